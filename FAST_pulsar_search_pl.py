@@ -134,7 +134,7 @@ import traceback
 class Observation(object):
     counter = 0  # 用于控制只打印第一个实例信息
 
-    def __init__(self, file_name, data_type="filterbank"):
+    def __init__(self, file_name, data_type="filterbank", header=None):
         self.__class__.counter += 1
         self.show_log = (self.__class__.counter == 1)
 
@@ -145,7 +145,12 @@ class Observation(object):
         self.file_basename, self.file_extension = os.path.splitext(self.file_nameonly)
         self.file_buffer_copy = ""
 
-        if data_type == "filterbank":
+        if header is not None:
+            # 已由 read_data_headers 读出（或从缓存中取出）的文件头
+            for key, value in header.items():
+                setattr(self, key, value)
+
+        elif data_type == "filterbank":
             if self.show_log:
                 print("\r正在读取filterbank文件信息...", end="", flush=True)
             try:
@@ -220,6 +225,8 @@ class Observation(object):
                     self.MJD_int = object_file.specinfo.mjd
                     self.MJD_sec = object_file.specinfo.secs
                     self.Tstart_MJD = self.MJD_int + np.float64(self.MJD_sec / 86400.)
+                    # 文件在整个观测中的起始采样点（NSUBOFFS × NSBLK），拆分文件的 STT_* 相同，偏移以此为准
+                    self.start_sample = int(object_file.specinfo.start_subint[0]) * int(object_file.specinfo.spectra_per_subint)
                     self.nchan = object_file.specinfo.num_channels
                     self.observer = object_file.specinfo.observer
                     self.project = object_file.specinfo.project_id
@@ -252,12 +259,111 @@ class Observation(object):
                     except Exception as e:
                         print(f"移动出错文件失败: {e}")
                         
+class ObservationSet(object):
+    """
+    同一次指向被拆分成的多个文件（FAST 的 *_0001.fits ... *_NNNN.fits），作为一个整体观测。
+    按起始时间排序，检查文件之间是否连续，并给出全局采样点数、每个文件的采样点偏移和大小。
+    """
+    def __init__(self, list_observations, tolerance_samples=1):
+        self.observations = sorted(list_observations, key=lambda obs: (obs.Tstart_MJD, getattr(obs, 'start_sample', 0), obs.file_nameonly))
+        first = self.observations[0]
+        self.n_files = len(self.observations)
+        self.nchan = first.nchan
+        self.nbits = first.nbits
+        self.t_samp_s = first.t_samp_s
+        self.chanbw_MHz = first.chanbw_MHz
+        self.bw_MHz = first.bw_MHz
+        self.freq_central_MHz = first.freq_central_MHz
+        self.freq_high_MHz = first.freq_high_MHz
+        self.freq_low_MHz = first.freq_low_MHz
+        self.Tstart_MJD = first.Tstart_MJD
+        self.source_name = getattr(first, 'source_name', '')
+
+        self.list_problems = []
+        for obs in self.observations[1:]:
+            for attr in ('nchan', 'nbits', 't_samp_s', 'chanbw_MHz', 'freq_central_MHz'):
+                if not np.isclose(np.float64(getattr(obs, attr)), np.float64(getattr(first, attr)), rtol=1e-9, atol=0):
+                    self.list_problems.append(f"{obs.file_nameonly} 的 {attr}={getattr(obs, attr)} 与 {first.file_nameonly} 的 {getattr(first, attr)} 不一致")
+
+        # 每个文件的起始采样点（以第一个文件的起点为 0，由文件头的 NSUBOFFS 或 MJD 换算），以及与前一个文件末尾之间的间隔
+        self.list_offsets = []
+        self.list_N_samples = []
+        self.list_gaps = []
+        list_header_offsets = get_observation_offsets(self.observations, self.t_samp_s)
+        for k, obs in enumerate(self.observations):
+            offset = list_header_offsets[k]
+            N_samples = int(obs.N_samples)
+            if k > 0:
+                gap = offset - (self.list_offsets[-1] + self.list_N_samples[-1])
+                self.list_gaps.append(gap)
+                if abs(gap) > tolerance_samples:
+                    kind = "间隔" if gap > 0 else "重叠"
+                    self.list_problems.append(f"{self.observations[k-1].file_nameonly} 与 {obs.file_nameonly} 之间{kind} {abs(gap)} 个采样点（{abs(gap) * self.t_samp_s:.3f} 秒）")
+                else:
+                    # 在容差内视为连续，按前一个文件的末尾计算偏移，避免舍入误差累积
+                    offset = self.list_offsets[-1] + self.list_N_samples[-1]
+            self.list_offsets.append(offset)
+            self.list_N_samples.append(N_samples)
+        self.list_file_sizes = [os.path.getsize(obs.file_abspath) for obs in self.observations]
+
+        self.N_samples_data = sum(self.list_N_samples)                        # 各文件实际的采样点数之和
+        self.N_samples = self.list_offsets[-1] + self.list_N_samples[-1]      # 从第一个文件开始到最后一个文件结束的采样点数（含间隔）
+        self.T_obs_s = self.N_samples * self.t_samp_s
+        self.total_bytes = sum(self.list_file_sizes)
+        self.flag_continuous = len(self.list_problems) == 0
+
+    def __len__(self):
+        return self.n_files
+
+    def __iter__(self):
+        return iter(self.observations)
+
+    def __getitem__(self, index):
+        return self.observations[index]
+
+    def get_file_index(self, sample):
+        """全局采样点所在的文件序号（落在间隔中时返回之后的文件）"""
+        for k in range(self.n_files):
+            if sample < self.list_offsets[k] + self.list_N_samples[k]:
+                return k
+        return self.n_files - 1
+
+    def print_summary(self):
+        print_log(f"观测文件 {self.n_files} 个，共 {self.N_samples} 个采样点（{format_execution_time(self.T_obs_s)}），{self.total_bytes / 1.0e9:.2f} GB", color=colors.OKGREEN)
+        if self.flag_continuous:
+            print_log("文件在时间上连续", color=colors.OKGREEN)
+        for problem in self.list_problems:
+            print_log(f"警告：{problem}", color=colors.WARNING)
+
 class SurveyConfiguration(object):
         def __init__(self, config_filename):
                 self.config_filename = config_filename
                 self.list_datafiles = []
-                self.list_survey_configuration_ordered_params = ['OBSNAME',"SOURCE_NAME",'SEARCH_LABEL', 'DATA_TYPE','IF_BARY','IF_PYSOLATOR','RA','DEC','POOL_NUM ', 'ROOT_WORKDIR', 'PRESTO', 'PRESTO_GPU','IF_DDPLAN', 'DM_MIN', 'DM_MAX','DM_STEP', 'DM_COHERENT_DEDISPERSION', 'N_SUBBANDS', 'PERIOD_TO_SEARCH_MIN', 'PERIOD_TO_SEARCH_MAX', 'LIST_SEGMENTS', 'RFIFIND_TIME', 'RFIFIND_CHANS_TO_ZAP', 'RFIFIND_TIME_INTERVALS_TO_ZAP', 'IGNORECHAN_LIST', 'ZAP_ISOLATED_PULSARS_FROM_FFTS', 'ZAP_ISOLATED_PULSARS_MAX_HARM', 'FLAG_ACCELERATION_SEARCH', 'ACCELSEARCH_LIST_ZMAX', 'ACCELSEARCH_NUMHARM', 'FLAG_JERK_SEARCH', 'JERKSEARCH_ZMAX', 'JERKSEARCH_WMAX', 'JERKSEARCH_NUMHARM', 'SIFTING_FLAG_REMOVE_DUPLICATES', 'SIFTING_FLAG_REMOVE_DM_PROBLEMS', 'SIFTING_FLAG_REMOVE_HARMONICS', 'SIFTING_MINIMUM_NUM_DMS', 'SIFTING_MINIMUM_DM', 'SIFTING_SIGMA_THRESHOLD', 'FLAG_FOLD_KNOWN_PULSARS', 'FLAG_FOLD_TIMESERIES', 'FLAG_FOLD_RAWDATA','FLAG_NUM', 'RFIFIND_FLAGS', 'PREPDATA_FLAGS', 'PREPSUBBAND_FLAGS', 'REALFFT_FLAGS', 'REDNOISE_FLAGS', 'ACCELSEARCH_FLAGS', 'ACCELSEARCH_GPU_FLAGS', 'ACCELSEARCH_JERK_FLAGS', 'PREPFOLD_FLAGS', 'FLAG_SINGLEPULSE_SEARCH', 'SINGLEPULSE_SEARCH_FLAGS', 'USE_CUDA', 'CUDA_IDS', 'NUM_SIMULTANEOUS_JERKSEARCHES', 'NUM_SIMULTANEOUS_PREPFOLDS', 'NUM_SIMULTANEOUS_PREPSUBBANDS', 'MAX_SIMULTANEOUS_DMS_PER_PREPSUBBAND', 'FAST_BUFFER_DIR', 'FLAG_KEEP_DATA_IN_BUFFER_DIR', 'FLAG_REMOVE_FFTFILES', 'FLAG_REMOVE_DATFILES_OF_SEGMENTS', 'STEP_RFIFIND', 'STEP_ZAPLIST', 'STEP_DEDISPERSE', 'STEP_REALFFT', 'STEP_PERIODICITY_SEARCH', 'STEP_SIFTING', 'STEP_FOLDING', 'STEP_SINGLEPULSE_SEARCH']
+                self.list_survey_configuration_ordered_params = ['OBSNAME',"SOURCE_NAME",'SEARCH_LABEL', 'DATA_TYPE','IF_BARY','IF_PYSOLATOR','RA','DEC','POOL_NUM ', 'ROOT_WORKDIR', 'PRESTO', 'PRESTO_GPU','IF_DDPLAN', 'DM_MIN', 'DM_MAX','DM_STEP', 'DM_COHERENT_DEDISPERSION', 'N_SUBBANDS', 'PERIOD_TO_SEARCH_MIN', 'PERIOD_TO_SEARCH_MAX', 'LIST_SEGMENTS', 'RFIFIND_TIME', 'RFIFIND_CHANS_TO_ZAP', 'RFIFIND_TIME_INTERVALS_TO_ZAP', 'IGNORECHAN_LIST', 'ZAP_ISOLATED_PULSARS_FROM_FFTS', 'ZAP_ISOLATED_PULSARS_MAX_HARM', 'FLAG_ACCELERATION_SEARCH', 'ACCELSEARCH_LIST_ZMAX', 'ACCELSEARCH_NUMHARM', 'FLAG_JERK_SEARCH', 'JERKSEARCH_ZMAX', 'JERKSEARCH_WMAX', 'JERKSEARCH_NUMHARM', 'SIFTING_FLAG_REMOVE_DUPLICATES', 'SIFTING_FLAG_REMOVE_DM_PROBLEMS', 'SIFTING_FLAG_REMOVE_HARMONICS', 'SIFTING_MINIMUM_NUM_DMS', 'SIFTING_MINIMUM_DM', 'SIFTING_SIGMA_THRESHOLD', 'FLAG_FOLD_KNOWN_PULSARS', 'FLAG_FOLD_TIMESERIES', 'FLAG_FOLD_RAWDATA','FLAG_NUM', 'RFIFIND_FLAGS', 'PREPDATA_FLAGS', 'PREPSUBBAND_FLAGS', 'REALFFT_FLAGS', 'REDNOISE_FLAGS', 'ACCELSEARCH_FLAGS', 'ACCELSEARCH_GPU_FLAGS', 'ACCELSEARCH_JERK_FLAGS', 'PREPFOLD_FLAGS', 'FLAG_SINGLEPULSE_SEARCH', 'SINGLEPULSE_SEARCH_FLAGS', 'USE_CUDA', 'CUDA_IDS', 'NUM_SIMULTANEOUS_JERKSEARCHES', 'NUM_SIMULTANEOUS_PREPFOLDS', 'NUM_SIMULTANEOUS_PREPSUBBANDS', 'MAX_SIMULTANEOUS_DMS_PER_PREPSUBBAND', 'FAST_BUFFER_DIR', 'FLAG_KEEP_DATA_IN_BUFFER_DIR', 'FLAG_REMOVE_FFTFILES', 'FLAG_REMOVE_DATFILES_OF_SEGMENTS', 'STEP_RFIFIND', 'STEP_ZAPLIST', 'STEP_DEDISPERSE', 'STEP_REALFFT', 'STEP_PERIODICITY_SEARCH', 'STEP_SIFTING', 'STEP_FOLDING', 'STEP_SINGLEPULSE_SEARCH', 'FLAG_DATAFLOW', 'FLAG_JOB_STORE', 'TASK_MAX_RETRIES', 'TASK_RETRY_BACKOFF', 'CPU_BUDGET', 'MEM_BUDGET_GB', 'EXECUTION_BACKEND', 'QUEUE_HEARTBEAT_TIMEOUT', 'RFIFIND_FILES_PER_JOB', 'FLAG_REMOVE_DATFILES', 'LIFECYCLE_ARCHIVE_DIR', 'STAGING_DIR', 'STAGING_CAPACITY_GB', 'BUFFER_COPY_THREADS', 'FFT_ENGINE', 'DEDISPERSE_ENGINE', 'BARY_ENGINE', 'DEORB_TEMPLATE_BANK', 'SINGLEPULSE_ENGINE', 'DDPLAN_ENGINE', 'PREPSUBBAND_SUBDM_STEP', 'FLAG_REPAIR_DEDISPERSION']
                 self.dict_survey_configuration = {}
+                # 较新的参数在旧配置文件中可能不存在，先给出默认值
+                self.flag_dataflow                         = 0
+                self.flag_job_store                        = 0
+                self.task_max_retries                      = 2
+                self.task_retry_backoff                    = 30.0
+                self.cpu_budget                            = 0
+                self.mem_budget_gb                         = 0.0
+                self.execution_backend                     = "local"
+                self.queue_heartbeat_timeout               = 300.0
+                self.rfifind_files_per_job                 = 0
+                self.flag_remove_datfiles                  = 0
+                self.lifecycle_archive_dir                 = ""
+                self.staging_dir                           = ""
+                self.staging_capacity_gb                   = 0.0
+                self.buffer_copy_threads                   = 4
+                self.fft_engine                            = "presto"
+                self.dedisperse_engine                     = "presto"
+                self.bary_engine                           = "presto"
+                self.deorb_template_bank                   = ""
+                self.singlepulse_engine                    = "presto"
+                self.ddplan_engine                         = "presto"
+                self.prepsubband_subdm_step                = 0.0
+                self.flag_repair_dedispersion              = 0
                 config_file = open(config_filename, "r" )
 
                 for line in config_file:
@@ -366,6 +472,28 @@ class SurveyConfiguration(object):
                         elif key == "STEP_SIFTING":                         self.flag_step_sifting                     = int(self.dict_survey_configuration[key])
                         elif key == "STEP_FOLDING":                         self.flag_step_folding                     = int(self.dict_survey_configuration[key])
                         elif key == "STEP_SINGLEPULSE_SEARCH":              self.flag_step_singlepulse_search          = int(self.dict_survey_configuration[key])
+                        elif key == "FLAG_DATAFLOW":                        self.flag_dataflow                         = int(self.dict_survey_configuration[key])
+                        elif key == "FLAG_JOB_STORE":                       self.flag_job_store                        = int(self.dict_survey_configuration[key])
+                        elif key == "TASK_MAX_RETRIES":                     self.task_max_retries                      = int(self.dict_survey_configuration[key])
+                        elif key == "TASK_RETRY_BACKOFF":                   self.task_retry_backoff                    = float(self.dict_survey_configuration[key])
+                        elif key == "CPU_BUDGET":                           self.cpu_budget                            = int(self.dict_survey_configuration[key])
+                        elif key == "MEM_BUDGET_GB":                        self.mem_budget_gb                         = float(self.dict_survey_configuration[key])
+                        elif key == "EXECUTION_BACKEND":                    self.execution_backend                     = self.dict_survey_configuration[key].strip('"').lower()
+                        elif key == "QUEUE_HEARTBEAT_TIMEOUT":              self.queue_heartbeat_timeout               = float(self.dict_survey_configuration[key])
+                        elif key == "RFIFIND_FILES_PER_JOB":                self.rfifind_files_per_job                 = int(self.dict_survey_configuration[key])
+                        elif key == "FLAG_REMOVE_DATFILES":                 self.flag_remove_datfiles                  = int(self.dict_survey_configuration[key])
+                        elif key == "LIFECYCLE_ARCHIVE_DIR":                self.lifecycle_archive_dir                 = self.dict_survey_configuration[key].strip('"')
+                        elif key == "STAGING_DIR":                          self.staging_dir                           = self.dict_survey_configuration[key].strip('"')
+                        elif key == "STAGING_CAPACITY_GB":                  self.staging_capacity_gb                   = float(self.dict_survey_configuration[key])
+                        elif key == "BUFFER_COPY_THREADS":                  self.buffer_copy_threads                   = int(self.dict_survey_configuration[key])
+                        elif key == "FFT_ENGINE":                           self.fft_engine                            = self.dict_survey_configuration[key].strip('"').lower()
+                        elif key == "DEDISPERSE_ENGINE":                    self.dedisperse_engine                     = self.dict_survey_configuration[key].strip('"').lower()
+                        elif key == "BARY_ENGINE":                          self.bary_engine                           = self.dict_survey_configuration[key].strip('"').lower()
+                        elif key == "DEORB_TEMPLATE_BANK":                  self.deorb_template_bank                   = self.dict_survey_configuration[key].strip('"')
+                        elif key == "SINGLEPULSE_ENGINE":                   self.singlepulse_engine                    = self.dict_survey_configuration[key].strip('"').lower()
+                        elif key == "DDPLAN_ENGINE":                        self.ddplan_engine                         = self.dict_survey_configuration[key].strip('"').lower()
+                        elif key == "PREPSUBBAND_SUBDM_STEP":               self.prepsubband_subdm_step                = float(self.dict_survey_configuration[key])
+                        elif key == "FLAG_REPAIR_DEDISPERSION":             self.flag_repair_dedispersion              = int(self.dict_survey_configuration[key])
 
                 config_file.close()
                 self.log_filename = "%s.log" % (self.search_label)
@@ -434,39 +562,16 @@ elif obsname != "":
                 exit()
             config.folder_datafiles           = os.path.dirname(os.path.abspath(obsname)) 
 
-config.list_datafiles_abspath = [os.path.join(config.folder_datafiles, x) for x in config.list_datafiles]  #每个文件的绝对路径
-config.list_Observations = [Observation(x, config.data_type) for x in config.list_datafiles_abspath]  #生成类属性
-config.file_common_birdies = os.path.join(config.root_workdir, "common_birdies.txt")
-time.sleep(1)
-
-##重要的变量
-obsname = config.obsname       #决定搜寻的文件
-if obsname == "":
-    print_log(f'obsname为空，请在{config_filename}指定文件',color=colors.ERROR)
-    exit()
-elif obsname != "":
-    # 通过 glob 模块获取所有匹配的观测文件
-    config.list_datafiles = [os.path.basename(x) for x in glob.glob(obsname)]
-    if len(config.list_datafiles) == 0:
-        print_log("错误: 未找到观测文件！请确保文件名正确无误。",color=colors.ERROR)
-        exit()
-    elif len(config.list_datafiles) >= 1:
-        # 如果找到一个或多个文件，检查每个文件是否存在以及文件大小是否为零
-        for f in config.list_datafiles:
-            if not os.path.exists(f):
-                print_log(f"错误: 文件{f}不存在！可能是符号链接损坏。" ,color=colors.ERROR)
-                exit()
-            elif os.path.getsize(f) == 0:
-                print_log(f"错误:文件{f}的大小为 0！" ,color=colors.ERROR)
-                exit()
-            config.folder_datafiles           = os.path.dirname(os.path.abspath(obsname)) 
-
 config.list_datafiles_abspath = [os.path.join(config.folder_datafiles, x) for x in config.list_datafiles]  #每个文件的绝对路径
 # sorted_files = sorted(config.list_datafiles_abspath)
 # config.list_Observations = [Observation(sorted_files[0], config.data_type)]
 
 
-config.list_Observations = [Observation(x, config.data_type) for x in config.list_datafiles_abspath]  #生成类属性
+# 文件头只读一次，并缓存在 00_IFOK/header_cache.json 中（按路径、大小和修改时间判断是否需要重新读取）
+list_headers = read_data_headers(config.list_datafiles_abspath, config.data_type, os.path.join(config.root_workdir, '00_IFOK', 'header_cache.json'), n_threads=config.pool_num)
+config.list_Observations = [Observation(x, config.data_type, header) for x, header in zip(config.list_datafiles_abspath, list_headers)]  #生成类属性
+config.observation_set = ObservationSet(config.list_Observations)  #多个文件组成的整体观测（全局采样点数、每个文件的偏移）
+config.list_Observations = config.observation_set.observations   #按起始时间排序
 config.file_common_birdies = os.path.join(config.root_workdir, "common_birdies.txt")
 
 #重要的变量
@@ -503,6 +608,28 @@ if ifbary == 1:
 
 #文件夹
 ifok_dir = os.path.join(workdir,'00_IFOK')
+if config.flag_job_store == 1:
+    # 任务状态记录在 00_IFOK/jobs.sqlite 中，可用 jobdb.py 查询或使某个阶段失效
+    set_job_store(os.path.join(ifok_dir,'jobs.sqlite'))
+    print_log(f"任务状态数据库：{os.path.join(ifok_dir,'jobs.sqlite')}",color=colors.OKBLUE)
+# 命令失败（返回码非 0 或预期输出缺失/为空）时按退避时间重试
+set_task_retry(config.task_max_retries, config.task_retry_backoff)
+# 按 -ncpus 和估计内存控制同时运行的任务
+set_resource_budget(config.cpu_budget, config.mem_budget_gb)
+set_obs_params(config.observation_set.nchan, config.observation_set.N_samples, config.nsubbands)
+# queue：任务写入 00_IFOK/queue.sqlite，其他节点可运行 queue_worker.py 一起执行
+set_execution_backend(config.execution_backend, os.path.join(ifok_dir,'queue.sqlite'), config.queue_heartbeat_timeout)
+# 中间文件在最后一个使用者完成后删除（或移动到 LIFECYCLE_ARCHIVE_DIR），折叠脚本 script_fold_ts.txt 用到的 .dat 始终保留
+# 回收的文件记录在 00_IFOK/lifecycle_reclaimed.txt，修复模式不会把它们当作缺失重新去色散
+set_lifecycle([suffix for suffix, flag in [('.fft', config.flag_remove_fftfiles), ('.dat', config.flag_remove_datfiles)] if flag == 1], config.lifecycle_archive_dir,
+              os.path.join(ifok_dir,'lifecycle_reclaimed.txt'))
+# 每个 DM 的 FFT → 去红噪声 → 消噪 → 搜寻在内存盘（如 /dev/shm）中完成，只写回 ACCEL 结果
+set_staging(config.staging_dir, config.staging_capacity_gb)
+
+def collect_intermediates(stage_name):
+    n_removed, bytes_freed = lifecycle_collect()
+    if n_removed > 0:
+        print_log(f"{stage_name}完成，回收中间文件 {n_removed} 个，释放 {bytes_freed / 1.0e9:.2f} GB",color=colors.OKGREEN)
 #打印文件总信息
 
 sifting.sigma_threshold = config.sifting_sigma_threshold
@@ -511,7 +638,20 @@ print_log("main:: SIFTING.sigma_threshold = ", sifting.sigma_threshold, color=co
 LOG_dir = os.path.join(config.root_workdir, "LOG")
 makedir(LOG_dir)
 
-if config.if_ddplan == 1:
+if config.if_ddplan == 1 and config.ddplan_engine == 'native':
+    print_log("\n ====================去色散计划（内置）：  ====================== \n",color=colors.HEADER)
+    list_DDplan_scheme = get_DDplan_scheme_native(config.dm_min,
+                                                  config.dm_max,
+                                                  config.dm_coherent_dedispersion,
+                                                  config.max_simultaneous_dms_per_prepsubband,
+                                                  config.list_Observations[0].freq_central_MHz,
+                                                  config.list_Observations[0].bw_MHz,
+                                                  config.list_Observations[0].nchan,
+                                                  config.nsubbands,
+                                                  config.list_Observations[0].t_samp_s,
+                                                  cache_path=os.path.join(config.root_workdir, '00_IFOK', 'ddplan_cache.json'),
+                                                  out_file=os.path.join(LOG_dir, 'ddplan_native.txt'))
+elif config.if_ddplan == 1:
     print_log("\n ====================DDplan去色散计划：  ====================== \n",color=colors.HEADER)
     list_DDplan_scheme = get_DDplan_scheme(config.list_Observations[0].file_abspath,
                                             LOG_dir,
@@ -528,21 +668,8 @@ if config.if_ddplan == 1:
                                             config.list_Observations[0].t_samp_s)
 else:
     print_log("\n ====================自定义去色散计划：  ====================== \n",color=colors.HEADER)
-    list_DDplan_scheme = []
-    ddpl = config.dm_step
-    print(ddpl)
-    for ddpl_value in ddpl:
-        loodm, highdm, ddm = ddpl_value
-        ndms = int((highdm - loodm) // ddm)
-
-        scheme = {
-            'loDM': loodm,
-            'highDM': highdm,
-            'dDM': ddm,
-            'downsamp': 1,  
-            'num_DMs': ndms
-        }
-        list_DDplan_scheme.append(scheme)
+    print(config.dm_step)
+    list_DDplan_scheme = get_custom_DD_schemes(config.dm_step)
 print_log(list_DDplan_scheme)
 time.sleep(2)
 
@@ -550,6 +677,7 @@ time.sleep(2)
 total_files = len(config.list_Observations)
 need_copy, skipped, no_space = [], [], []
 buffer_valid = False
+buffer_copy_handle = None
 
 # 检查快速缓冲目录是否可用
 if config.fast_buffer_dir:
@@ -560,18 +688,22 @@ if config.fast_buffer_dir:
         print_log(f"警告：快速缓冲目录 '{config.fast_buffer_dir}' 不存在！", color=colors.WARNING)
         config.fast_buffer_dir = ""
 
-# 分类统计文件
+# 分类统计文件：清单中记录的源文件大小和修改时间一致才复用，未完成的 .part 文件会接着复制
 if buffer_valid:
+    dict_buffer_manifest = load_buffer_manifest(config.fast_buffer_dir)
     for obs in config.list_Observations:
         dst_path = os.path.join(config.fast_buffer_dir, obs.file_nameonly)
-        if not os.path.exists(dst_path) or os.path.getsize(dst_path) != os.path.getsize(obs.file_abspath):
-            if os.path.getsize(obs.file_abspath) <= buffer_free:
+        if not check_buffer_copy_done(obs.file_abspath, dst_path, dict_buffer_manifest):
+            size_to_copy = os.path.getsize(obs.file_abspath)
+            if os.path.isfile(dst_path + '.part'):
+                size_to_copy -= os.path.getsize(dst_path + '.part')
+            if size_to_copy <= buffer_free:
                 need_copy.append(obs)
-                buffer_free -= os.path.getsize(obs.file_abspath)
+                buffer_free -= size_to_copy
             else:
                 no_space.append(obs.file_nameonly)
         else:
-            skipped.append(obs.file_nameonly)
+            skipped.append(obs)
 
 # 统一打印操作摘要
 if buffer_valid:
@@ -582,28 +714,32 @@ if buffer_valid:
         for obs in need_copy:
             print(f"  - {obs.file_nameonly}")
     if skipped:
-        print_log(f"\n已跳过 {len(skipped)} 个文件（已存在且大小匹配）:", color=colors.OKGREEN)
-        for name in skipped:
-            print(f"  - {name}")
+        print_log(f"\n已跳过 {len(skipped)} 个文件（已复制且校验通过）:", color=colors.OKGREEN)
+        for obs in skipped:
+            print(f"  - {obs.file_nameonly}")
+            obs.file_abspath = os.path.join(config.fast_buffer_dir, obs.file_nameonly)
     if no_space:
         print_log(f"\n警告：{len(no_space)} 个文件因空间不足未复制！", color=colors.WARNING)
 
-    # 批量复制文件
+    # 后台并行复制，按起始时间顺序进行；分段 rfifind 等任务会等待各自的文件复制完成后立即开始
     if need_copy:
-        print("\n开始批量复制...")
+        list_copy_pairs = []
         for obs in need_copy:
-            dst_path = shutil.copy(obs.file_abspath, config.fast_buffer_dir)
+            dst_path = os.path.join(config.fast_buffer_dir, obs.file_nameonly)
+            # 旧版本复制不完整的文件不能复用，删除后重新复制，避免被误认为已复制完成
+            if os.path.lexists(dst_path):
+                os.remove(dst_path)
+            list_copy_pairs.append((obs.file_abspath, dst_path))
             obs.file_abspath = dst_path  # 更新路径
-            print(f"  已完成: {obs.file_nameonly}")
-        print("所有文件复制完成！")
+        print_log(f"开始后台复制 {len(need_copy)} 个文件（{config.buffer_copy_threads} 线程）...", color=colors.OKGREEN)
+        buffer_copy_handle = start_buffer_copy(list_copy_pairs, config.fast_buffer_dir, config.buffer_copy_threads)
 else:
     print_log("未使用快速缓冲目录，处理速度可能受影响。", color=colors.WARNING)
 
-data_len = 0
-for i, obs in enumerate(config.list_Observations):
-    data_len += obs.T_obs_s
-formatted_time = format_execution_time(obs.T_obs_s)
-print_log(f" {data_path} ({formatted_time})", color=colors.OKGREEN)
+# 全长度时间序列按第一个文件开始到最后一个文件结束计算（文件之间的间隔会被补齐）
+data_len = config.observation_set.T_obs_s
+print_log(f" {data_path} ({format_execution_time(data_len)})", color=colors.OKGREEN)
+config.observation_set.print_summary()
 
 
 time.sleep(1)
@@ -613,13 +749,32 @@ num_DMs = 0
 for j in range(len(list_DDplan_scheme)):
         num_DMs = num_DMs + list_DDplan_scheme[j]['num_DMs']
         
-flag_enough_disk_space = False
-flag_enough_disk_space = check_if_enough_disk_space(config.root_workdir, num_DMs, data_len, config.list_Observations[0].t_samp_s, config.flag_remove_fftfiles)
+# 去轨道调制模板库的每个模板都写出一份完整的时间序列
+n_deorb_templates = 1
+if config.ifpysolator == 1 and config.deorb_template_bank and os.path.isfile(os.path.join(workdir, config.deorb_template_bank)):
+    n_deorb_templates = len(read_deorb_template_bank(os.path.join(workdir, config.deorb_template_bank)))
+
+# 按流程逐步估计磁盘占用（含质心修正、去轨道调制的副本和去红噪声时的临时文件），与可用空间比较峰值
+dict_storage_plan_args = {'list_DDplan_scheme': list_DDplan_scheme,
+                          'N_samples': config.observation_set.N_samples,
+                          't_samp_s': config.list_Observations[0].t_samp_s,
+                          'nchan': config.observation_set.nchan,
+                          'rfifind_time_s': float(config.rfifind_time),
+                          'n_zmax': len(config.accelsearch_list_zmax) + (1 if config.flag_jerk_search == 1 else 0),
+                          'n_pool': n_pool,
+                          'ifbary': config.ifbary,
+                          'ifdeorb': config.ifpysolator,
+                          'flag_dataflow': config.flag_dataflow,
+                          'flag_remove_fftfiles': config.flag_remove_fftfiles,
+                          'fold_num': 2*fold_num if (config.flag_fold_timeseries == 1 and config.flag_fold_rawdata == 1) else fold_num,
+                          'flag_singlepulse': config.flag_singlepulse_search,
+                          'n_deorb_templates': n_deorb_templates}
+print_log(f"DM 试验数：{num_DMs}，观测时长 {data_len:.1f} s")
+flag_enough_disk_space = check_storage_plan(config.root_workdir, dict_storage_plan_args, existing_bytes=get_pipeline_output_bytes(config.root_workdir))
 
 # 如果磁盘空间不足，打印错误信息并退出程序
 if flag_enough_disk_space == False:
-        print_log(f"错误：磁盘空间不足！请释放空间或更改工作目录。",color=colors.ERROR)
-        print("> 提示：为了最小化磁盘使用，请确保在配置文件中将 FLAG_REMOVE_FFTFILES 和 FLAG_REMOVE_DATFILES_OF_SEGMENTS 保留为默认值 1。")
+        print_log(f"错误：磁盘空间不足！请释放空间、更改工作目录或按上面的建议修改配置。",color=colors.ERROR)
         exit()
 time.sleep(1)
 
@@ -664,9 +819,13 @@ basename = f'rfi{timebin_rfi}s'
 mask_file_path = f"{rfifind_masks_dir}/rfi{timebin_rfi}s_rfifind.mask"
 ignorechan_list = config.ignorechan_list
 
+# 分段 rfifind：每 RFIFIND_FILES_PER_JOB 个文件运行一个 rfifind，并行后合并掩模（合并结果没有 .ps 和 .rfi）
+flag_rfifind_parts = config.rfifind_files_per_job > 0 and len(config.observation_set) > config.rfifind_files_per_job
+list_rfifind_suffixes = ["bytemask", "inf", "mask", "stats"] if flag_rfifind_parts else ["bytemask", "inf", "mask", "ps", "rfi", "stats"]
+
 time.sleep(0.2)
-def check_rfifind_outfiles(out_dir, basename):
-        for suffix in ["bytemask", "inf", "mask", "ps", "rfi", "stats"]:
+def check_rfifind_outfiles(out_dir, basename, list_suffixes=list_rfifind_suffixes):
+        for suffix in list_suffixes:
                 file_to_check = "%s/%s_rfifind.%s" % (out_dir, basename, suffix)
                 if not os.path.exists(file_to_check):
                         print("ERROR: file %s not found!" % (file_to_check))
@@ -693,20 +852,52 @@ elif not flag_mask_present and config.flag_step_rfifind == 1:
     print_log(f"正在为观测源 {sourcename} 创建 rfifind 掩模文件...\n")
 
     sys.stdout.flush()
-    make_rfifind_mask(
-        config.list_Observations[i].file_abspath,
-        rfifind_masks_dir,
-        LOG_dir,
-        LOG_basename,
-        config.rfifind_time,
-        config.rfifind_time_intervals_to_zap,
-        config.rfifind_chans_to_zap,
-        config.ignorechan_list,
-        config.rfifind_flags,
-        config.presto_env,
-        search_type=sourcename,
-        obsname=obsname,
-    )
+    if flag_rfifind_parts:
+        obs_set = config.observation_set
+        n_per_job = config.rfifind_files_per_job
+        list_groups = [list(range(k, min(k + n_per_job, len(obs_set)))) for k in range(0, len(obs_set), n_per_job)]
+        list_part_offsets = [obs_set.list_offsets[group[0]] for group in list_groups]
+        list_part_N_samples = [obs_set.list_offsets[group[-1]] + obs_set.list_N_samples[group[-1]] - obs_set.list_offsets[group[0]] for group in list_groups]
+        print_log(f"分段 rfifind：{len(obs_set)} 个文件分为 {len(list_groups)} 段（每段 {n_per_job} 个文件）并行运行，之后合并掩模", color=colors.OKBLUE)
+
+        dir_rfifind_parts = os.path.join(rfifind_masks_dir, 'parts')
+        LOG_dir01 = os.path.join(LOG_dir, '01_RFIFIND')
+        makedir(dir_rfifind_parts, LOG_dir01)
+        rfifind_cmd_list, ifok_list, log_list, list_part_basenames = rfifind_parts2cmd(
+            [[obs_set[j].file_abspath for j in group] for group in list_groups],
+            dir_rfifind_parts,
+            LOG_dir01,
+            config.rfifind_time,
+            config.rfifind_chans_to_zap,
+            config.ignorechan_list,
+            config.rfifind_flags)
+        # 复制线程运行时不能 fork，进程池会先等待后台复制结束
+        pool(n_pool,'rfifind',rfifind_cmd_list,ifok_list,log_list,work_dir = dir_rfifind_parts)
+
+        list_missing = [x for x in ifok_list if not os.path.exists(x)]
+        if list_missing:
+            print_log(f"错误：{len(list_missing)} 段 rfifind 没有生成掩模，例如 {list_missing[0]}，请查看 {LOG_dir01} 中的日志", color=colors.ERROR)
+            exit()
+        merge_rfifind_parts(list_part_basenames, list_part_offsets, list_part_N_samples, rfifind_masks_dir, basename, config.rfifind_time_intervals_to_zap)
+        ps2png(os.path.join(dir_rfifind_parts,'*ps'))
+    else:
+        # 对全部文件运行一个 rfifind，需要等待全部文件复制完成
+        wait_buffer_copy(buffer_copy_handle)
+        buffer_copy_handle = None
+        make_rfifind_mask(
+            config.list_Observations[i].file_abspath,
+            rfifind_masks_dir,
+            LOG_dir,
+            LOG_basename,
+            config.rfifind_time,
+            config.rfifind_time_intervals_to_zap,
+            config.rfifind_chans_to_zap,
+            config.ignorechan_list,
+            config.rfifind_flags,
+            config.presto_env,
+            search_type=sourcename,
+            obsname=obsname,
+        )
 
 # 情况 3 和 4：掩模已存在
 else:
@@ -714,24 +905,19 @@ else:
     if config.flag_step_rfifind == 0:
         print_log("警告：STEP_RFIFIND = 0，将跳过该步骤，默认当前掩模文件可用。\n", color=colors.WARNING)
 
+# 之后的步骤需要全部文件复制完成（分段 rfifind 的进程池启动前已等待复制结束，这里不会重复等待）
+wait_buffer_copy(buffer_copy_handle)
+buffer_copy_handle = None
+
 # 如果配置允许 rfifind，评估掩蔽频率通道比例
 if config.flag_step_rfifind == 1:
-    masked_info_file = os.path.join(rfifind_masks_dir,"rfifind_mask_info.json")
     print("正在检查被掩蔽的频带比例...", end=' ')
     sys.stdout.flush()
-    
-    if os.path.exists(masked_info_file):
-        with open(masked_info_file, 'r') as f:
-            info = json.load(f)
-            fraction_masked_channels = info.get("fraction_masked_channels", 0)
-        print("(已从缓存文件读取)", end=' ')
-    else:
-        mask = rfifind.rfifind(mask_file_path)
-        fraction_masked_channels = len(mask.mask_zap_chans) / mask.nchan
-        with open(masked_info_file, 'w') as f:
-            json.dump({"fraction_masked_channels": fraction_masked_channels}, f)
+    rfifind_summary = load_rfifind_summary(mask_file_path)   # 掩模摘要 *_rfifind_summary.npz，掩模变化后自动重建
+    fraction_masked_channels = rfifind_summary['fraction_masked_channels']
     mask_str = f"{fraction_masked_channels * 100:.2f}"
-    print_log(f"\nRFIFIND：被掩蔽的频率通道比例：{mask_str}%\n", masks=mask_str, color=colors.OKGREEN)
+    print_log(f"\nRFIFIND：被掩蔽的频率通道比例：{mask_str}%", masks=mask_str, color=colors.OKGREEN)
+    print_log(f"RFIFIND：被整体消除的时间段比例：{rfifind_summary['fraction_masked_ints'] * 100:.2f}%，bytemask 中被标记的比例：{rfifind_summary['bytemask_fraction'] * 100:.2f}%\n")
 
     if 0.5 < fraction_masked_channels <= 0.95:
         print_log(f"!!! 警告：{mask_str}% 的频带被掩蔽，比例偏高 !!!", color=colors.WARNING)
@@ -745,8 +931,7 @@ if config.flag_step_rfifind == 1:
 # 如果存在 weights 文件，提取并记录被忽略通道
 weights_file = mask_file_path.replace(".mask", ".weights")
 if os.path.exists(weights_file):
-    array_weights = np.loadtxt(weights_file, unpack=True, usecols=(0, 1,), skiprows=1)
-    ignored_indices = np.where(array_weights[1] == 0)[0]
+    ignored_indices = load_rfifind_summary(mask_file_path)['ignorechan']
     config.ignorechan_list = ",".join(map(str, ignored_indices))
     config.nchan_ignored = len(ignored_indices)
 
@@ -808,7 +993,7 @@ if config.flag_step_zaplist == 1:
 
 
         if config.zap_isolated_pulsars_from_ffts == 1:
-                fourier_bin_size =  1./config.list_Observations[0].T_obs_s  # 计算傅里叶变换的频率分辨率
+                fourier_bin_size =  1./config.observation_set.T_obs_s  # 计算傅里叶变换的频率分辨率（全长度时间序列）
                 zaplist_file = open(zaplist_filename, 'a')  # 打开 zaplist 文件以追加内容
 
                 zaplist_file.write("########################################\n")
@@ -841,7 +1026,20 @@ print("3) 去色散、去红噪声和周期性搜索：", end=' '); sys.stdout.f
 makedir(dir_dedispersion)  # 创建去色散目录
 
 
-if config.if_ddplan == 1:
+if config.if_ddplan == 1 and config.ddplan_engine == 'native':
+    print_log("\n ====================去色散计划（内置）：  ====================== \n",color=colors.HEADER)
+    list_DDplan_scheme = get_DDplan_scheme_native(config.dm_min,
+                                                  config.dm_max,
+                                                  config.dm_coherent_dedispersion,
+                                                  config.max_simultaneous_dms_per_prepsubband,
+                                                  config.list_Observations[i].freq_central_MHz,
+                                                  config.list_Observations[i].bw_MHz,
+                                                  config.list_Observations[i].nchan,
+                                                  config.nsubbands,
+                                                  config.list_Observations[i].t_samp_s,
+                                                  cache_path=os.path.join(config.root_workdir, '00_IFOK', 'ddplan_cache.json'),
+                                                  out_file=os.path.join(png_dir, 'ddplan_native.txt'))
+elif config.if_ddplan == 1:
     print_log("\n ====================DDplan去色散计划：  ====================== \n",color=colors.HEADER)
     list_DDplan_scheme = get_DDplan_scheme(config.list_Observations[i].file_abspath,
                                             png_dir,
@@ -858,21 +1056,8 @@ if config.if_ddplan == 1:
                                             config.list_Observations[i].t_samp_s)
 else:
     print_log("\n ====================自定义去色散计划：  ====================== \n",color=colors.HEADER)
-    list_DDplan_scheme = []
-    ddpl = config.dm_step
-    print(ddpl)
-    for ddpl_value in ddpl:
-        loodm, highdm, ddm = ddpl_value
-        ndms = int((highdm - loodm) // ddm)
-
-        scheme = {
-            'loDM': loodm,
-            'highDM': highdm,
-            'dDM': ddm,
-            'downsamp': 1,  
-            'num_DMs': ndms
-        }
-        list_DDplan_scheme.append(scheme)
+    print(config.dm_step)
+    list_DDplan_scheme = get_custom_DD_schemes(config.dm_step)
 
 # 遍历每个方案并生成 dm_list
 all_dm_ranges_str = []
@@ -907,7 +1092,82 @@ num_simultaneous_prepsubbands = config.num_simultaneous_prepsubbands
 other_flags_prepsubband = config.prepsubband_flags
 presto_env_prepsubband =  config.presto_env
 
-if N_schemes < num_simultaneous_prepsubbands:
+flag_partitioned = config.if_ddplan == 0 and config.dedisperse_engine == 'presto' and num_simultaneous_prepsubbands > 1
+if flag_partitioned:
+        # 自定义方案按 DM 连续拆分为多次 prepsubband 调用，走并行路径，DM 值和文件名不变
+        list_DDplan_scheme = partition_DD_schemes(list_DDplan_scheme, num_simultaneous_prepsubbands, config.max_simultaneous_dms_per_prepsubband, nchan, subbands)
+        N_schemes = len(list_DDplan_scheme)
+        print_log(f'自定义去色散方案拆分为 {len(list_DDplan_scheme)} 次 prepsubband 调用（{num_simultaneous_prepsubbands} 个并行）',color=colors.OKBLUE)
+
+if config.flag_repair_dedispersion == 1:
+        # 修复模式：只列一次去色散目录，按期望的采样点数找出缺失或不完整的 DM 试验，只重新运行连续缺失的 DM 段
+        # 已被中间文件生命周期删除或归档的 .dat（其 FFT、折叠、单脉冲等使用者均已完成）不算缺失
+        set_reclaimed = read_lifecycle_manifest(dict_lifecycle['manifest_file'], dir_dedispersion)
+        list_repair_schemes, n_missing, n_total = get_dedispersion_repair_schemes(dir_dedispersion, sourcename_mask, list_DDplan_scheme, sum(config.observation_set.list_N_samples), other_flags_prepsubband,
+                                                                                  set_reclaimed=set_reclaimed)
+        if set_reclaimed:
+                print_log(f'去色散修复：{len(set_reclaimed)} 个文件已被回收（FLAG_REMOVE_DATFILES / LIFECYCLE_ARCHIVE_DIR），不重新生成',color=colors.OKBLUE)
+        if n_missing == 0:
+                print_log(f'去色散修复：{n_total} 个 DM 试验均完整，跳过',color=colors.OKBLUE)
+        else:
+                print_log(f'去色散修复：{n_missing}/{n_total} 个 DM 试验缺失或不完整，重新运行 {len(list_repair_schemes)} 个 DM 段',masks=str(n_missing),color=colors.WARNING)
+                for DD_scheme in list_repair_schemes:
+                        print_log("%10.3f %10.3f %10s %10s %10d " % (DD_scheme['loDM'], DD_scheme['highDM'], DD_scheme['dDM'], DD_scheme['downsamp'], DD_scheme['num_DMs']))
+                prepsubbandcmd_all,ifok_all,log_all=dedisperse_repair2cmd(data_path,basename_dd_pl,sourcename_mask, dir_dedispersion, LOG_dir03, ignorechan_list, mask_file_path, list_repair_schemes, nchan, subbands, other_flags_prepsubband)
+                pool(num_simultaneous_prepsubbands,'prepsubband-repair',prepsubbandcmd_all,ifok_all,log_all,work_dir = dir_dedispersion)
+
+elif config.dedisperse_engine in ('numpy', 'validate'):
+        # 原始数据只读取一次，按块形成子带并输出全部 DM 试验
+        ifok_dedisperse_numpy = os.path.join(ifok_dir, f'ok-dedisperse-numpy-{basename_dd_pl}.ifok')
+        numout_prepsubband, list_unsupported_flags = parse_dedisperse_numpy_flags(other_flags_prepsubband)
+        if list_unsupported_flags:
+                print_log(f'错误：DEDISPERSE_ENGINE = {config.dedisperse_engine} 无法复现 PREPSUBBAND_FLAGS 中的 {", ".join(list_unsupported_flags)}，'
+                          f'请去掉这些选项或改用 DEDISPERSE_ENGINE = presto',color=colors.ERROR)
+                sys.exit(1)
+        dict_dedispersion_sizes = list_dedispersion_dir(dir_dedispersion)
+        if os.path.exists(ifok_dedisperse_numpy) and all(check_prepsubband_result_single_scheme(dir_dedispersion, scheme, dict_sizes=dict_dedispersion_sizes) for scheme in list_DDplan_scheme):
+                print_log(f'numpy 去色散已完成（{ifok_dedisperse_numpy}），跳过',color=colors.OKBLUE)
+        else:
+                start_time = time.time()
+                dedisperse_numpy([obs.file_abspath for obs in config.observation_set], config.observation_set.list_offsets, config.observation_set.list_N_samples,
+                                 config.data_type, config.observation_set.t_samp_s, dir_dedispersion, sourcename_mask, list_DDplan_scheme,
+                                 mask_file_path.replace('.mask', '.inf'), subbands, mask_file_path, ignorechan_list, n_threads=num_simultaneous_prepsubbands, numout=numout_prepsubband)
+                write2file(f'numpy 去色散完成，耗时 {format_execution_time(time.time() - start_time)}', ifok_dedisperse_numpy)
+
+        if config.dedisperse_engine == 'validate':
+                # 每个方案的第一个和最后一个 DM 再用 prepsubband 跑一遍（子带 DM 相同），逐个比较，不一致时终止运行
+                dir_validate = os.path.join(dir_dedispersion, 'validate_prepsubband')
+                makedir(dir_validate)
+                prepsubbandcmd_all,ifok_all,log_all,list_validate_names = dedisperse_validate2cmd(data_path,sourcename_mask, dir_validate, LOG_dir03, ignorechan_list, mask_file_path, list_DDplan_scheme, nchan, subbands, other_flags_prepsubband)
+                pool(num_simultaneous_prepsubbands,'validate_prepsubband',prepsubbandcmd_all,ifok_all,log_all,work_dir = dir_validate)
+                list_validate = compare_dedispersion([os.path.join(dir_dedispersion, name) for name in list_validate_names], dir_validate)
+                with open(os.path.join(dir_validate, 'dedisperse_validation.txt'), 'w') as file_validate:
+                        file_validate.write("%-40s %12s %12s %8s %10s\n" % ("# 文件", "相关系数", "平均后", "偏移", "长度差"))
+                        for name, corr, corr_smooth, lag, len_diff in list_validate:
+                                file_validate.write("%-40s %12.5f %12.5f %8d %10d\n" % (name, corr, corr_smooth, lag, len_diff))
+                list_bad = [x for x in list_validate if x[2] < 0.95 or x[3] != 0 or x[4] != 0]
+                if len(list_validate) < len(list_validate_names) or list_bad:
+                        print_log(f'错误：numpy 去色散与 prepsubband 不一致的 DM 试验 {len(list_bad)}/{len(list_validate_names)} 个，缺少 prepsubband 输出 {len(list_validate_names) - len(list_validate)} 个'
+                                  f'（平均后相关系数 < 0.95、存在偏移或长度不同），详见 {dir_validate}/dedisperse_validation.txt',color=colors.ERROR)
+                        if os.path.exists(ifok_dedisperse_numpy):
+                                os.remove(ifok_dedisperse_numpy)
+                        sys.exit(1)
+                print_log(f'numpy 去色散与 prepsubband 一致：{len(list_validate)} 个 DM 试验，平均后相关系数最小 {min(x[2] for x in list_validate):.4f}',color=colors.OKGREEN)
+
+elif config.dedisperse_engine == 'presto_sub':
+        # 两级去色散：原始数据按名义 DM 各读取一遍写出子带文件（保留复用），各 DM 段再从子带文件去色散
+        dir_subbands = os.path.join(dir_dedispersion, 'subbands')
+        makedir(dir_subbands)
+        subdm_step = config.prepsubband_subdm_step
+        if subdm_step <= 0:
+                subdm_step = get_subband_dm_step(subbands if subbands > 0 else nchan, config.list_Observations[0].bw_MHz, config.list_Observations[0].freq_central_MHz, config.list_Observations[0].t_samp_s)
+        print_log(f'两级去色散:核数{num_simultaneous_prepsubbands}/{cpu_count()}，名义 DM 间距 {subdm_step}',masks=str(subdm_step),color=colors.HEADER)
+        list_sub_tasks, list_dd_tasks = dedisperse_sub2cmd(data_path,basename_dd_pl,sourcename_mask, dir_dedispersion, dir_subbands, LOG_dir03, ignorechan_list, mask_file_path, list_DDplan_scheme, nchan, subbands,
+                                                           subdm_step, config.max_simultaneous_dms_per_prepsubband, other_flags_prepsubband, presto_env_prepsubband)
+        pool(num_simultaneous_prepsubbands,'prepsubband-sub',*list_sub_tasks,work_dir = dir_subbands)
+        pool(num_simultaneous_prepsubbands,'prepsubband',*list_dd_tasks,work_dir = dir_dedispersion)
+
+elif N_schemes < num_simultaneous_prepsubbands and not flag_partitioned:
         print(f'非并行消色散')
         dedisperse(data_path,basename_dd_pl,sourcename_mask, dir_dedispersion, LOG_dir03, ignorechan_list, mask_file_path, list_DDplan_scheme, nchan, subbands, other_flags_prepsubband, presto_env_prepsubband)
 
@@ -953,11 +1213,59 @@ if ifbary == 1:
     print_log('成功！')
     print_log('''\n ==================== ra,dec修正完毕  ====================== \n''',color=colors.HEADER)
 
-    prepdata_cmd_list,ifok_list,log_list = prepdata2bary(dat_names,sourcename_mask, bary_dir,ifok_dir03b, LOG_dir03b, Nsamples=0, ignorechan_list="",mask='', downsample_factor=1, other_flags=config.prepsubband_flags,presto_env=os.environ['PRESTO'])
-    
-    print_log('''\n ==================== 3 -3  prepdata质心修正  ====================== \n''',color=colors.OKGREEN) 
-    print_log(f'并行质心修正:核数{n_pool}/{cpu_count()}',masks=str(n_pool),color=colors.HEADER)
-    pool(n_pool,'prepdata-bary',prepdata_cmd_list,ifok_list,log_list,work_dir = bary_dir)
+    if config.bary_engine == 'numpy':
+        print_log('''\n ==================== 3 -3  质心修正（每种采样参数只运行一次 prepdata）  ====================== \n''',color=colors.OKGREEN)
+        # 按 (采样点数, 采样时间) 分组（不同降采样的方案），每组用 prepdata 处理一条合成的序号时间序列
+        bary_ref_dir = os.path.join(bary_dir, 'bary_reference')
+        ifok_dir03b_ref = os.path.join(ifok_dir03b, 'reference')
+        makedir(bary_ref_dir)
+        makedir(ifok_dir03b_ref)
+        dict_bary_groups = {}
+        for dat in dat_names:
+            info = infodata.infodata(dat.replace('.dat', '.inf'))
+            dict_bary_groups.setdefault((int(info.N), float(info.dt)), []).append(dat)
+        ref_cmd_list, ref_ifok_list, ref_log_list = [], [], []
+        dict_bary_refs = {}
+        for k, (key_group, list_group_dats) in enumerate(dict_bary_groups.items()):
+            DM_ref = extract_dm_part(list_group_dats[0])
+            ref_topo_dat = os.path.join(bary_ref_dir, f"baryref{k}_topo_DM{DM_ref}.dat")
+            if not os.path.isfile(ref_topo_dat):
+                make_bary_reference_dat(list_group_dats[0].replace('.dat', '.inf'), ref_topo_dat)
+            cmd_list_k, ifok_list_k, log_list_k = prepdata2bary([ref_topo_dat], f"baryref{k}", bary_ref_dir, ifok_dir03b_ref, LOG_dir03b, Nsamples=0, ignorechan_list="", mask='', downsample_factor=1, other_flags=config.prepsubband_flags, presto_env=os.environ['PRESTO'])
+            ref_cmd_list += cmd_list_k
+            ref_ifok_list += ifok_list_k
+            ref_log_list += log_list_k
+            dict_bary_refs[key_group] = (os.path.join(bary_ref_dir, f"baryref{k}_DM{DM_ref}"), float(DM_ref))
+        pool(n_pool,'prepdata-baryref',ref_cmd_list,ref_ifok_list,ref_log_list,work_dir = bary_ref_dir)
+
+        dict_bary_index_maps = {key_group: read_bary_index_map(ref_basename + '.dat', key_group[0]) for key_group, (ref_basename, DM_ref) in dict_bary_refs.items()}
+        ifok_list = [os.path.join(ifok_dir03b, f'BARY-{extract_dm_part(dat)}.ifok') for dat in dat_names]
+        set_bary_done = get_done_ifoks(ifok_list)
+
+        def apply_bary(args):
+            dat, ifok = args
+            DM = extract_dm_part(dat)
+            key_group = next(key for key, list_group_dats in dict_bary_groups.items() if dat in list_group_dats)
+            ref_basename, DM_ref = dict_bary_refs[key_group]
+            out_basename = os.path.join(bary_dir, f"{sourcename_mask}_DM{DM}")
+            apply_bary_index_map(dat, dict_bary_index_maps[key_group], out_basename + '.dat')
+            write_bary_inf(ref_basename + '.inf', out_basename + '.inf', os.path.basename(out_basename), float(DM), DM_ref)
+            write2file(f'{dat} -> {out_basename}.dat', ifok)
+
+        list_bary_todo = [(dat, ifok) for dat, ifok in zip(dat_names, ifok_list) if ifok not in set_bary_done]
+        print_log(f'质心修正映射应用到 {len(list_bary_todo)}/{len(dat_names)} 个 DM 试验（{len(dict_bary_groups)} 组采样参数）',color=colors.HEADER)
+        with ThreadPool(n_pool) as thread_pool:
+            for k in tqdm(thread_pool.imap_unordered(apply_bary, list_bary_todo), total=len(list_bary_todo), desc='bary-numpy', unit='dat', dynamic_ncols=True):
+                pass
+    else:
+        prepdata_cmd_list,ifok_list,log_list = prepdata2bary(dat_names,sourcename_mask, bary_dir,ifok_dir03b, LOG_dir03b, Nsamples=0, ignorechan_list="",mask='', downsample_factor=1, other_flags=config.prepsubband_flags,presto_env=os.environ['PRESTO'])
+
+        print_log('''\n ==================== 3 -3  prepdata质心修正  ====================== \n''',color=colors.OKGREEN) 
+        print_log(f'并行质心修正:核数{n_pool}/{cpu_count()}',masks=str(n_pool),color=colors.HEADER)
+        pool(n_pool,'prepdata-bary',prepdata_cmd_list,ifok_list,log_list,work_dir = bary_dir)
+    # 地心时间序列只被质心修正使用
+    lifecycle_register(dat_names, 'bary', ifok_list)
+    collect_intermediates('质心修正')
 
     dir_dedispersion = bary_dir
 
@@ -1035,7 +1343,43 @@ def deorb2cmd(infile_list,sourcename, out_dir,ifok_dir, log_dir, other_flags="",
     return cmd_rfft_list,ifok_list,log_list  
 
 ifdeorb = config.ifpysolator
-if ifdeorb == 1:
+if ifdeorb == 1 and config.deorb_template_bank:
+    print_log('''\n ==================== 进行去轨道调制-模板库  ====================== \n''',color=colors.HEADER)
+    bank_file = os.path.join(workdir, config.deorb_template_bank)
+    if not os.path.isfile(bank_file):
+        print_log(f'错误：模板库文件 {bank_file} 不存在！',color=colors.ERROR)
+        exit()
+    list_templates = read_deorb_template_bank(bank_file)
+    print_log(f'轨道模板个数：{len(list_templates)}',masks=str(len(list_templates)),color=colors.OKBLUE)
+
+    # 所有模板的输出放在同一目录，文件名带模板名（xxx_TPL003_DM12.00），之后的 FFT 和搜寻把 模板 × DM 作为同一批任务调度
+    deorb_dir = os.path.join(config.root_workdir, "03_deorb", "bank")
+    makedir(deorb_dir)
+    write_deorb_template_table(list_templates, os.path.join(deorb_dir, 'deorb_templates.txt'))
+    ifok_dir03c = os.path.join(ifok_dir,'03c_deorb','bank')
+    LOG_dir03c = os.path.join(LOG_dir,'03c_deorb','bank')
+    makedir(ifok_dir03c)
+    makedir(LOG_dir03c)
+
+    dat_names = sorted([os.path.abspath(os.path.join(dir_dedispersion, file)) for file in os.listdir(dir_dedispersion) if file.endswith('.dat')])
+    deorb_cmd_list,ifok_list,log_list = deorb_bank2cmd(dat_names, bank_file, deorb_dir, ifok_dir03c, LOG_dir03c)
+
+    # 写出之前再检查一次磁盘空间：尚未完成的每个 DM 都要写 模板数 × .dat 大小
+    set_done = get_done_ifoks(ifok_list)
+    bank_bytes = sum(os.path.getsize(dat) for dat, ifok in zip(dat_names, ifok_list) if ifok not in set_done) * len(list_templates)
+    disk_free_bytes = shutil.disk_usage(deorb_dir).free
+    size_G = f"{1.1 * bank_bytes / 1.0e9:.2f}"
+    print_log(f'模板库输出：~{size_G} GB（{len(dat_names) - len(set_done)} 个 DM × {len(list_templates)} 个模板），可用 {disk_free_bytes / 1.0e9:.2f} GB',masks=size_G,color=colors.OKBLUE)
+    if 1.1 * bank_bytes > disk_free_bytes:
+        print_log(f'错误：磁盘空间不足以写出模板库的全部时间序列！请减少 DEORB_TEMPLATE_BANK 中的模板数或释放空间。',color=colors.ERROR)
+        exit()
+    pool(n_pool,'deorb_bank',deorb_cmd_list,ifok_list,log_list,work_dir = deorb_dir)
+    lifecycle_register(dat_names, 'deorb', ifok_list)
+    collect_intermediates('去轨道调制')
+
+    dir_dedispersion = deorb_dir
+    step = 'bank'
+elif ifdeorb == 1:
     print_log('''\n ==================== 进行去轨道调制-DEORB.par  ====================== \n''',color=colors.HEADER)
     par_deorb = os.path.join(workdir,'DEORB.par')
     if os.path.exists(par_deorb):
@@ -1064,6 +1408,8 @@ if ifdeorb == 1:
     dat_names = sorted(file for file in os.listdir(dir_dedispersion) if file.endswith('.dat'))
     deorb_cmd_list,ifok_list,log_list = deorb2cmd(dat_names,sourcename_mask+f'_{q}', deorb_dir_work,ifok_dir03c, LOG_dir03c, other_flags=config.realfft_flags,presto_env=os.environ['PRESTO'])
     pool(n_pool,'deorb',deorb_cmd_list,ifok_list,log_list,work_dir = deorb_dir_work)
+    lifecycle_register([os.path.join(dir_dedispersion, name) for name in dat_names], 'deorb', ifok_list)
+    collect_intermediates('去轨道调制')
 
     dat_names = sorted([os.path.abspath(os.path.join(deorb_dir_work, file)) for file in os.listdir(deorb_dir_work) if file.endswith('_p.dat')])
     print(dat_names)
@@ -1079,12 +1425,70 @@ else:
 list_zmax = config.accelsearch_list_zmax
 numharm = config.accelsearch_numharm
 
+final_dat_names = sorted([os.path.abspath(os.path.join(dir_dedispersion, file)) for file in os.listdir(dir_dedispersion) if file.endswith('.dat')])
+final_DMs = [extract_dm_part(dat) for dat in final_dat_names]
+
+# 内存盘暂存模式：每个 DM 的整条 FFT 链作为一个任务在暂存目录中运行；单个 DM 的链放不进暂存容量时退回普通模式
+flag_staging = (dict_staging['dir'] != '' and dict_flag_steps['flag_step_realfft'] == 1 and dict_flag_steps['flag_step_periodicity_search'] == 1)
+if flag_staging and final_dat_names:
+    staging_bytes_per_DM = 2 * max(os.path.getsize(dat) for dat in final_dat_names) + 1024**2
+    if staging_bytes_per_DM > dict_staging['capacity_bytes']:
+        print_log(f"警告：单个 DM 需要暂存 {staging_bytes_per_DM / 1024**3:.2f} GB，超过暂存容量 {dict_staging['capacity_bytes'] / 1024**3:.2f} GB，不使用内存盘暂存",color=colors.WARNING)
+        flag_staging = False
+
+# 数据流模式：FFT、去红噪声、消噪和加速度搜寻按 DM 试验逐个推进，阶段之间不再等待全部 DM 完成
+flag_dataflow = (config.flag_dataflow == 1 and dict_flag_steps['flag_step_realfft'] == 1 and dict_flag_steps['flag_step_periodicity_search'] == 1 and not flag_staging)
+
+# FFT_ENGINE = numpy：realfft、rednoise、zapbirds 合并为一次 fused_fft.py，每个 DM 只读一次 .dat、写一次 .fft
+flag_fused_fft = (config.fft_engine == 'numpy')
+
+# 登记最终时间序列和 FFT 的使用者：.dat 供 FFT、时间序列折叠和单脉冲搜索使用，.fft 供每个 zmax 的搜索使用
+fft_ifok_dir = os.path.join(ifok_dir,f'04_baryfft{step}') if ifbary == 1 else os.path.join(ifok_dir,f'04_FFT{step}')
+search_ifok_dir = os.path.join(ifok_dir,f'05_barysearch{step}') if ifbary == 1 else os.path.join(ifok_dir,f'05_search{step}')
+# 旧版本把去红噪声的 ifok 写在字面名为 04_RED{step} 的目录中，改名为当前步骤的目录，避免断点续跑时对 .fft 重复去红噪声
+legacy_red_ifok_dir = os.path.join(ifok_dir,'04_RED{step}')
+if ifbary != 1 and os.path.isdir(legacy_red_ifok_dir) and not os.path.exists(os.path.join(ifok_dir,f'04_RED{step}')):
+    os.rename(legacy_red_ifok_dir, os.path.join(ifok_dir,f'04_RED{step}'))
+    print_log(f"旧的去红噪声 ifok 目录 {legacy_red_ifok_dir} 已改名为 04_RED{step}",color=colors.WARNING)
+if flag_staging:
+    # 暂存模式下 .dat 和写回的 .fft 都只被同一条链使用
+    list_chain_ifoks = [os.path.join(search_ifok_dir,f'chain-{DM}.ifok') for DM in final_DMs]
+    lifecycle_register(final_dat_names, 'realfft', list_chain_ifoks)
+elif flag_fused_fft:
+    lifecycle_register(final_dat_names, 'realfft', [os.path.join(fft_ifok_dir,f'fused-{DM}.ifok') for DM in final_DMs])
+else:
+    lifecycle_register(final_dat_names, 'realfft', [os.path.join(fft_ifok_dir,f'real-{DM}.ifok') for DM in final_DMs])
+if config.flag_fold_timeseries == 1:
+    lifecycle_register(final_dat_names, 'fold_ts')
+    lifecycle_pin_from_script(os.path.join(png_dir,'script_fold_ts.txt'))
+if config.flag_singlepulse_search == 1:
+    lifecycle_register(final_dat_names, 'single', [os.path.join(ifok_dir,'07_single',f'single-{DM}.ifok') for DM in final_DMs])
+for z in list_zmax:
+    if flag_staging:
+        lifecycle_register([dat.replace(".dat", ".fft") for dat in final_dat_names], f'search{z}', list_chain_ifoks)
+    else:
+        lifecycle_register([dat.replace(".dat", ".fft") for dat in final_dat_names], f'search{z}', [os.path.join(search_ifok_dir,f'search{z}-{DM}.ifok') for DM in final_DMs])
+
 flag_jerk_search = config.flag_jerk_search
 jerksearch_zmax = config.jerksearch_zmax
 jerksearch_wmax = config.jerksearch_wmax
 jerksearch_numharm = config.jerksearch_numharm
 
-if dict_flag_steps['flag_step_realfft'] == 1:
+if dict_flag_steps['flag_step_realfft'] == 1 and not flag_dataflow and not flag_staging and flag_fused_fft:
+
+    print_log('''\n ==================== 傅里叶变换 + 去除红噪声 + 消噪（numpy） ====================== \n''',color=colors.HEADER)
+
+    dat_names = sorted([os.path.abspath(os.path.join(dir_dedispersion, file)) for file in os.listdir(dir_dedispersion) if file.endswith('.dat')])
+    LOG_dir04 = os.path.join(LOG_dir,os.path.basename(fft_ifok_dir))
+    makedir(fft_ifok_dir)
+    makedir(LOG_dir04)
+    fused_cmd_list,ifok_list,log_list = fused_fft2cmd(dat_names, zapfile, fft_ifok_dir, LOG_dir04, other_flags=config.rednoise_flags)
+
+    print_log(f'并行FFT:核数{n_pool}/{cpu_count()}',masks=str(n_pool),color=colors.HEADER)
+    pool(n_pool,'fused_fft',fused_cmd_list,ifok_list,log_list,work_dir = dir_dedispersion)
+    collect_intermediates('FFT')
+
+elif dict_flag_steps['flag_step_realfft'] == 1 and not flag_dataflow and not flag_staging:
 
     print_log('''\n ==================== 傅里叶变换  ====================== \n''',color=colors.HEADER) 
 
@@ -1108,6 +1512,7 @@ if dict_flag_steps['flag_step_realfft'] == 1:
     
     print_log(f'并行质心修正:核数{n_pool}/{cpu_count()}',masks=str(n_pool),color=colors.HEADER)
     pool(n_pool,'realfft',realfft_cmd_list,ifok_list,log_list,work_dir = dir_dedispersion)
+    collect_intermediates('FFT')
     
     print_log('''\n ==================== 去除红噪声  ====================== \n''',color=colors.HEADER) 
 
@@ -1118,7 +1523,7 @@ if dict_flag_steps['flag_step_realfft'] == 1:
         ifok_dir04 = os.path.join(ifok_dir,f'04_baryred{step}')
         LOG_dir04 = os.path.join(LOG_dir,f'04_baryred{step}')
     else:
-        ifok_dir04 = os.path.join(ifok_dir,'04_RED{step}')
+        ifok_dir04 = os.path.join(ifok_dir,f'04_RED{step}')
         LOG_dir04 = os.path.join(LOG_dir,f'04_RED{step}')
     makedir(ifok_dir04)
     makedir(LOG_dir04)
@@ -1157,7 +1562,7 @@ if dict_flag_steps['flag_step_realfft'] == 1:
     print_log(f'并行消除ODM噪声:核数{n_pool}/{cpu_count()}',masks=str(n_pool),color=colors.HEADER)
     pool(n_pool,'zap',zap_cmd_list,ifok_list,log_list,work_dir = dir_dedispersion)
 
-else:
+elif not flag_dataflow and not flag_staging:
     print_log('''\n =============STEP_REALFFT = 0，跳过 realfft、rednoise、zapbirds... ================ \n''',color=colors.HEADER) 
 
 #周期搜寻(耗时最久的部分)
@@ -1171,7 +1576,73 @@ presto_env_accelsearch_zmax_any = os.environ['PRESTO']
 dict_env_zmax_0 = {'PRESTO': presto_env_accelsearch_zmax_0, 'PATH': f"{presto_env_accelsearch_zmax_0}/bin:{os.environ['PATH']}", 'LD_LIBRARY_PATH': f"{presto_env_accelsearch_zmax_0}/lib:{os.environ['LD_LIBRARY_PATH']}"}
 dict_env_zmax_any = {'PRESTO': presto_env_accelsearch_zmax_any, 'PATH': f"{presto_env_accelsearch_zmax_any}/bin:{os.environ['PATH']}", 'LD_LIBRARY_PATH': f"{presto_env_accelsearch_zmax_any}/lib:{os.environ['LD_LIBRARY_PATH']}"}
 
-if dict_flag_steps['flag_step_periodicity_search'] == 1:  
+def get_accelsearch_flags(z):
+    """每个 zmax 对应的 accelsearch 选项（zmax>0 且使用 GPU 时随机分配一块 GPU）"""
+    if int(z) != 0 and flag_use_cuda == 1:
+        gpu_id = random.choice(list_cuda_ids)
+        flag_cuda = " -cuda %d " % (gpu_id)
+    else:
+        flag_cuda = ""
+    return other_flags_accelsearch + flag_cuda
+
+if flag_dataflow:
+    print_log(f'''\n ==================== 数据流调度：FFT → 去红噪声 → 消噪 → 加速度搜寻 zmax = {list_zmax}  ====================== \n''',color=colors.HEADER)
+
+    # 与分阶段模式使用同一套 ifok 目录，两种模式之间可以断点续跑
+    if ifbary == 1:
+        dict_ifok_dirs = {'fft': os.path.join(ifok_dir,f'04_baryfft{step}'), 'red': os.path.join(ifok_dir,f'04_baryred{step}'), 'zap': os.path.join(ifok_dir,f'04_baryzap{step}'), 'search': os.path.join(ifok_dir,f'05_barysearch{step}')}
+        dict_log_dirs = {'fft': os.path.join(LOG_dir,f'04_baryfft{step}'), 'red': os.path.join(LOG_dir,f'04_baryred{step}'), 'zap': os.path.join(LOG_dir,f'04_baryzap{step}'), 'search': os.path.join(LOG_dir,f'05_barysearch{step}')}
+    else:
+        dict_ifok_dirs = {'fft': os.path.join(ifok_dir,f'04_FFT{step}'), 'red': os.path.join(ifok_dir,f'04_RED{step}'), 'zap': os.path.join(ifok_dir,f'04_ZAP{step}'), 'search': os.path.join(ifok_dir,f'05_search{step}')}
+        dict_log_dirs = {'fft': os.path.join(LOG_dir,f'04_FFT{step}'), 'red': os.path.join(LOG_dir,f'04_RED{step}'), 'zap': os.path.join(LOG_dir,f'04_ZAP{step}'), 'search': os.path.join(LOG_dir,f'05_search{step}')}
+    makedir(*dict_ifok_dirs.values())
+    makedir(*dict_log_dirs.values())
+
+    dat_names = sorted([os.path.abspath(os.path.join(dir_dedispersion, file)) for file in os.listdir(dir_dedispersion) if file.endswith('.dat')])
+    fft_files = [file.replace(".dat", ".fft") for file in dat_names]
+    dict_accelsearch_flags = {z: get_accelsearch_flags(z) for z in list_zmax}
+
+    dataflow_task_list = dataflow2tasks(dat_names, sourcename_mask, dir_dedispersion, zapfile, list_zmax, dict_ifok_dirs, dict_log_dirs, numharm=numharm,
+                                        realfft_flags=config.realfft_flags, rednoise_flags=config.rednoise_flags if flag_fused_fft else '',
+                                        dict_accelsearch_flags=dict_accelsearch_flags, flag_fused=flag_fused_fft)
+    print_log(f'数据流调度:{len(dat_names)} 个 DM 试验，{len(dataflow_task_list)} 个任务，核数{n_pool}/{cpu_count()}',masks=str(n_pool),color=colors.HEADER)
+    pool_dataflow(n_pool,'dataflow',dataflow_task_list,work_dir = dir_dedispersion)
+
+    for z in list_zmax:
+        for fft_path in fft_files:
+            if not check_accelsearch_result(fft_path, int(z),verbosity_level=0):
+                inffile_empty = fft_path.replace(".fft", "_ACCEL_%d_empty" % (z))
+                with open(inffile_empty, "w") as file_empty:
+                    print_log("警告：accelsearch 没有产生任何候选结果！写入文件 %s 以标记此情况..." % (inffile_empty),color=colors.WARNING,mode='p')
+                    file_empty.write("ACCELSEARCH DID NOT PRODUCE ANY CANDIDATES!")
+
+if flag_staging:
+    print_log(f'''\n ==================== 内存盘暂存：FFT → 去红噪声 → 消噪 → 加速度搜寻 zmax = {list_zmax}  ====================== \n''',color=colors.HEADER)
+    LOG_dir_chain = os.path.join(LOG_dir,os.path.basename(search_ifok_dir))
+    makedir(search_ifok_dir)
+    makedir(LOG_dir_chain)
+
+    # 已在其他模式下搜索完成的 DM 不再重复
+    set_done = get_done_ifoks([os.path.join(search_ifok_dir,f'search{z}-{DM}.ifok') for DM in final_DMs for z in list_zmax])
+    dat_todo = [dat for dat, DM in zip(final_dat_names, final_DMs) if not all(os.path.join(search_ifok_dir,f'search{z}-{DM}.ifok') in set_done for z in list_zmax)]
+    dict_accelsearch_flags = {z: get_accelsearch_flags(z) for z in list_zmax}
+    chain_cmd_list,ifok_list,log_list = staging_chain2cmd(dat_todo, dir_dedispersion, zapfile, list_zmax, search_ifok_dir, LOG_dir_chain, numharm=numharm,
+                                                          realfft_flags=config.realfft_flags, rednoise_flags=config.rednoise_flags if flag_fused_fft else '',
+                                                          dict_accelsearch_flags=dict_accelsearch_flags,
+                                                          flag_keep_fft=(config.flag_remove_fftfiles == 0), flag_fused=flag_fused_fft)
+    print_log(f'内存盘暂存:{len(dat_todo)}/{len(final_dat_names)} 个 DM 试验，核数{n_pool}/{cpu_count()}',masks=str(n_pool),color=colors.HEADER)
+    pool(n_pool,'staging',chain_cmd_list,ifok_list,log_list,work_dir = dir_dedispersion)
+
+    for z in list_zmax:
+        for dat in final_dat_names:
+            fft_path = dat.replace(".dat", ".fft")
+            if not check_accelsearch_result(fft_path, int(z),verbosity_level=0):
+                inffile_empty = fft_path.replace(".fft", "_ACCEL_%d_empty" % (z))
+                with open(inffile_empty, "w") as file_empty:
+                    print_log("警告：accelsearch 没有产生任何候选结果！写入文件 %s 以标记此情况..." % (inffile_empty),color=colors.WARNING,mode='p')
+                    file_empty.write("ACCELSEARCH DID NOT PRODUCE ANY CANDIDATES!")
+
+if dict_flag_steps['flag_step_periodicity_search'] == 1 and not flag_dataflow and not flag_staging:
     if ifbary == 1:
         ifok_dir05 = os.path.join(ifok_dir,f'05_barysearch{step}')
         LOG_dir05 = os.path.join(LOG_dir,f'05_barysearch{step}')
@@ -1211,6 +1682,9 @@ if dict_flag_steps['flag_step_periodicity_search'] == 1:
                         print_log("警告：accelsearch 没有产生任何候选结果！写入文件 %s 以标记此情况..." % (inffile_empty),color=colors.WARNING,mode='p')
                         file_empty.write("ACCELSEARCH DID NOT PRODUCE ANY CANDIDATES!")
 
+# 折叠和单脉冲搜索只用 .dat 和 ACCEL 文件，所有 zmax 搜索完成后 .fft 即可回收
+collect_intermediates('周期搜寻')
+
 
 oksift = os.path.join(workdir,'ok-sifting')
 if config.flag_step_sifting == 1 :
@@ -1461,7 +1935,8 @@ def fold_task(cmd, ifok, logfile, work_dir, png_dir):
     png_name = f'{filename[:-4]}.png'
     ps_path = os.path.join(work_dir, f'{filename[:-4]}.ps')
     try:
-        run_cmd(cmd, ifok=ifok, work_dir=work_dir, log_file=logfile, mode='both')
+        if not run_cmd(cmd, ifok=ifok, work_dir=work_dir, log_file=logfile, mode='both'):
+            raise RuntimeError(f"prepfold 失败（日志：{logfile}）：{cmd}")
         if not os.path.exists(ifok):
             ps2png(ps_path)
             handle_files(work_dir, png_dir, 'copy', png_name)
@@ -1472,9 +1947,8 @@ def fold_task(cmd, ifok, logfile, work_dir, png_dir):
         error_args = e.args
         print_log(f"fold_task 内部错误: 类型={error_type}, 参数={error_args}", color=colors.ERROR)
         print_log(tb, color=colors.ERROR)
-        # error_file = ifok + ".error"
-        # with open(error_file, 'w') as ef:
-        #     ef.write(f"类型: {error_type}\n参数: {error_args}\n{tb}")
+        # run_cmd 的重试已经用尽，继续抛出，由 pool_fold 的 handle_error 报告失败
+        raise
 
 def pool_fold(num_processes, task_name, cmd_list, ifok_list,log_list, work_dir=os.getcwd(),png_dir = None):
     """
@@ -1491,6 +1965,17 @@ def pool_fold(num_processes, task_name, cmd_list, ifok_list,log_list, work_dir=o
     if len(cmd_list) != len(ifok_list):
         raise ValueError("cmd_list和ifok_list长度必须一致")
 
+    # 折叠后还要在本进程内把 ps 转为 png 并复制，EXECUTION_BACKEND = queue 时也在本机运行
+    if dict_execution_backend['name'] == 'queue':
+        print_log(f"{task_name}: 折叠任务在本机运行（不进入任务队列）", color=colors.WARNING)
+
+    # 估计耗时长的任务（原始数据折叠等）先提交
+    list_order, predicted_makespan = order_tasks_by_cost(num_processes, task_name, cmd_list, ifok_list, work_dir)
+    cmd_list = [cmd_list[k] for k in list_order]
+    ifok_list = [ifok_list[k] for k in list_order]
+    log_list = [log_list[k] for k in list_order]
+    start_time = time.time()
+
     # 初始化进度条和线程锁
     progress_bar = tqdm(
         total=len(cmd_list),
@@ -1501,9 +1986,6 @@ def pool_fold(num_processes, task_name, cmd_list, ifok_list,log_list, work_dir=o
     )
     # lock = Lock()
 
-    def update(*args):
-        progress_bar.update()
-    
     def handle_error(error):
         try:
             error_str = str(error)
@@ -1512,25 +1994,14 @@ def pool_fold(num_processes, task_name, cmd_list, ifok_list,log_list, work_dir=o
         except Exception as e:
             progress_bar.write(f"任务执行错误: 无法解码错误信息 - {repr(error)} (额外异常: {repr(e)})")
 
-    # 创建进程池并提交任务
-    process_pool = Pool(num_processes)
+    # 在进程数和核数/内存预算内提交任务（PREPFOLD_FLAGS 中的 -ncpus 计入核数）
+    list_args = [(cmd, ifok, log_file, work_dir, png_dir) for cmd, ifok, log_file in zip(cmd_list, ifok_list, log_list)]
+    list_resources = [estimate_task_resources(cmd, work_dir) for cmd in cmd_list]
     try:
-        results = [
-            process_pool.apply_async(
-                fold_task,
-                args=(cmd, ifok, log_file,work_dir,png_dir),
-                callback=update,
-                error_callback=handle_error
-            )
-            for cmd, ifok,log_file in zip(cmd_list, ifok_list,log_list)
-        ]
-        process_pool.close()
-        process_pool.join()
-    except Exception as e:
-        process_pool.terminate()
-        raise e
+        pool_admit(num_processes, fold_task, list_args, list_resources, progress_bar, handle_error)
     finally:
         progress_bar.close()
+    report_makespan(task_name, predicted_makespan, start_time)
 
 
 if config.flag_step_folding == 1:
@@ -1543,6 +2014,11 @@ if config.flag_step_folding == 1:
     start_time = time.time()
     print_log(f"test :{ifok_prepfold_list} \n")
     pool_fold(n_pool,'fold',cmd_prepfold_list[:fold_num_pl],ifok_prepfold_list[:fold_num_pl],log_prepfold_list[:fold_num_pl],work_dir = dir_folding,png_dir=png_dir)
+    if config.flag_fold_timeseries == 1:
+        # 脚本中所有候选体（包括超出 FLAG_NUM 未折叠的）用到的 .dat 都保留
+        lifecycle_pin_from_script(os.path.join(dir_folding,'script_fold_ts.txt'))
+        lifecycle_finish('fold_ts')
+        collect_intermediates('时间序列折叠')
 
     end_time = time.time()
     execution_time = end_time - start_time
@@ -1740,7 +2216,93 @@ def single2cmd(infile_list,sourcename, out_dir,ifok_dir, log_dir, other_flags=""
 
     return cmd_single_list,ifok_list,log_list  
 
-if config.flag_singlepulse_search == 1 and config.flag_step_singlepulse_search == 1:
+def plot_singlepulse_events(dict_events, out_png, title, sigma_min=6.0, max_events=200000):
+    """
+    从事件库画单脉冲总图（与 single_pulse_search.py 的总图布局相同）：上方为信噪比分布、DM 分布、信噪比-DM，
+    下方为 DM-时间图（圆圈大小随信噪比增大）。事件过多时只画信噪比最高的 max_events 个。
+    """
+    keep = np.flatnonzero(dict_events['sigma'] >= sigma_min)
+    if len(keep) > max_events:
+        keep = keep[np.argsort(dict_events['sigma'][keep])[-max_events:]]
+    DMs = dict_events['DM'][keep]
+    sigmas = dict_events['sigma'][keep]
+    times = dict_events['time'][keep]
+
+    fig = plt.figure(figsize=(11, 8.5))
+    ax_hist_sigma = fig.add_axes([0.06, 0.72, 0.26, 0.22])
+    ax_hist_DM = fig.add_axes([0.39, 0.72, 0.26, 0.22])
+    ax_sigma_DM = fig.add_axes([0.72, 0.72, 0.26, 0.22])
+    ax_DM_time = fig.add_axes([0.06, 0.07, 0.92, 0.56])
+    if len(keep) > 0:
+        ax_hist_sigma.hist(sigmas, bins=50, log=True, histtype='step', color='k')
+        ax_hist_DM.hist(DMs, bins=min(200, len(np.unique(DMs))), histtype='step', color='k')
+        ax_sigma_DM.plot(DMs, sigmas, 'k.', markersize=1)
+        ax_DM_time.scatter(times, DMs, s=(np.minimum(sigmas, 30) - sigma_min + 1) ** 2, facecolors='none', edgecolors='k', linewidths=0.5)
+    ax_hist_sigma.set_xlabel('Signal-to-Noise')
+    ax_hist_sigma.set_ylabel('Number of Pulses')
+    ax_hist_DM.set_xlabel('DM (pc cm$^{-3}$)')
+    ax_hist_DM.set_ylabel('Number of Pulses')
+    ax_sigma_DM.set_xlabel('DM (pc cm$^{-3}$)')
+    ax_sigma_DM.set_ylabel('Signal-to-Noise')
+    ax_DM_time.set_xlabel('Time (s)')
+    ax_DM_time.set_ylabel('DM (pc cm$^{-3}$)')
+    fig.suptitle(f"{title}    事件数 {len(keep)}（信噪比 >= {sigma_min}）")
+    fig.savefig(out_png, dpi=120)
+    plt.close(fig)
+
+if config.flag_singlepulse_search == 1 and config.flag_step_singlepulse_search == 1 and config.singlepulse_engine == 'numpy':
+    print_log("\n ====================STEP 7 - SINGLE-PULSE SEARCH (numpy)====================== \n",color=colors.HEADER)
+    dir_singlepulse_search = os.path.join(config.root_workdir, "07_SINGLEPULSE")
+    dir_event_parts = os.path.join(dir_singlepulse_search, 'events_parts')
+    makedir(dir_event_parts)
+    ifok_dir07 = os.path.join(ifok_dir,'07_single')
+    makedir(ifok_dir07)
+
+    threshold, maxwidth, detrendlen, flag_fast, flag_badblocks = parse_singlepulse_flags(config.singlepulse_search_flags)
+    dat_names = sorted([os.path.abspath(os.path.join(dir_dedispersion, file)) for file in os.listdir(dir_dedispersion) if file.endswith('.dat')])
+    ifok_list = [os.path.join(ifok_dir07,f'single-{extract_dm_part(dat)}.ifok') for dat in dat_names]
+    set_single_done = get_done_ifoks(ifok_list)
+
+    # 同一批的 DM 试验采样时间必须相同（不同降采样的方案分开成批）
+    dict_dt_groups = {}
+    for dat, ifok in zip(dat_names, ifok_list):
+        if ifok not in set_single_done:
+            dict_dt_groups.setdefault(float(infodata.infodata(dat.replace('.dat', '.inf')).dt), []).append((dat, ifok))
+    list_batches = [list_group[k:k + singlepulse_batch_dms] for list_group in dict_dt_groups.values() for k in range(0, len(list_group), singlepulse_batch_dms)]
+
+    def search_singlepulse_batch(batch):
+        dict_events = singlepulse_search_batch([dat for dat, ifok in batch], threshold, maxwidth, detrendlen, flag_fast, flag_badblocks)
+        part_file = os.path.join(dir_event_parts, f"events_DM{extract_dm_part(batch[0][0])}_DM{extract_dm_part(batch[-1][0])}.npz")
+        write_event_store(part_file, dict_events)
+        for dat, ifok in batch:
+            write2file(f'{dat} -> {part_file}', ifok)
+
+    n_todo = sum(len(batch) for batch in list_batches)
+    print_log(f'单脉冲搜寻 {n_todo}/{len(dat_names)} 个 DM 试验，{len(list_batches)} 批（阈值 {threshold}）',color=colors.HEADER)
+    with ThreadPool(n_pool) as thread_pool:
+        for k in tqdm(thread_pool.imap_unordered(search_singlepulse_batch, list_batches), total=len(list_batches), desc='single-numpy', unit='batch', dynamic_ncols=True):
+            pass
+    collect_intermediates('单脉冲搜索')
+
+    store_file = os.path.join(dir_singlepulse_search, f'{sourcename_mask}_singlepulse_events.npz')
+    dict_events = merge_event_stores(sorted(glob.glob(os.path.join(dir_event_parts, 'events_*.npz'))), store_file)
+    print_log(f'事件库：{store_file}（{len(dict_events["DM"])} 个事件）',color=colors.OKGREEN)
+
+    png_single_dir = os.path.join(workdir,'06_PNG','single')
+    makedir(png_single_dir)
+    single_png = os.path.join(dir_singlepulse_search, f'{sourcename_mask}_singlepulse.png')
+    plot_singlepulse_events(dict_events, single_png, sourcename_mask, sigma_min=max(threshold, 6.0))
+    shutil.copy(single_png, png_single_dir)
+
+    # 事件聚类为爆发，按峰值信噪比排序
+    os.chdir(dir_singlepulse_search)
+    command = f'{sp_cluster_script} -o {sourcename_mask} -n {n_pool} {store_file}'
+    print_log(command,color=colors.OKBLUE)
+    os.system(command)
+    write2file(command,f'{dir_singlepulse_search}/cluster_cmd.sh')
+    handle_files(dir_singlepulse_search, png_single_dir, 'copy', '*_bursts.png')
+
+elif config.flag_singlepulse_search == 1 and config.flag_step_singlepulse_search == 1:
     print_log("\n ====================STEP 7 STEP 6 - SINGLE-PULSE SEARCH (PRESTO)====================== \n",color=colors.HEADER)
     dir_singlepulse_search = os.path.join(config.root_workdir, "07_SINGLEPULSE")
     makedir(dir_singlepulse_search)
@@ -1762,6 +2324,7 @@ if config.flag_singlepulse_search == 1 and config.flag_step_singlepulse_search =
     
     print_log(f'并行单脉冲搜寻:核数{n_pool}/{cpu_count()}',masks=str(n_pool),color=colors.HEADER)
     pool(n_pool,'single',single_cmd_list,ifok_list,log_list,work_dir = dir_singlepulse_search)
+    collect_intermediates('单脉冲搜索')
 
     os.chdir(dir_singlepulse_search)
     command = f'single_pulse_search.py -b -t 10 -m 30 *_DM*.singlepulse'
@@ -1770,6 +2333,12 @@ if config.flag_singlepulse_search == 1 and config.flag_step_singlepulse_search =
     write2file(command,f'{dir_singlepulse_search}/single_cmd.sh')
     ps2png(f'{dir_singlepulse_search}/*ps',rotated=False)
 
+    # 所有 .singlepulse 读入一个事件库，事件聚类为爆发，按峰值信噪比排序
+    command = f'{sp_cluster_script} -o {sourcename_mask} -n {n_pool} -glob "*_DM*.singlepulse"'
+    print_log(command,color=colors.OKBLUE)
+    os.system(command)
+    write2file(command,f'{dir_singlepulse_search}/cluster_cmd.sh')
+
     png_single_dir = os.path.join(workdir,'06_PNG','single')
     print(f'mkdir {png_single_dir}')
     makedir(png_single_dir)
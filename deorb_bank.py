@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+去轨道调制模板库（IF_PYSOLATOR = 1 且配置文件中设置了 DEORB_TEMPLATE_BANK 时使用）
+
+每个 .dat 只读一次，按模板库中的全部圆轨道模板批量重采样，每个模板写出 xxx_TPL<编号>_DM<DM>.dat/.inf。
+
+用法：
+    deorb_bank.py -bank <模板库> [-outdir <输出目录>] <文件.dat> ...
+    -bank     模板库文件，每行 Pb(天) x(光秒) T0(MJD) q，任一字段可写成 起始:结束:步长
+    -outdir   输出目录，默认为当前目录
+"""
+import os,sys
+import time
+from psr_fuc import *
+
+bank_file = ""
+out_dir = os.getcwd()
+list_datfiles = []
+
+if len(sys.argv) == 1 or ("-h" in sys.argv) or ("-help" in sys.argv) or ("--help" in sys.argv):
+    print(__doc__)
+    sys.exit(0)
+
+j = 1
+while j < len(sys.argv):
+    if sys.argv[j] == "-bank":
+        bank_file = sys.argv[j+1]
+        j += 1
+    elif sys.argv[j] == "-outdir":
+        out_dir = sys.argv[j+1]
+        j += 1
+    elif sys.argv[j].endswith(".dat"):
+        list_datfiles.append(sys.argv[j])
+    j += 1
+
+if not os.path.isfile(bank_file):
+    print_log(f"错误：模板库文件 {bank_file} 不存在！", color=colors.ERROR, mode='p')
+    sys.exit(1)
+
+list_templates = read_deorb_template_bank(bank_file)
+if len(list_templates) == 0:
+    print_log(f"错误：模板库文件 {bank_file} 中没有模板！", color=colors.ERROR, mode='p')
+    sys.exit(1)
+
+for datfile in list_datfiles:
+    start_time = time.time()
+    list_outfiles = deorb_template_bank(datfile, list_templates, out_dir)
+    print(f"{datfile} -> {len(list_outfiles)} 个模板（{time.time() - start_time:.1f} 秒）")
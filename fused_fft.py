@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+进程内 FFT（配置文件中 FFT_ENGINE 为 numpy 时使用）
+
+一次读取 .dat，在内存中完成 realfft、rednoise 和 zapbirds，只写一次 .fft（.inf 沿用 .dat 的）。
+
+用法：
+    fused_fft.py [-zapfile <zaplist>] [-startwidth 6] [-endwidth 100] [-endfreq 6.0] [-norednoise] <文件.dat> ...
+    -zapfile      要消除的干扰频率列表（PRESTO zaplist 格式），不指定则不消噪
+    -startwidth   去红噪声的初始块宽度（频率单元），默认 6
+    -endwidth     去红噪声的最大块宽度（频率单元），默认 100
+    -endfreq      块宽度达到最大值的频率（Hz），默认 6.0
+    -norednoise   不去红噪声
+"""
+import os,sys
+import time
+from psr_fuc import *
+
+zapfile = ""
+startwidth = 6
+endwidth = 100
+endfreq = 6.0
+flag_rednoise = True
+list_datfiles = []
+
+if len(sys.argv) == 1 or ("-h" in sys.argv) or ("-help" in sys.argv) or ("--help" in sys.argv):
+    print(__doc__)
+    sys.exit(0)
+
+j = 1
+while j < len(sys.argv):
+    if sys.argv[j] == "-zapfile":
+        zapfile = sys.argv[j+1]
+        j += 1
+    elif sys.argv[j] == "-startwidth":
+        startwidth = int(sys.argv[j+1])
+        j += 1
+    elif sys.argv[j] == "-endwidth":
+        endwidth = int(sys.argv[j+1])
+        j += 1
+    elif sys.argv[j] == "-endfreq":
+        endfreq = float(sys.argv[j+1])
+        j += 1
+    elif sys.argv[j] == "-norednoise":
+        flag_rednoise = False
+    elif sys.argv[j].endswith(".dat"):
+        list_datfiles.append(sys.argv[j])
+    j += 1
+
+if zapfile and not os.path.isfile(zapfile):
+    print_log(f"错误：zaplist 文件 {zapfile} 不存在！", color=colors.ERROR, mode='p')
+    sys.exit(1)
+
+for datfile in list_datfiles:
+    start_time = time.time()
+    fftfile = fused_fft(datfile, zapfile, startwidth, endwidth, endfreq, flag_rednoise)
+    print(f"{datfile} -> {fftfile}（{time.time() - start_time:.1f} 秒）")
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+查询和管理任务状态数据库（00_IFOK/jobs.sqlite）
+
+用法：
+    jobdb.py summary                                 各阶段任务数、失败数、耗时和输出大小
+    jobdb.py list [-stage 04_FFT] [-status failed] [-n 50]
+    jobdb.py failed                                  列出失败的任务及日志路径
+    jobdb.py slowest [-stage 05_search] [-n 20]      耗时最长的任务
+    jobdb.py invalidate -stage 05_search             使整个阶段失效（下次运行时重新执行）
+    jobdb.py invalidate -status failed               清除失败记录
+    jobdb.py invalidate -like "%DM12.30%"            按命令匹配使任务失效
+    可选 -db <路径> 指定数据库，默认使用配置文件中 ROOT_WORKDIR 下的 00_IFOK/jobs.sqlite
+"""
+import os,sys
+import time
+from psr_fuc import *
+
+def find_cfg_file():
+    for folder in [".", "..", "../..", "../../..","../../../.."]:
+        try:
+            for fname in os.listdir(folder):
+                if fname.endswith(".cfg"):
+                    return os.path.join(folder, fname)
+        except FileNotFoundError:
+            continue
+    return None
+
+def parse_config_value(cfg_path, param_name):
+    with open(cfg_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            line = line.split("#", 1)[0].strip()
+            parts = line.split(None, 1)
+            if len(parts) >= 2 and parts[0] == param_name:
+                return parts[1].strip()
+    return None
+
+def format_size(size_bytes):
+    if size_bytes is None:
+        return "-"
+    return f"{size_bytes / 1.0e9:.2f}G" if size_bytes >= 1.0e9 else f"{size_bytes / 1.0e6:.1f}M"
+
+def print_summary(conn):
+    rows = conn.execute("""SELECT stage,
+                                  COUNT(*),
+                                  SUM(status = 'done'),
+                                  SUM(status = 'failed'),
+                                  SUM(status = 'running'),
+                                  SUM(duration),
+                                  SUM(output_bytes)
+                           FROM jobs GROUP BY stage ORDER BY stage""").fetchall()
+    print("%-28s %8s %8s %8s %8s %14s %10s" % ("阶段", "总数", "完成", "失败", "运行中", "累计耗时", "输出"))
+    for stage, n_total, n_done, n_failed, n_running, duration, output_bytes in rows:
+        print("%-28s %8d %8d %8d %8d %14s %10s" % (stage, n_total, n_done or 0, n_failed or 0, n_running or 0,
+                                                 format_execution_time(duration or 0), format_size(output_bytes)))
+
+def print_jobs(rows):
+    for stage, status, exit_code, duration, output_bytes, ifok, log_file, cmd in rows:
+        print(f"[{stage}] {status} exit={exit_code} {format_execution_time(duration or 0)} {format_size(output_bytes)}")
+        print(f"    ifok: {ifok}")
+        print(f"    log : {log_file}")
+        print(f"    cmd : {cmd}")
+
+db_path = None
+action = "summary"
+stage = None
+status = None
+cmd_like = None
+n_rows = 50
+
+if ("-h" in sys.argv) or ("-help" in sys.argv) or ("--help" in sys.argv):
+    print(__doc__)
+    sys.exit(0)
+
+for j in range(1, len(sys.argv)):
+    if sys.argv[j] in ["summary", "list", "failed", "slowest", "invalidate"]:
+        action = sys.argv[j]
+    elif sys.argv[j] == "-db":
+        db_path = sys.argv[j+1]
+    elif sys.argv[j] == "-stage":
+        stage = sys.argv[j+1]
+    elif sys.argv[j] == "-status":
+        status = sys.argv[j+1]
+    elif sys.argv[j] == "-like":
+        cmd_like = sys.argv[j+1]
+    elif sys.argv[j] == "-n":
+        n_rows = int(sys.argv[j+1])
+
+if db_path is None:
+    cfg_file = find_cfg_file()
+    root_workdir = parse_config_value(cfg_file, "ROOT_WORKDIR") if cfg_file else None
+    db_path = os.path.join(root_workdir or os.getcwd(), '00_IFOK', 'jobs.sqlite')
+
+if not os.path.isfile(db_path):
+    print_log(f"错误：任务数据库 {db_path} 不存在！", color=colors.ERROR, mode='p')
+    sys.exit(1)
+
+set_job_store(db_path)
+conn = connect_job_store()
+columns = "stage, status, exit_code, duration, output_bytes, ifok, log_file, cmd"
+
+if action == "summary":
+    print_summary(conn)
+elif action == "list":
+    list_conditions, list_values = [], []
+    if stage is not None:
+        list_conditions.append("stage = ?")
+        list_values.append(stage)
+    if status is not None:
+        list_conditions.append("status = ?")
+        list_values.append(status)
+    where = ("WHERE " + " AND ".join(list_conditions)) if list_conditions else ""
+    print_jobs(conn.execute(f"SELECT {columns} FROM jobs {where} ORDER BY t_start DESC LIMIT ?", list_values + [n_rows]).fetchall())
+elif action == "failed":
+    print_jobs(conn.execute(f"SELECT {columns} FROM jobs WHERE status = 'failed' ORDER BY stage").fetchall())
+elif action == "slowest":
+    if stage is not None:
+        rows = conn.execute(f"SELECT {columns} FROM jobs WHERE stage = ? AND duration IS NOT NULL ORDER BY duration DESC LIMIT ?", (stage, n_rows)).fetchall()
+    else:
+        rows = conn.execute(f"SELECT {columns} FROM jobs WHERE duration IS NOT NULL ORDER BY duration DESC LIMIT ?", (n_rows,)).fetchall()
+    print_jobs(rows)
+elif action == "invalidate":
+    if stage is None and status is None and cmd_like is None:
+        print_log("错误：invalidate 需要指定 -stage、-status 或 -like", color=colors.ERROR, mode='p')
+        sys.exit(1)
+    n_deleted = invalidate_jobs(stage=stage, status=status, cmd_like=cmd_like)
+    print_log(f"已使 {n_deleted} 条任务记录失效（数据库：{db_path}）", color=colors.OKGREEN)
+conn.close()
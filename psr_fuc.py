@@ -5,13 +5,25 @@ import os.path
 import glob
 import subprocess
 from tqdm import tqdm
-from multiprocessing import Pool,Lock, cpu_count
+from multiprocessing import Pool,Lock, cpu_count, Process
 import shlex
 import shutil
 import copy
 import random
 import time
+import heapq
+import itertools
+import queue
+import sqlite3
+import hashlib
+import zlib
+import codecs
+import struct
+import json
+import socket
+import threading
 from datetime import datetime,timedelta
+from collections import deque
 import numpy as np
 import urllib
 from presto import filterbank, infodata, parfile, psr_utils, psrfits, rfifind, sifting
@@ -195,9 +207,357 @@ def append_to_script_if_not_exists(file_path, content):
             f.write(content.encode('utf-8', errors='replace'))
             f.write(b'\n')
 
-def run_cmd(cmd, ifok=None, work_dir=None, log_file=None, dict_envs={}, flag_append=True,mode='both'):
+###任务状态数据库（SQLite，WAL 模式），取代 00_IFOK 下的 .ifok 标记文件
+#由主程序调用 set_job_store() 启用；未启用时 run_cmd 仍按 ifok 文件判断是否跳过
+job_store_path = None
+#SQLite 日志模式：单机用 WAL；多节点共享文件系统时 WAL 不可用，需改为 DELETE（set_execution_backend 会自动设置）
+sqlite_journal_mode = 'WAL'
+
+#作为输入文件参与任务键计算的扩展名
+list_job_input_suffixes = ('.dat', '.fft', '.inf', '.fits', '.fil', '.sf', '.mask', '.zaplist', '.birds', '.cand', '.par', '.singlepulse')
+
+def set_job_store(db_path):
+    """启用任务状态数据库（在创建进程池之前调用，子进程会继承该设置）"""
+    global job_store_path
+    job_store_path = db_path
+    if db_path:
+        makedir(os.path.dirname(os.path.abspath(db_path)))
+        conn = connect_job_store(db_path)
+        conn.close()
+
+def connect_job_store(db_path=None):
+    """连接任务状态数据库，不存在时自动建表"""
+    conn = sqlite3.connect(db_path or job_store_path, timeout=120)
+    conn.execute(f'PRAGMA journal_mode={sqlite_journal_mode}')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                        job_key      TEXT PRIMARY KEY,
+                        stage        TEXT,
+                        cmd_name     TEXT,
+                        ifok         TEXT,
+                        cmd          TEXT,
+                        work_dir     TEXT,
+                        inputs       TEXT,
+                        log_file     TEXT,
+                        status       TEXT,
+                        exit_code    INTEGER,
+                        attempts     INTEGER DEFAULT 0,
+                        host         TEXT,
+                        t_start      REAL,
+                        t_end        REAL,
+                        duration     REAL,
+                        output_bytes INTEGER,
+                        cost         REAL)""")
+    # 旧数据库没有 cost 列时补上
+    if 'cost' not in [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]:
+        conn.execute('ALTER TABLE jobs ADD COLUMN cost REAL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_stage ON jobs (stage)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)')
+    return conn
+
+def normalize_cmd(cmd):
+    """去掉对结果没有影响、每次运行可能不同的部分（如随机分配的 -cuda 编号），用于计算任务键"""
+    cmd = re.sub(r'\s-cuda\s+\d+', ' ', ' ' + cmd)
+    return ' '.join(cmd.split())
+
+def split_cmd(cmd):
+    try:
+        return shlex.split(cmd)
+    except ValueError:
+        return cmd.split()
+
+def get_cmd_input_files(cmd, work_dir):
+    """根据扩展名从命令中找出输入文件（只做字符串处理，不访问文件系统）"""
+    list_inputs = []
+    for token in split_cmd(cmd):
+        if token.startswith('-') or not token.endswith(list_job_input_suffixes):
+            continue
+        list_inputs.append(os.path.normpath(os.path.join(work_dir, token)))
+    return sorted(set(list_inputs))
+
+def get_cmd_input_fingerprints(cmd, work_dir):
+    """
+    输入文件的 "路径|大小|修改时间"，输入改变（如上游重新运行）时任务键随之改变。
+    同时也是输出的文件（zapbirds、rednoise && mv 原地改写的 .fft）不计大小和修改时间，否则任务完成后键就变了。
+    """
+    set_outputs = set(os.path.normpath(path) for path, _ in get_expected_outputs(cmd, work_dir))
+    list_fingerprints = []
+    for path in get_cmd_input_files(cmd, work_dir):
+        if path in set_outputs:
+            list_fingerprints.append(path)
+            continue
+        try:
+            stat = os.stat(path)
+            list_fingerprints.append(f"{path}|{stat.st_size}|{stat.st_mtime_ns}")
+        except OSError:
+            list_fingerprints.append(f"{path}|-")
+    return list_fingerprints
+
+def check_inputs_missing(cmd, work_dir):
+    """命令的输入文件（不含同时也是输出的文件）是否有已不存在的，例如被生命周期管理回收的 .fft"""
+    set_outputs = set(os.path.normpath(path) for path, _ in get_expected_outputs(cmd, work_dir))
+    return any(not os.path.exists(path) for path in get_cmd_input_files(cmd, work_dir) if path not in set_outputs)
+
+def get_job_key(cmd, work_dir):
+    """任务键：命令、工作目录和输入文件（含大小、修改时间）的哈希"""
+    work_dir = os.path.abspath(work_dir)
+    content = "\0".join([normalize_cmd(cmd), work_dir] + get_cmd_input_fingerprints(cmd, work_dir))
+    return hashlib.sha1(content.encode('utf-8', errors='replace')).hexdigest()
+
+def get_job_stage(cmd, ifok=None):
+    """任务所属阶段：ifok 在 00_IFOK 下的子目录名（如 04_FFT、05_search），否则为命令名"""
+    cmd_name = os.path.basename(split_cmd(cmd)[0]) if cmd.strip() else ""
+    if ifok:
+        parts = os.path.abspath(ifok).split(os.sep)
+        if '00_IFOK' in parts:
+            index = len(parts) - 1 - parts[::-1].index('00_IFOK')
+            stage = "/".join(parts[index + 1:-1])
+            if stage:
+                return stage
+    return cmd_name
+
+def get_option_value(list_tokens, option, default=None):
+    """返回命令行中某个选项后面的值"""
+    for k, token in enumerate(list_tokens[:-1]):
+        if token == option:
+            return list_tokens[k + 1]
+    return default
+
+def get_expected_outputs(cmd, work_dir):
+    """
+    各阶段命令预期生成的输出文件。
+    返回 [(文件路径, 是否要求非空), ...]，None 表示可选输出；无法识别的命令返回空列表（只检查返回码）。
+    对 "cmd && mv -f a b" 形式的组合命令，会把 mv 的重命名应用到输出列表上。
+    """
+    list_parts = [part.strip() for part in cmd.split('&&')]
+    list_tokens = split_cmd(list_parts[0])
+    if not list_tokens:
+        return []
+    cmd_name = os.path.basename(list_tokens[0])
+    infile = os.path.normpath(os.path.join(work_dir, list_tokens[-1]))
+    list_outputs = []
+
+    if cmd_name == 'prepsubband':
+        outname = get_option_value(list_tokens, '-o')
+        lodm = get_option_value(list_tokens, '-lodm')
+        dmstep = get_option_value(list_tokens, '-dmstep')
+        numdms = get_option_value(list_tokens, '-numdms')
+        if outname and lodm and dmstep and numdms and '-sub' not in list_tokens:
+            for i in range(int(numdms)):
+                basename = os.path.join(work_dir, "%s_DM%.2f" % (outname, float(lodm) + i * float(dmstep)))
+                list_outputs += [(basename + '.dat', True), (basename + '.inf', True)]
+        subdm = get_option_value(list_tokens, '-subdm')
+        nsub = get_option_value(list_tokens, '-nsub')
+        if outname and subdm and nsub and '-sub' in list_tokens:
+            basename = os.path.join(work_dir, "%s_DM%.2f" % (outname, float(subdm)))
+            list_outputs += [(basename + '.sub%04d' % (k), True) for k in range(int(nsub))] + [(basename + '.sub.inf', True)]
+    elif cmd_name == 'prepdata':
+        outname = get_option_value(list_tokens, '-o')
+        if outname:
+            basename = os.path.join(work_dir, outname)
+            list_outputs += [(basename + '.dat', True), (basename + '.inf', True)]
+    elif cmd_name in ('realfft', 'fused_fft.py'):
+        list_outputs.append((infile.replace('.dat', '.fft'), True))
+    elif cmd_name == 'rednoise':
+        list_outputs += [(infile.replace('.fft', '_red.fft'), True), (infile.replace('.fft', '_red.inf'), True)]
+    elif cmd_name == 'zapbirds':
+        list_outputs.append((infile, True))
+    elif cmd_name == 'accelsearch':
+        zmax = get_option_value(list_tokens, '-zmax', '200')
+        wmax = get_option_value(list_tokens, '-wmax')
+        accel_suffix = f"_ACCEL_{int(zmax)}" + (f"_JERK_{int(wmax)}" if wmax and int(wmax) > 0 else "")
+        # 没有候选体时 accelsearch 不生成 ACCEL 文件（之后会写 _empty 标记），因此只记录大小、只检查返回码
+        list_outputs.append((infile.replace('.fft', accel_suffix), None))
+    elif cmd_name == 'prepfold':
+        outname = get_option_value(list_tokens, '-o')
+        candnum = get_option_value(list_tokens, '-accelcand')
+        if outname and candnum:
+            basename = os.path.join(work_dir, f"{outname}_ACCEL_Cand_{candnum}")
+            list_outputs += [(basename + '.pfd', True), (basename + '.pfd.ps', True)]
+    elif cmd_name == 'rfifind':
+        outname = get_option_value(list_tokens, '-o')
+        if outname:
+            basename = os.path.join(work_dir, f"{outname}_rfifind")
+            list_outputs += [(basename + '.mask', True), (basename + '.stats', True)]
+    elif cmd_name == 'single_pulse_search.py' and infile.endswith('.dat'):
+        list_outputs.append((infile.replace('.dat', '.singlepulse'), False))
+    elif cmd_name == 'makezaplist.py':
+        list_outputs.append((infile.replace('.birds', '.zaplist'), True))
+
+    for part in list_parts[1:]:
+        list_mv = split_cmd(part)
+        if len(list_mv) >= 3 and list_mv[0] == 'mv':
+            src = os.path.normpath(os.path.join(work_dir, list_mv[-2]))
+            dst = os.path.normpath(os.path.join(work_dir, list_mv[-1]))
+            list_outputs = [(dst if os.path.normpath(path) == src else path, flag_nonempty) for path, flag_nonempty in list_outputs]
+    return list_outputs
+
+def get_outputs_size(list_outputs):
+    """输出文件的总大小（字节），不存在的文件按 0 计"""
+    total_bytes = 0
+    for path, _ in list_outputs:
+        try:
+            total_bytes += os.path.getsize(path)
+        except OSError:
+            pass
+    return total_bytes
+
+def flag_use_job_store(ifok):
+    """只有 .ifok/.txt 这类纯标记文件由数据库取代；以真实产物（png、zaplist 等）作为 ifok 时仍按文件判断"""
+    return job_store_path is not None and bool(ifok) and ifok.endswith(('.txt', '.ifok'))
+
+def record_job(job_key, cmd, work_dir, ifok, status, exit_code=None, log_file=None, t_start=None, t_end=None, output_bytes=None, attempts=None, cost=None):
+    """写入或更新一条任务记录（cost 为 None 时保留原有的估计值）"""
+    conn = connect_job_store()
+    with conn:
+        conn.execute("""INSERT INTO jobs (job_key, stage, cmd_name, ifok, cmd, work_dir, inputs, log_file, status, exit_code, attempts, host, t_start, t_end, duration, output_bytes, cost)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(job_key) DO UPDATE SET
+                            stage=excluded.stage, ifok=excluded.ifok, cmd=excluded.cmd, log_file=excluded.log_file,
+                            status=excluded.status, exit_code=excluded.exit_code, attempts=excluded.attempts,
+                            host=excluded.host, t_start=excluded.t_start, t_end=excluded.t_end,
+                            duration=excluded.duration, output_bytes=excluded.output_bytes,
+                            cost=COALESCE(excluded.cost, jobs.cost)""",
+                     (job_key, get_job_stage(cmd, ifok), os.path.basename(split_cmd(cmd)[0]), ifok, cmd, os.path.abspath(work_dir),
+                      "\n".join(get_cmd_input_files(cmd, work_dir)), log_file or None, status, exit_code, attempts or 0, socket.gethostname(),
+                      t_start, t_end, (t_end - t_start) if (t_start and t_end) else None, output_bytes, cost))
+    conn.close()
+
+def get_job_key_status():
+    """一次查询取出全部任务的 {键: 状态}"""
+    conn = connect_job_store()
+    dict_status = dict(conn.execute("SELECT job_key, status FROM jobs").fetchall())
+    conn.close()
+    return dict_status
+
+def get_latest_ifok_records():
+    """一次查询取出每个 (ifok, 工作目录) 最新一条记录的 {(ifok, 工作目录): (规范化的命令, 状态)}"""
+    conn = connect_job_store()
+    list_rows = conn.execute("SELECT ifok, work_dir, cmd, status FROM jobs WHERE ifok IS NOT NULL ORDER BY COALESCE(t_end, t_start, 0), rowid").fetchall()
+    conn.close()
+    return {(os.path.abspath(ifok), work_dir): (normalize_cmd(cmd or ''), status) for ifok, work_dir, cmd, status in list_rows}
+
+def check_job_done(cmd, ifok, work_dir, dict_status=None, dict_latest=None):
+    """
+    判断任务是否已完成。数据库中完全没有该任务的记录、但旧的 ifok 文件存在时，视为已完成并导入数据库；
+    有记录（如被 invalidate_jobs 置为 invalidated）时只按记录的状态判断，不再导入 ifok。
+    输入文件已被删除（如 .fft 已被生命周期管理回收）时任务键必然改变，此时以同一 ifok、同一命令最新一条记录的状态为准，
+    否则重新运行时这些任务会因为缺少输入而全部失败。
+    dict_status: 预先查询好的 {任务键: 状态}（批量判断时避免逐条查询）
+    dict_latest: 预先查询好的 get_latest_ifok_records()
+    """
+    job_key = get_job_key(cmd, work_dir)
+    if dict_status is not None:
+        status = dict_status.get(job_key)
+    else:
+        conn = connect_job_store()
+        row = conn.execute("SELECT status FROM jobs WHERE job_key = ?", (job_key,)).fetchone()
+        conn.close()
+        status = row[0] if row is not None else None
+    if status is None and check_inputs_missing(cmd, work_dir):
+        if dict_latest is None:
+            dict_latest = get_latest_ifok_records()
+        latest = dict_latest.get((os.path.abspath(ifok), os.path.abspath(work_dir)))
+        if latest is not None and latest[0] == normalize_cmd(cmd):
+            return latest[1] == 'done'
+    if status is None and os.path.isfile(ifok):
+        record_job(job_key, cmd, work_dir, ifok, 'done', output_bytes=get_outputs_size(get_expected_outputs(cmd, work_dir)))
+        return True
+    return status == 'done'
+
+def invalidate_jobs(stage=None, status=None, cmd_like=None, cmd=None):
+    """
+    使一个阶段（或满足条件的任务）失效，下次运行时重新执行；返回失效的记录数。
+    记录保留并置为 invalidated（不删除），这样残留的旧 ifok 文件不会被 check_job_done 重新导入为已完成。
+    cmd_like 为 SQL LIKE 模式（_ 和 % 是通配符），cmd 为完全相同的命令。
+    """
+    list_conditions, list_values = [], []
+    if stage is not None:
+        list_conditions.append("(stage = ? OR stage LIKE ?)")
+        list_values += [stage, stage.rstrip('/') + '/%']
+    if status is not None:
+        list_conditions.append("status = ?")
+        list_values.append(status)
+    if cmd_like is not None:
+        list_conditions.append("cmd LIKE ?")
+        list_values.append(cmd_like)
+    if cmd is not None:
+        list_conditions.append("cmd = ?")
+        list_values.append(cmd)
+    if not list_conditions:
+        raise ValueError("invalidate_jobs: 至少需要指定一个条件")
+    conn = connect_job_store()
+    with conn:
+        n_deleted = conn.execute("UPDATE jobs SET status = 'invalidated' WHERE " + " AND ".join(list_conditions), list_values).rowcount
+    conn.close()
+    return n_deleted
+
+###子进程输出的读取设置
+stream_chunk_bytes = 64 * 1024     # 每次从管道读取的字节数
+stream_tail_bytes = 16 * 1024      # 内存中保留的输出末尾字节数（用于报错）
+
+def stream_process_output(proc, log_handle=None):
+    """
+    逐块读取子进程的 stdout（stderr 已合并），实时写入日志并刷新，便于 tail -f 查看。
+    没有日志文件时直接输出到终端。内存中只保留末尾 stream_tail_bytes 字节。
+
+    Returns:
+        str: 输出的末尾部分
+    """
+    tail = deque()
+    n_tail = 0
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')   # 防止多字节字符被截断在两块之间
+    fd = proc.stdout.fileno()
+
+    def write_text(text):
+        if not text:
+            return
+        if log_handle:
+            log_handle.write(text)
+            log_handle.flush()
+        else:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+    while True:
+        chunk = os.read(fd, stream_chunk_bytes)
+        if not chunk:
+            # 输出结束时解码器中可能还留有不完整的多字节字符，final=True 将其输出为替换字符
+            write_text(decoder.decode(b'', final=True))
+            break
+        write_text(decoder.decode(chunk))
+        tail.append(chunk)
+        n_tail += len(chunk)
+        while n_tail - len(tail[0]) >= stream_tail_bytes:
+            n_tail -= len(tail.popleft())
+    proc.stdout.close()
+    return b''.join(tail)[-stream_tail_bytes:].decode('utf-8', errors='replace')
+
+###失败重试设置，由主程序根据配置调用 set_task_retry() 修改
+dict_task_retry = {'max_retries': 0, 'backoff_s': 30.0}
+
+def set_task_retry(max_retries, backoff_s):
+    """设置 run_cmd 失败后的重试次数和首次重试前的等待时间（秒，之后每次翻倍）"""
+    dict_task_retry['max_retries'] = max(0, int(max_retries))
+    dict_task_retry['backoff_s'] = max(0.0, float(backoff_s))
+
+def check_outputs(list_outputs):
+    """检查预期输出文件，返回问题描述列表（为空表示全部正常）"""
+    list_problems = []
+    for path, flag_nonempty in list_outputs:
+        if flag_nonempty is None:
+            continue
+        if not os.path.exists(path):
+            list_problems.append(f"缺少输出文件 {path}")
+        elif flag_nonempty and os.path.getsize(path) == 0:
+            list_problems.append(f"输出文件 {path} 大小为 0")
+    return list_problems
+
+def run_cmd(cmd, ifok=None, work_dir=None, log_file=None, dict_envs={}, flag_append=True,mode='both', expected_outputs=None, max_retries=None):
     """
     执行命令并记录日志，支持条件执行、目录切换、环境变量设置和日志记录。
+    只有命令正常退出（返回码为 0）且预期输出文件存在、非空时才算完成，否则按退避时间重试。
+    命令输出（stderr 合并到 stdout）边运行边写入日志，失败时打印输出末尾。
 
     Args:
         cmd (str): 要执行的命令。
@@ -206,19 +566,37 @@ def run_cmd(cmd, ifok=None, work_dir=None, log_file=None, dict_envs={}, flag_app
         log_file (str, optional): 日志文件路径。默认为None。
         dict_envs (dict, optional): 自定义环境变量。默认为空字典。
         flag_append (bool, optional): 是否追加日志。默认为False。
+        expected_outputs (list, optional): [(文件路径, 是否要求非空), ...]，默认由 get_expected_outputs 根据命令推断。
+        max_retries (int, optional): 失败后的最大重试次数，默认使用 set_task_retry 的设置。
+    Returns:
+        bool: 命令成功完成（或已完成而跳过）返回 True，重试用尽仍失败返回 False。
     """
-    if ifok and os.path.isfile(ifok):
+    global cwd
+    flag_store = flag_use_job_store(ifok)
+    if flag_store:
+        if check_job_done(cmd, ifok, work_dir or cwd):
+            print_log(f'Job {ifok} done (job store). Skipping command: {cmd}', log_file,mode=mode)
+            return True
+    elif ifok and os.path.isfile(ifok):
         print_log(f'File {ifok} exists. Skipping command: {cmd}', log_file,mode=mode)
-        return
+        return True
 
     start_time = time.time()
-    datetime_start = datetime.now().strftime("%Y/%m/%d %H:%M")
-    global cwd
 
     if work_dir:
         os.chdir(work_dir)
     else:
         work_dir = cwd
+    wait_for_buffer_inputs(cmd, work_dir)
+
+    if expected_outputs is None:
+        expected_outputs = get_expected_outputs(cmd, work_dir)
+    if max_retries is None:
+        max_retries = dict_task_retry['max_retries']
+
+    if flag_store:
+        job_key = get_job_key(cmd, work_dir)
+        record_job(job_key, cmd, work_dir, ifok, 'running', log_file=log_file, t_start=start_time, attempts=1, cost=estimate_task_cost(cmd, work_dir))
 
     log_mode = "a" if flag_append else "w"
     log_handle = open(log_file, log_mode, encoding='utf-8', errors='replace') if log_file else None
@@ -227,54 +605,74 @@ def run_cmd(cmd, ifok=None, work_dir=None, log_file=None, dict_envs={}, flag_app
     print_log(f'日志文件为：{log_file} /n ifok文件为：{ifok}',mode=mode)
     print_log(f'运行命令：{cmd}\n', log_file,masks=cmd,color=colors.OKCYAN)
 
-
-    if log_handle:
-        log_handle.write(f"****************************************************************\n")
-        log_handle.write(f"开始日期和时间：{datetime_start}\n")
-        log_handle.write(f"命令：{cmd}\n")
-        log_handle.write(f"工作目录：{work_dir}\n")
-        log_handle.write(f"****************************************************************\n")
-        log_handle.flush()
-
     env = os.environ.copy()
     env.update(dict_envs)
     env['LC_ALL'] = 'C'          # 强制英文输出
     env['LANG'] = 'C'
-    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, cwd=work_dir)
-    stdout, stderr = proc.communicate()
 
-    try:
-        stdout_str = stdout.decode('utf-8', errors='replace')
-    except Exception as dec_err:
-        stdout_str = f"[无法解码 stdout: {dec_err}]\n原始字节 repr: {stdout!r}"
-    try:
-        stderr_str = stderr.decode('utf-8', errors='replace')
-    except Exception as dec_err:
-        stderr_str = f"[无法解码 stderr: {dec_err}]\n原始字节 repr: {stderr!r}"
+    for attempt in range(1, max_retries + 2):
+        datetime_start = datetime.now().strftime("%Y/%m/%d %H:%M")
+        attempt_start_time = time.time()
+        if log_handle:
+            log_handle.write(f"****************************************************************\n")
+            log_handle.write(f"开始日期和时间：{datetime_start}\n")
+            log_handle.write(f"命令：{cmd}\n")
+            log_handle.write(f"工作目录：{work_dir}\n")
+            if attempt > 1:
+                log_handle.write(f"第 {attempt} 次尝试（最多 {max_retries + 1} 次）\n")
+            log_handle.write(f"****************************************************************\n")
+            log_handle.flush()
+
+        # stderr 合并到 stdout，边读边写入日志，内存中只保留末尾一段用于报错
+        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env, cwd=work_dir)
+        output_tail = stream_process_output(proc, log_handle)
+        proc.wait()
+
+        datetime_end = datetime.now().strftime("%Y/%m/%d %H:%M")
+        execution_time = time.time() - attempt_start_time
+
+        # 返回码和预期输出都正常才算完成
+        list_problems = []
+        if proc.returncode != 0:
+            list_problems.append(f"返回码为 {proc.returncode}")
+        list_problems += check_outputs(expected_outputs)
+
+        if log_handle:
+            log_handle.write(f"\n结束日期和时间：{datetime_end}\n")
+            log_handle.write(f"总耗时：{execution_time:.2f} 秒\n")
+            if list_problems:
+                log_handle.write("任务失败：" + "；".join(list_problems) + "\n")
+            log_handle.flush()
+
+        if not list_problems:
+            break
+
+        print_log(f"命令失败（第 {attempt}/{max_retries + 1} 次）：{cmd}\n    " + "\n    ".join(list_problems), log_file, color=colors.ERROR, mode=mode)
+        if output_tail.strip():
+            print_log(f"输出末尾：\n{output_tail}", color=colors.ERROR, mode='p')
+        if attempt <= max_retries:
+            wait_time = dict_task_retry['backoff_s'] * 2 ** (attempt - 1)
+            print_log(f"{wait_time:.0f} 秒后重试...", log_file, color=colors.WARNING, mode=mode)
+            if flag_store:
+                record_job(job_key, cmd, work_dir, ifok, 'running', exit_code=proc.returncode, log_file=log_file, t_start=start_time, attempts=attempt + 1)
+            time.sleep(wait_time)
 
     if log_handle:
-        log_handle.write(stdout_str)
-        log_handle.write(stderr_str)
-    else:
-        print(stdout_str)
-        if stderr_str:
-            print_log(f"Error: {stderr_str}", log_file, color=colors.ERROR)
-
-    datetime_end = datetime.now().strftime("%Y/%m/%d %H:%M")
-    execution_time = time.time() - start_time
-
-    if log_handle:
-        log_handle.write(f"\n结束日期和时间：{datetime_end}\n")
-        log_handle.write(f"总耗时：{execution_time:.2f} 秒\n")
-        
-        log_handle.write(stdout_str)
-        log_handle.write(stderr_str)
         log_handle.close()
 
     append_to_script_if_not_exists(os.path.join(work_dir, 'cmd.sh'),f'#程序运行路径为: {work_dir}\n{cmd}\n')
     time_consum(start_time,cmd=cmd,mode=mode)
 
-    if ifok and ifok.endswith(('.txt', '.ifok')):
+    flag_success = not list_problems
+    if flag_store:
+        # 记录到数据库后不再生成 ifok 文件和 rm 脚本，阶段失效请使用 jobdb.py invalidate
+        record_job(job_key, cmd, work_dir, ifok, 'done' if flag_success else 'failed', exit_code=proc.returncode, log_file=log_file,
+                   t_start=start_time, t_end=time.time(), output_bytes=get_outputs_size(expected_outputs), attempts=attempt)
+        os.chdir(cwd)
+        return flag_success
+
+    # 失败的任务不写 ifok，下次运行时会重新执行
+    if flag_success and ifok and ifok.endswith(('.txt', '.ifok')):
         with open(ifok, 'a', encoding='utf-8') as f:
             f.write(f"#Command executed:\n {cmd}\n")
     os.chdir(cwd)
@@ -290,6 +688,7 @@ def run_cmd(cmd, ifok=None, work_dir=None, log_file=None, dict_envs={}, flag_app
         append_to_script_if_not_exists(rm_script_path, f"rm -f {ifok}\n")
         append_to_script_if_not_exists(rm_script_path, f"echo 'Deleted {ifok}'\n")
         os.chmod(rm_script_path, 0o755)
+    return flag_success
 
 def check_presto_path(presto_path, key):
     # 检查 PRESTO 路径是否存在
@@ -308,44 +707,259 @@ def check_presto_path(presto_path, key):
         print("请确保配置文件中 %s 的路径设置正确。" % (key))
         exit()
 
-def check_if_enough_disk_space(root_workdir, num_DMs, T_obs_s, t_samp_s, flag_remove_fftfiles):
-    # 获取根工作目录的磁盘使用情况
-    disk_space = shutil.disk_usage(root_workdir)
-    disk_space_free_bytes = disk_space.free  # 可用磁盘空间（字节）
+# 存储规划中除时间序列以外各类输出文件的估计大小（字节），按实际运行结果粗略取值
+dict_storage_estimates = {
+    'block': 4096,                    # 文件系统块大小，小文件（inf、ifok、日志）至少占一个块
+    'accel_per_zmax': 64 * 1024,      # 每个 DM、每个 zmax 的 ACCEL、.cand、.txtcand
+    'singlepulse': 256 * 1024,        # 每个 DM 的 .singlepulse
+    'fold': 6 * 1024**2,              # 每个折叠候选体的 pfd、bestprof、ps、png
+}
 
-    # 计算全长度数据的采样点数和数据文件大小
-    N_samples_per_datfile_full = int(T_obs_s / t_samp_s)  # 全长度数据的采样点数
-    datfile_full_size_bytes = N_samples_per_datfile_full * 4  # 全长度数据文件大小（字节）
-
-    # 如果不删除 .fft 文件，则每个 DM 试验占用的空间将翻倍
-    if flag_remove_fftfiles == 0:
-        datfile_full_size_bytes = datfile_full_size_bytes * 2
+def plan_storage(list_DDplan_scheme, N_samples, t_samp_s, nchan, rfifind_time_s, n_zmax, n_pool=1, ifbary=0, ifdeorb=0,
+                 flag_dataflow=0, flag_remove_fftfiles=0, fold_num=0, flag_singlepulse=0, n_deorb_templates=1):
+    """
+    按流程顺序估计每一步新增（或删除）的文件大小，得到整个流程的磁盘占用曲线和峰值。
 
-    # 计算全长度搜索所需的磁盘空间
-    full_length_search_size_bytes = num_DMs * datfile_full_size_bytes
+    时间序列大小由 DDplan 决定：每个 DM 的 .dat 为 4 * N_samples / downsamp 字节，.fft 与 .dat 同样大小。
+    质心修正和去轨道调制各自再写一份完整的 .dat；分阶段模式下去红噪声时所有 _red.fft 与原 .fft 同时存在，
+    数据流模式下同时存在的 _red.fft 只有 n_pool 个。
+    使用去轨道调制模板库时每个 DM 写出 n_deorb_templates 条时间序列，之后的 FFT、搜寻和单脉冲搜索都按 模板 × DM 计算。
 
-    if flag_remove_fftfiles == 0:
-        print_log("是否删除 .fft 文件？否  --> 每个 DM 试验将占用双倍空间")
+    Returns:
+        dict: stages 为 [(步骤, 新增字节数, 新增文件数, 累计字节数), ...]，以及 peak_bytes、peak_stage、final_bytes、n_files
+    """
+    block = dict_storage_estimates['block']
+    n_DMs = sum(int(scheme['num_DMs']) for scheme in list_DDplan_scheme)
+    total_dat = sum(int(scheme['num_DMs']) * 4 * int(np.ceil(N_samples / max(1, int(scheme['downsamp'])))) for scheme in list_DDplan_scheme)
+    max_dat = max([4 * int(np.ceil(N_samples / max(1, int(scheme['downsamp'])))) for scheme in list_DDplan_scheme] or [0])
+
+    plan = {'stages': [], 'peak_bytes': 0, 'peak_stage': '', 'final_bytes': 0, 'n_files': 0}
+
+    def add_stage(name, delta_bytes, delta_files=0):
+        plan['final_bytes'] += int(delta_bytes)
+        plan['n_files'] += int(delta_files)
+        plan['stages'].append((name, int(delta_bytes), int(delta_files), plan['final_bytes']))
+        if plan['final_bytes'] > plan['peak_bytes']:
+            plan['peak_bytes'] = plan['final_bytes']
+            plan['peak_stage'] = name
+
+    # rfifind 的 mask 和 stats 每个时间间隔、每个通道约 13 字节
+    n_intervals = max(1, int(N_samples * t_samp_s / max(float(rfifind_time_s), 1e-3)))
+    add_stage('rfifind', n_intervals * nchan * 13 + 8 * block, 8)
+    add_stage('birdies', 2 * 4 * N_samples + 6 * block, 6)
+
+    # 每个 DM 每一步另有 inf、ifok、日志等小文件
+    add_stage('prepsubband', total_dat + 3 * n_DMs * block, 3 * n_DMs)
+    if ifbary == 1:
+        add_stage('prepdata-bary', total_dat + 3 * n_DMs * block, 3 * n_DMs)
+    if ifdeorb == 1:
+        n_deorb_templates = max(1, int(n_deorb_templates))
+        add_stage('deorb', n_deorb_templates * (total_dat + 3 * n_DMs * block), 3 * n_DMs * n_deorb_templates)
+        total_dat *= n_deorb_templates
+        n_DMs *= n_deorb_templates
+
+    if flag_dataflow == 1:
+        red_transient = min(n_pool, n_DMs) * max_dat
     else:
-        print_log("是否删除 .fft 文件？是")
-
-    size_G = f"{full_length_search_size_bytes / 1.0e9:4.2f}" 
-    print_log(f"全长度搜索：~{size_G} GB       ({num_DMs} DM 试验 * 每次试验 {datfile_full_size_bytes / 1.0e6:5.0f} MB)",masks=size_G,color=colors.OKGREEN)
-
-    # 初始化总搜索所需空间
-    total_search_size_bytes = full_length_search_size_bytes
+        red_transient = total_dat
+    add_stage('realfft', total_dat + 2 * n_DMs * block, 2 * n_DMs)
+    add_stage('rednoise', red_transient + 3 * n_DMs * block, 3 * n_DMs)
+    add_stage('rednoise-rename', -red_transient)
+    add_stage('accelsearch', n_DMs * n_zmax * dict_storage_estimates['accel_per_zmax'] + n_DMs * n_zmax * 2 * block, n_DMs * (4 + 5 * n_zmax))
+    if flag_remove_fftfiles == 1:
+        add_stage('remove-fft', -total_dat, -n_DMs)
+
+    add_stage('prepfold', fold_num * dict_storage_estimates['fold'], 6 * fold_num)
+    if flag_singlepulse == 1:
+        add_stage('single_pulse', n_DMs * dict_storage_estimates['singlepulse'], n_DMs)
+    return plan
+
+def get_pipeline_output_bytes(root_workdir, list_prefixes=('01_', '02_', '03_', '04_', '05_', '06_')):
+    """
+    统计工作目录下已有的流程输出大小（不跟随符号链接），断点续跑时这些文件已经占用了磁盘空间。
+    """
+    total_bytes = 0
+    list_dirs = [os.path.join(root_workdir, name) for name in os.listdir(root_workdir) if name.startswith(list_prefixes)]
+    while list_dirs:
+        current_dir = list_dirs.pop()
+        try:
+            with os.scandir(current_dir) as it:
+                for entry in it:
+                    if entry.is_symlink():
+                        continue
+                    if entry.is_dir():
+                        list_dirs.append(entry.path)
+                    elif entry.is_file():
+                        total_bytes += entry.stat().st_size
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+    return total_bytes
 
-    # 输出预估的磁盘空间使用情况和可用磁盘空间
-    size_G = f"{1.1 * total_search_size_bytes / 1.0e9:5.2f}" 
-    size_G_total = f"{disk_space_free_bytes / 1.0e9:5.2f}" 
-    print_log(f"预期磁盘空间使用量：~{size_G} GB",masks=size_G,color=colors.OKGREEN)
+def check_storage_plan(root_workdir, dict_plan_args, existing_bytes=0, safety_margin=1.1):
+    """
+    在启动前按当前配置给出各步骤的磁盘占用和峰值，与可用空间、可用 inode 比较。
+    空间不足时依次评估：搜索后删除 .fft、数据流模式，打印能放下的方案。
 
-    if disk_space_free_bytes > 1.1 * total_search_size_bytes:
-        print_log(f"可用磁盘空间：~{size_G_total} GB   --> 太好了！磁盘空间足够。",masks=size_G_total,color=colors.OKGREEN)
+    Args:
+        dict_plan_args (dict): 传给 plan_storage 的参数
+        existing_bytes (int): 工作目录中已有的流程输出（断点续跑时这部分已计入已用空间）
+        safety_margin (float): 峰值的安全系数
+    Returns:
+        bool: 当前配置能否放下
+    """
+    disk_space_free_bytes = shutil.disk_usage(root_workdir).free
+    stat = os.statvfs(root_workdir)
+    inodes_free = stat.f_favail if stat.f_files > 0 else None
+    # 已有输出在规划中也会被计入，这部分不需要再占用新的空间
+    available_bytes = disk_space_free_bytes + existing_bytes
+
+    plan = plan_storage(**dict_plan_args)
+    print_log("%-24s %12s %10s %12s" % ("步骤", "新增 (GB)", "新增文件", "累计 (GB)"), color=colors.OKBLUE)
+    for name, delta_bytes, delta_files, footprint in plan['stages']:
+        print("%-24s %12.2f %10d %12.2f" % (name, delta_bytes / 1.0e9, delta_files, footprint / 1.0e9))
+
+    size_peak = f"{safety_margin * plan['peak_bytes'] / 1.0e9:.2f}"
+    size_free = f"{available_bytes / 1.0e9:.2f}"
+    print_log(f"峰值磁盘占用：~{size_peak} GB（出现在 {plan['peak_stage']} 步骤，含安全系数 {safety_margin}），结束时 ~{plan['final_bytes'] / 1.0e9:.2f} GB",masks=size_peak,color=colors.OKGREEN)
+    print_log(f"可用磁盘空间：~{size_free} GB（其中已有输出 {existing_bytes / 1.0e9:.2f} GB）",masks=size_free,color=colors.OKGREEN)
+
+    flag_fits = safety_margin * plan['peak_bytes'] <= available_bytes
+    if inodes_free is not None and plan['n_files'] > inodes_free:
+        print_log(f"可用 inode 不足：需要约 {plan['n_files']} 个文件，剩余 {inodes_free} 个！",color=colors.ERROR)
+        flag_fits = False
+
+    if flag_fits:
+        print_log("磁盘空间足够。",color=colors.OKGREEN)
         return True
+
+    print_log("按当前配置磁盘空间不足，评估其他清理方案：",color=colors.WARNING)
+    list_alternatives = []
+    if dict_plan_args.get('flag_remove_fftfiles', 0) != 1:
+        list_alternatives.append(("FLAG_REMOVE_FFTFILES 1", {'flag_remove_fftfiles': 1}))
+    if dict_plan_args.get('flag_dataflow', 0) != 1:
+        list_alternatives.append(("FLAG_DATAFLOW 1", {'flag_dataflow': 1}))
+        list_alternatives.append(("FLAG_DATAFLOW 1 + FLAG_REMOVE_FFTFILES 1", {'flag_dataflow': 1, 'flag_remove_fftfiles': 1}))
+
+    for name, dict_update in list_alternatives:
+        dict_args = dict(dict_plan_args)
+        dict_args.update(dict_update)
+        alt_peak = safety_margin * plan_storage(**dict_args)['peak_bytes']
+        if alt_peak <= available_bytes:
+            print_log(f"  {name}：峰值 ~{alt_peak / 1.0e9:.2f} GB  --> 可以放下",masks=name,color=colors.OKGREEN)
+            break
+        print_log(f"  {name}：峰值 ~{alt_peak / 1.0e9:.2f} GB  --> 仍然不足",color=colors.WARNING)
     else:
-        print_log(f"可用磁盘空间：~{size_G_total} GB   --> 哎呀！磁盘空间不足！ ",masks=size_G_total,color=colors.ERROR)
-        return False
+        print_log("以上方案都放不下，请释放空间、更换工作目录，或缩小 DM 范围分多次运行。",color=colors.ERROR)
+    return False
+
+# 中间文件生命周期：每个文件登记剩余的使用者（按使用者任务的 ifok 判断是否完成），最后一个使用者完成后删除或归档
+dict_lifecycle = {'artifacts': {}, 'finished': set(), 'pinned': set(), 'remove_suffixes': (), 'archive_dir': '', 'manifest_file': ''}
+
+def set_lifecycle(remove_suffixes, archive_dir="", manifest_file=""):
+    """
+    remove_suffixes: 允许回收的文件后缀，例如 ('.fft', '.dat')；为空时只登记不删除
+    archive_dir: 不为空时把文件移动到该目录而不是删除
+    manifest_file: 不为空时把每个回收文件的原路径追加到该文件，修复模式据此区分被回收的文件和真正缺失的文件
+    """
+    dict_lifecycle['remove_suffixes'] = tuple(remove_suffixes)
+    dict_lifecycle['archive_dir'] = archive_dir
+    dict_lifecycle['manifest_file'] = manifest_file
+    if archive_dir:
+        makedir(archive_dir)
+
+def lifecycle_register(list_paths, consumer, list_ifoks=None):
+    """
+    登记 list_paths 中每个文件的一个使用者。list_ifoks 与 list_paths 一一对应，ifok 完成即该使用者完成；
+    不提供 ifok 的使用者需要调用 lifecycle_finish 才算完成。
+    """
+    for k, path in enumerate(list_paths):
+        dict_consumers = dict_lifecycle['artifacts'].setdefault(os.path.realpath(path), {})
+        dict_consumers[consumer] = list_ifoks[k] if list_ifoks else None
+
+def lifecycle_finish(consumer):
+    """标记某个没有逐文件 ifok 的使用者（例如整个折叠步骤）已完成"""
+    dict_lifecycle['finished'].add(consumer)
+
+def lifecycle_pin(list_paths):
+    """固定的文件不会被回收"""
+    for path in list_paths:
+        dict_lifecycle['pinned'].add(os.path.realpath(path))
+
+def lifecycle_pin_from_script(script_path):
+    """固定折叠脚本（如 script_fold_ts.txt）中用到的 .dat 文件，保证之后还能按脚本重新折叠"""
+    list_paths = []
+    if os.path.isfile(script_path):
+        with open(script_path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if parts and parts[0] == 'prepfold' and parts[-1].endswith('.dat'):
+                    list_paths.append(parts[-1])
+    lifecycle_pin(list_paths)
+    return len(list_paths)
+
+def get_done_ifoks(list_ifoks):
+    """
+    返回 list_ifoks 中已完成的部分。使用任务数据库时，.ifok/.txt 标记以数据库中该 ifok 最新一条记录的状态为准
+    （与 check_job_done 一致：被 invalidate_jobs 置为 invalidated 的任务即使残留旧 ifok 也不算完成），
+    数据库中完全没有记录时才按 ifok 文件判断。
+    """
+    if job_store_path is None:
+        return set(ifok for ifok in list_ifoks if os.path.isfile(ifok))
+    conn = connect_job_store()
+    # 同一个 ifok 可能对应多个任务键（输入变化后重新运行），按运行时间取最新的记录
+    dict_db_status = dict(conn.execute("SELECT ifok, status FROM jobs WHERE ifok IS NOT NULL ORDER BY COALESCE(t_end, t_start, 0), rowid").fetchall())
+    conn.close()
+    dict_db_status = {os.path.abspath(ifok): status for ifok, status in dict_db_status.items()}
+    set_done = set()
+    for ifok in list_ifoks:
+        status = dict_db_status.get(os.path.abspath(ifok)) if flag_use_job_store(ifok) else None
+        if status is not None:
+            if status == 'done':
+                set_done.add(ifok)
+        elif os.path.isfile(ifok):
+            set_done.add(ifok)
+    return set_done
+
+def lifecycle_collect():
+    """
+    删除（或归档）所有使用者都已完成且没有被固定的中间文件。
+    Returns:
+        tuple: (回收的文件数, 释放的字节数)
+    """
+    list_candidates = [(path, dict_consumers) for path, dict_consumers in dict_lifecycle['artifacts'].items()
+                       if dict_lifecycle['remove_suffixes'] and path.endswith(dict_lifecycle['remove_suffixes']) and path not in dict_lifecycle['pinned']]
+    set_done = get_done_ifoks([ifok for _, dict_consumers in list_candidates for ifok in dict_consumers.values() if ifok])
+
+    n_removed = 0
+    bytes_freed = 0
+    list_reclaimed = []
+    for path, dict_consumers in list_candidates:
+        if not all(consumer in dict_lifecycle['finished'] or (ifok is not None and ifok in set_done) for consumer, ifok in dict_consumers.items()):
+            continue
+        if os.path.isfile(path):
+            bytes_freed += os.path.getsize(path)
+            if dict_lifecycle['archive_dir']:
+                shutil.move(path, os.path.join(dict_lifecycle['archive_dir'], os.path.basename(path)))
+            else:
+                os.remove(path)
+            n_removed += 1
+            list_reclaimed.append(path)
+        del dict_lifecycle['artifacts'][path]
+    if list_reclaimed and dict_lifecycle['manifest_file']:
+        with open(dict_lifecycle['manifest_file'], 'a') as f:
+            f.writelines(path + '\n' for path in list_reclaimed)
+    return n_removed, bytes_freed
+
+def read_lifecycle_manifest(manifest_file, work_dir=None):
+    """读取已回收文件的路径；给出 work_dir 时只返回该目录下的文件名"""
+    if not manifest_file or not os.path.isfile(manifest_file):
+        return set()
+    with open(manifest_file, 'r') as f:
+        set_paths = set(line.strip() for line in f if line.strip())
+    if work_dir is None:
+        return set_paths
+    real_dir = os.path.realpath(work_dir)
+    return set(os.path.basename(path) for path in set_paths if os.path.dirname(path) == real_dir)
 
 def return_all_par_files(pulsar_list_file):
     """
@@ -389,8 +1003,562 @@ def return_all_par_files(pulsar_list_file):
 ###多线程函数最终优化版
 #需要参数：进程池数，总进程名，cmd列表，判断是否需要运行的文件列表
 def child_task(cmd, ifok,logfile, work_dir):
-    """子任务执行函数"""
-    run_cmd(cmd, ifok = ifok, work_dir=work_dir,log_file=logfile,mode='both')  #根据ifok判断是否运行cmd
+    """子任务执行函数，重试后仍失败时抛出异常，由进程池的错误回调记录"""
+    if not run_cmd(cmd, ifok = ifok, work_dir=work_dir,log_file=logfile,mode='both'):  #根据ifok判断是否运行cmd
+        raise RuntimeError(f"命令失败（日志：{logfile}）：{cmd}")
+
+###任务耗时模型：估计每个任务的相对开销，按从长到短的顺序提交（longest job first），
+#避免少数耗时任务（高 zmax 搜寻、原始数据折叠、大的 prepsubband 方案）最后才开始而拖长收尾时间。
+#启用任务数据库时，用历史记录（各阶段 实际耗时/估计开销）把开销换算成秒，并预测整体耗时。
+list_cost_cmd_names = ('prepsubband', 'prepdata', 'realfft', 'rednoise', 'zapbirds', 'fused_fft.py', 'deorb_bank.py', 'accelsearch', 'prepfold', 'rfifind', 'single_pulse_search.py')
+# 没有历史记录时使用的先验：每单位开销（estimate_task_cost）的秒数，按典型单核速度粗略取值。
+# 开销正比于输入字节数（.dat 为 4 × N_samples，prepsubband 再乘 DM 个数），所以首次运行的预测随 N_samples × DM 数缩放
+dict_cost_prior_rates = {
+    'prepsubband': 1e-9, 'prepdata': 2e-8, 'realfft': 1.5e-8, 'rednoise': 1e-8, 'zapbirds': 5e-9,
+    'fused_fft.py': 2.5e-8, 'deorb_bank.py': 2e-8, 'accelsearch': 1e-9, 'prepfold': 3e-8, 'rfifind': 6e-8,
+    'single_pulse_search.py': 5e-8,
+}
+
+def get_cmd_input_bytes(cmd, work_dir):
+    """命令中输入文件的总大小（字节，支持通配符），不存在的文件按 0 计"""
+    total_bytes = 0
+    for token in split_cmd(cmd):
+        if token.startswith('-') or not token.endswith(list_job_input_suffixes):
+            continue
+        for path in glob.glob(os.path.join(work_dir, token)):
+            try:
+                total_bytes += os.path.getsize(path)
+            except OSError:
+                pass
+    return total_bytes
+
+def get_cost_cmd_name(cmd):
+    """组合命令中第一个可估计开销的命令名及其后的参数"""
+    list_tokens = split_cmd(cmd)
+    for k, token in enumerate(list_tokens):
+        if os.path.basename(token) in list_cost_cmd_names:
+            return os.path.basename(token), list_tokens[k:]
+    return "", list_tokens
+
+def estimate_task_cost(cmd, work_dir):
+    """
+    任务的相对开销（无单位）：以输入数据量为基础，按命令类型乘以计算量因子。
+        prepsubband: DM 个数 / 降采样倍数
+        accelsearch: z 平面数 × w 平面数 × 叠加谐波数
+    同一阶段内的任务之间可以比较，不同阶段之间需用历史耗时（或 dict_cost_prior_rates）换算。
+    输入文件尚不存在时（如数据流中还没生成的 .fft）按一条完整时间序列 4 × N_samples 字节计。
+    """
+    cmd_name, list_tokens = get_cost_cmd_name(cmd)
+    cost = float(max(get_cmd_input_bytes(cmd, work_dir) or 4 * dict_obs_params['N_samples'], 1))
+    try:
+        if cmd_name == 'prepsubband':
+            numdms = int(get_option_value(list_tokens, '-numdms', 1))
+            downsamp = int(get_option_value(list_tokens, '-downsamp', 1))
+            cost *= 1 + numdms / max(downsamp, 1)
+        elif cmd_name == 'accelsearch':
+            zmax = int(get_option_value(list_tokens, '-zmax', 200))
+            wmax = int(get_option_value(list_tokens, '-wmax', 0))
+            numharm = int(get_option_value(list_tokens, '-numharm', 8))
+            cost *= (zmax + 1) * (wmax // 10 + 1) * numharm
+    except ValueError:
+        pass
+    return cost
+
+def get_stage_cost_history():
+    """
+    从任务数据库读取历史耗时。
+    Returns:
+        tuple: ({阶段: 秒/单位开销}, {任务键: 实际耗时})
+    """
+    conn = connect_job_store()
+    dict_rates = {}
+    for stage, sum_duration, sum_cost in conn.execute("""SELECT stage, SUM(duration), SUM(cost) FROM jobs
+                                                          WHERE status = 'done' AND duration > 0 AND cost > 0 GROUP BY stage"""):
+        dict_rates[stage] = sum_duration / sum_cost
+    dict_durations = dict(conn.execute("SELECT job_key, duration FROM jobs WHERE status = 'done' AND duration > 0"))
+    conn.close()
+    return dict_rates, dict_durations
+
+def predict_task_times(cmd_list, ifok_list, work_dir):
+    """
+    估计每个任务的开销和耗时（秒）：优先使用同一任务的实际耗时，其次用该阶段的历史速率，
+    都没有时（首次运行、未启用任务数据库）用命令类型的先验速率 dict_cost_prior_rates。
+    Returns:
+        tuple: (开销列表, 耗时列表, 使用先验的任务数)，无法估计的任务耗时为 None
+    """
+    list_costs = [estimate_task_cost(cmd, work_dir) for cmd in cmd_list]
+    list_seconds = [None] * len(cmd_list)
+    dict_rates, dict_durations = get_stage_cost_history() if job_store_path is not None else ({}, {})
+    n_prior = 0
+    for k, (cmd, ifok) in enumerate(zip(cmd_list, ifok_list)):
+        if dict_durations:
+            job_key = get_job_key(cmd, work_dir)
+            if job_key in dict_durations:
+                list_seconds[k] = dict_durations[job_key]
+                continue
+        stage = get_job_stage(cmd, ifok)
+        if stage in dict_rates:
+            list_seconds[k] = list_costs[k] * dict_rates[stage]
+        elif get_cost_cmd_name(cmd)[0] in dict_cost_prior_rates:
+            list_seconds[k] = list_costs[k] * dict_cost_prior_rates[get_cost_cmd_name(cmd)[0]]
+            n_prior += 1
+    return list_costs, list_seconds, n_prior
+
+def predict_makespan(list_seconds, num_processes):
+    """按提交顺序把任务分给最先空闲的进程，返回预计的总耗时（秒）"""
+    list_finish = [0.0] * max(1, min(num_processes, len(list_seconds)))
+    for seconds in list_seconds:
+        heapq.heapreplace(list_finish, list_finish[0] + seconds)
+    return max(list_finish)
+
+def order_tasks_by_cost(num_processes, task_name, cmd_list, ifok_list, work_dir):
+    """
+    按估计耗时从长到短排序任务。
+    Returns:
+        tuple: (排序后的下标列表, 预计总耗时（秒），有任务无法估计耗时时为 None)
+    """
+    list_costs, list_seconds, n_prior = predict_task_times(cmd_list, ifok_list, work_dir)
+    flag_seconds = len(cmd_list) > 0 and all(seconds is not None for seconds in list_seconds)
+    list_keys = list_seconds if flag_seconds else list_costs
+    list_order = sorted(range(len(cmd_list)), key=lambda k: -list_keys[k])
+    predicted_makespan = None
+    if flag_seconds:
+        predicted_makespan = predict_makespan([list_seconds[k] for k in list_order], num_processes)
+        string_prior = f"，其中 {n_prior} 个任务按先验速率估计" if n_prior > 0 else ""
+        print_log(f"{task_name}: 预计总耗时 {format_execution_time(predicted_makespan)}（{len(cmd_list)} 个任务，{num_processes} 核{string_prior}）", color=colors.OKBLUE)
+    return list_order, predicted_makespan
+
+def report_makespan(task_name, predicted_makespan, start_time):
+    """打印预计与实际总耗时，用于检查耗时模型"""
+    actual_makespan = time.time() - start_time
+    if predicted_makespan is None:
+        print_log(f"{task_name}: 实际总耗时 {format_execution_time(actual_makespan)}（部分任务无法估计耗时，未预测）", color=colors.OKBLUE)
+    else:
+        print_log(f"{task_name}: 预计总耗时 {format_execution_time(predicted_makespan)}，实际总耗时 {format_execution_time(actual_makespan)}"
+                  f"（实际/预计 = {actual_makespan / max(predicted_makespan, 1e-6):.2f}）", color=colors.OKBLUE)
+
+###资源预算：按每个任务的线程数（-ncpus）和估计内存决定何时提交，避免超订或核空闲
+#主程序总是根据配置调用 set_resource_budget()，配置为 0 时取全部核和当前可用内存的 90%，因此准入控制总是开启：
+#ACCELSEARCH_FLAGS/PREPFOLD_FLAGS 中的 -ncpus 大于 1 时，同时运行的任务数可能少于 POOL_NUM（调用之前的初始值 0 表示不限制）
+dict_resource_budget = {'cpus': 0, 'mem_bytes': 0}
+admit_max_skips = 8     # 队首任务被回填越过的次数达到该值后不再回填，为队首预留资源，防止大任务一直等不到
+#观测参数（通道数、采样点数、子带数），用于估计 prepsubband 等读原始数据的任务内存，由 set_obs_params() 设置
+dict_obs_params = {'nchan': 4096, 'N_samples': 0, 'nsub': 0}
+#prepsubband/rfifind/prepfold 处理原始数据时每次读入的采样点数（估计值）
+raw_block_samples = 32768
+# 内存盘暂存（如 /dev/shm）：每个 DM 的 FFT 链在暂存目录中完成，capacity_bytes 为同时占用暂存空间的上限
+dict_staging = {'dir': '', 'capacity_bytes': 0}
+
+def get_available_mem_bytes():
+    """当前可用内存（字节），读取 /proc/meminfo，失败时返回 0"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+def set_resource_budget(cpu_budget=0, mem_budget_gb=0):
+    """
+    设置核数和内存预算（在创建进程池之前调用）。
+    cpu_budget <= 0 时使用全部核；mem_budget_gb <= 0 时使用当前可用内存的 90%。
+    """
+    dict_resource_budget['cpus'] = int(cpu_budget) if cpu_budget > 0 else cpu_count()
+    dict_resource_budget['mem_bytes'] = int(mem_budget_gb * 1024**3) if mem_budget_gb > 0 else int(0.9 * get_available_mem_bytes())
+    print_log(f"资源预算：{dict_resource_budget['cpus']} 核，内存 {dict_resource_budget['mem_bytes'] / 1024**3:.1f} GB", color=colors.OKBLUE)
+
+def set_obs_params(nchan, N_samples, nsub=0):
+    dict_obs_params['nchan'] = int(nchan)
+    dict_obs_params['N_samples'] = int(N_samples)
+    dict_obs_params['nsub'] = int(nsub) if nsub else int(nchan)
+
+def set_staging(staging_dir, capacity_gb=0):
+    """
+    设置内存盘暂存目录（在创建进程池之前调用）。staging_dir 为空时不使用暂存。
+    capacity_gb <= 0 时使用暂存目录所在文件系统当前可用空间的 80%。
+    """
+    if not staging_dir:
+        dict_staging['dir'] = ''
+        dict_staging['capacity_bytes'] = 0
+        return
+    makedir(staging_dir)
+    dict_staging['dir'] = os.path.abspath(staging_dir)
+    dict_staging['capacity_bytes'] = int(capacity_gb * 1024**3) if capacity_gb > 0 else int(0.8 * shutil.disk_usage(staging_dir).free)
+    print_log(f"内存盘暂存：{dict_staging['dir']}，容量上限 {dict_staging['capacity_bytes'] / 1024**3:.1f} GB", color=colors.OKBLUE)
+
+def check_staging_task(cmd):
+    return bool(dict_staging['dir']) and cmd.startswith(f"mkdir -p {dict_staging['dir']}/")
+
+def estimate_task_resources(cmd, work_dir):
+    """
+    估计任务占用的线程数、内存（字节）和暂存空间（字节）。
+    线程数取命令中的 -ncpus（默认 1）；内存按 4 字节浮点数估计：
+        prepsubband: 原始数据块（nchan）+ 子带（nsub）+ 各 DM 输出（numdms/downsamp）的缓冲区
+        realfft/rednoise/zapbirds/prepdata: 约为输入时间序列或频谱大小的 2 倍
+        fused_fft.py: numpy 的 complex128 频谱、complex64 输出和功率数组，约为 .dat 大小的 5 倍
+        deorb_bank.py: 每块的下标、相位和输出数组（deorb_block_elements 决定，与 .dat 大小无关）
+        accelsearch: 频谱大小的 2 倍 + f-fdot 平面（z 平面数 × w 平面数 × 叠加谐波数）
+        prepfold/rfifind: 原始数据块（折叠时间序列时为 .dat 大小的 2 倍）
+        暂存链（staging_chain2cmd）: 各步骤的最大值；去红噪声时 .fft 和 _red.fft 同时在暂存目录中，
+            暂存空间按 .dat 大小的 2 倍估计，且内存盘占用的是内存，同样计入内存
+    Returns:
+        tuple: (线程数, 内存字节数, 暂存字节数)
+    """
+    if check_staging_task(cmd):
+        list_parts = [part.strip() for part in cmd.split(';')[0].split('&&')]
+        list_resources = [estimate_task_resources(part, work_dir) for part in list_parts[4:]]
+        try:
+            staging_bytes = 2 * os.path.getsize(split_cmd(list_parts[2])[2]) + 1024**2
+        except (OSError, IndexError):
+            staging_bytes = 2 * 4 * dict_obs_params['N_samples'] + 1024**2
+        return max(r[0] for r in list_resources), max(r[1] for r in list_resources) + staging_bytes, staging_bytes
+
+    cmd_name, list_tokens = get_cost_cmd_name(cmd)
+    try:
+        ncpus = max(1, int(get_option_value(list_tokens, '-ncpus', 1)))
+    except ValueError:
+        ncpus = 1
+    nchan = dict_obs_params['nchan']
+    block_samples = raw_block_samples
+    if dict_obs_params['N_samples'] > 0:
+        block_samples = min(block_samples, dict_obs_params['N_samples'])
+    mem_bytes = 100 * 1024**2     # 程序本身
+    try:
+        if cmd_name == 'prepsubband':
+            nsub = int(get_option_value(list_tokens, '-nsub', dict_obs_params['nsub'] or nchan))
+            numdms = int(get_option_value(list_tokens, '-numdms', 1))
+            downsamp = max(1, int(get_option_value(list_tokens, '-downsamp', 1)))
+            mem_bytes += 4 * block_samples * (2 * nchan + 2 * nsub + 2 * numdms / downsamp)
+        elif cmd_name in ('realfft', 'rednoise', 'zapbirds', 'prepdata', 'single_pulse_search.py'):
+            if cmd_name == 'prepdata':
+                mem_bytes += 4 * block_samples * 2 * nchan
+            mem_bytes += 2 * get_cmd_input_bytes(cmd, work_dir)
+        elif cmd_name == 'fused_fft.py':
+            mem_bytes += 5 * get_cmd_input_bytes(cmd, work_dir)
+        elif cmd_name == 'deorb_bank.py':
+            mem_bytes += 20 * deorb_block_elements
+        elif cmd_name == 'accelsearch':
+            zmax = int(get_option_value(list_tokens, '-zmax', 200))
+            wmax = int(get_option_value(list_tokens, '-wmax', 0))
+            numharm = int(get_option_value(list_tokens, '-numharm', 8))
+            mem_bytes += 2 * get_cmd_input_bytes(cmd, work_dir) + 8 * 8192 * (zmax + 1) * (wmax // 10 + 1) * numharm
+        elif cmd_name in ('prepfold', 'rfifind'):
+            if any(token.endswith('.dat') for token in list_tokens):
+                mem_bytes += 2 * get_cmd_input_bytes(cmd, work_dir)
+            else:
+                mem_bytes += 4 * block_samples * 2 * nchan
+    except ValueError:
+        pass
+    return ncpus, int(mem_bytes), 0
+
+def check_resource_fit(resources, used_cpus, used_mem_bytes, n_running, used_staging_bytes=0):
+    """在预算内时返回 True；没有正在运行的任务时总是允许提交（单个任务超过预算时也能运行）"""
+    if n_running == 0:
+        return True
+    ncpus, mem_bytes, staging_bytes = resources
+    if staging_bytes > 0 and used_staging_bytes + staging_bytes > dict_staging['capacity_bytes']:
+        return False
+    if dict_resource_budget['cpus'] > 0 and used_cpus + ncpus > dict_resource_budget['cpus']:
+        return False
+    if dict_resource_budget['mem_bytes'] > 0 and used_mem_bytes + mem_bytes > dict_resource_budget['mem_bytes']:
+        return False
+    return True
+
+def pool_admit(num_processes, func, list_args, list_resources, progress_bar, handle_error):
+    """
+    按列表顺序在进程数和资源预算内提交任务，直到全部完成。
+    排在前面的任务放不下时，先提交后面能放下的任务（回填），不让核空着；
+    队首任务被越过 admit_max_skips 次后停止回填，等运行中的任务释放出足够的资源再提交队首。
+    """
+    finished = queue.Queue()
+    list_pending = list(range(len(list_args)))
+    used_cpus, used_mem_bytes, used_staging_bytes, n_running = 0, 0, 0, 0
+    n_head_skips = 0
+    wait_buffer_copy_before_fork()
+    process_pool = Pool(num_processes)
+    try:
+        while list_pending or n_running > 0:
+            while list_pending and n_running < num_processes:
+                head = list_pending[0]
+                if check_resource_fit(list_resources[head], used_cpus, used_mem_bytes, n_running, used_staging_bytes):
+                    k = head
+                    n_head_skips = 0
+                elif n_head_skips >= admit_max_skips:
+                    break
+                else:
+                    k = next((k for k in list_pending[1:] if check_resource_fit(list_resources[k], used_cpus, used_mem_bytes, n_running, used_staging_bytes)), None)
+                    if k is None:
+                        break
+                    n_head_skips += 1
+                list_pending.remove(k)
+                process_pool.apply_async(
+                    func,
+                    args=list_args[k],
+                    callback=lambda result, k=k: finished.put((k, None)),
+                    error_callback=lambda error, k=k: finished.put((k, error))
+                )
+                used_cpus += list_resources[k][0]
+                used_mem_bytes += list_resources[k][1]
+                used_staging_bytes += list_resources[k][2]
+                n_running += 1
+
+            k, error = finished.get()
+            used_cpus -= list_resources[k][0]
+            used_mem_bytes -= list_resources[k][1]
+            used_staging_bytes -= list_resources[k][2]
+            n_running -= 1
+            progress_bar.update()
+            if error is not None:
+                handle_error(error)
+        process_pool.close()
+        process_pool.join()
+    except Exception as e:
+        process_pool.terminate()
+        raise e
+
+def filter_done_tasks(cmd_list, ifok_list, work_dir):
+    """
+    批量判断任务是否已在任务数据库中完成（只查询一次数据库）。
+    work_dir 可以是单个目录，也可以是与 cmd_list 等长的目录列表。
+    """
+    if isinstance(work_dir, (list, tuple)):
+        list_work_dirs = list(work_dir)
+    else:
+        list_work_dirs = [work_dir] * len(cmd_list)
+    dict_status = get_job_key_status()
+    dict_latest = None
+    list_flag_done = []
+    for cmd, ifok, task_work_dir in zip(cmd_list, ifok_list, list_work_dirs):
+        if not flag_use_job_store(ifok):
+            list_flag_done.append(False)
+            continue
+        # 只有输入文件缺失时才需要按 ifok 查询最新记录
+        if dict_latest is None and get_job_key(cmd, task_work_dir) not in dict_status and check_inputs_missing(cmd, task_work_dir):
+            dict_latest = get_latest_ifok_records()
+        list_flag_done.append(check_job_done(cmd, ifok, task_work_dir, dict_status=dict_status, dict_latest=dict_latest))
+    return list_flag_done
+
+###多节点任务队列：任务写入共享文件系统上的 SQLite 数据库，任意节点上的 worker（queue_worker.py）领取执行
+#worker 定期写心跳，超过 heartbeat_timeout 没有心跳的任务视为丢失，重新放回队列
+dict_execution_backend = {'name': 'local', 'queue_path': None, 'heartbeat_s': 30.0, 'heartbeat_timeout': 300.0, 'max_attempts': 3}
+queue_backfill_window = 64      # 领取任务时队首放不下，最多向后查看的待执行任务数
+
+def set_execution_backend(name='local', queue_path=None, heartbeat_timeout=300.0):
+    """
+    设置 pool() 的执行方式（在创建进程池之前调用）。
+        local: 本机 multiprocessing 进程池（默认）
+        queue: 任务写入 queue_path 队列数据库，本机和其他节点上的 queue_worker.py 共同执行
+    只有 pool() 提交的独立命令走队列。数据流调度（pool_dataflow）需要在本进程内按依赖关系逐个提交，
+    折叠（pool_fold）在任务结束后还要在本进程内转换 png，这两者在 queue 方式下仍在本机运行。
+    """
+    global sqlite_journal_mode
+    if name not in ('local', 'queue'):
+        raise ValueError(f"未知的执行方式: {name}（可选 local、queue）")
+    dict_execution_backend['name'] = name
+    dict_execution_backend['queue_path'] = queue_path
+    dict_execution_backend['heartbeat_timeout'] = float(heartbeat_timeout)
+    dict_execution_backend['heartbeat_s'] = max(1.0, float(heartbeat_timeout) / 10)
+    if name == 'queue':
+        if not queue_path:
+            raise ValueError("queue 执行方式需要指定队列数据库路径")
+        # 共享文件系统上 WAL 的共享内存文件不能跨节点使用
+        sqlite_journal_mode = 'DELETE'
+        makedir(os.path.dirname(os.path.abspath(queue_path)))
+        conn = connect_task_queue(queue_path)
+        conn.close()
+        print_log(f"任务队列：{queue_path}（其他节点可运行 queue_worker.py 领取任务）", color=colors.OKBLUE)
+
+def connect_task_queue(queue_path=None):
+    """连接任务队列数据库，不存在时自动建表"""
+    conn = sqlite3.connect(queue_path or dict_execution_backend['queue_path'], timeout=120, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=DELETE')
+    conn.execute("""CREATE TABLE IF NOT EXISTS tasks (
+                        task_id     INTEGER PRIMARY KEY AUTOINCREMENT,
+                        batch       TEXT,
+                        cmd         TEXT,
+                        ifok        TEXT,
+                        log_file    TEXT,
+                        work_dir    TEXT,
+                        job_store   TEXT,
+                        max_retries INTEGER,
+                        status      TEXT,
+                        worker      TEXT,
+                        attempts    INTEGER DEFAULT 0,
+                        heartbeat   REAL,
+                        t_submit    REAL,
+                        t_start     REAL,
+                        t_end       REAL,
+                        error       TEXT,
+                        ncpus       INTEGER DEFAULT 1,
+                        mem_bytes   INTEGER DEFAULT 0,
+                        host        TEXT,
+                        skips       INTEGER DEFAULT 0)""")
+    # 旧队列数据库没有资源列时补上
+    list_columns = [row[1] for row in conn.execute('PRAGMA table_info(tasks)')]
+    for column, column_type in (('ncpus', 'INTEGER DEFAULT 1'), ('mem_bytes', 'INTEGER DEFAULT 0'), ('host', 'TEXT'), ('skips', 'INTEGER DEFAULT 0')):
+        if column not in list_columns:
+            conn.execute(f'ALTER TABLE tasks ADD COLUMN {column} {column_type}')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, task_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_batch ON tasks (batch)')
+    return conn
+
+def queue_submit(batch, cmd_list, ifok_list, log_list, work_dir):
+    """把一批任务写入队列，按列表顺序领取；同时记录每个任务估计的核数和内存，worker 领取时按所在节点的预算判断"""
+    list_resources = [estimate_task_resources(cmd, work_dir) for cmd in cmd_list]
+    conn = connect_task_queue()
+    t_submit = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    conn.executemany("""INSERT INTO tasks (batch, cmd, ifok, log_file, work_dir, job_store, max_retries, status, t_submit, ncpus, mem_bytes)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?, ?)""",
+                     [(batch, cmd, ifok, log_file or None, os.path.abspath(work_dir), job_store_path, dict_task_retry['max_retries'], t_submit, int(resources[0]), int(resources[1]))
+                      for cmd, ifok, log_file, resources in zip(cmd_list, ifok_list, log_list, list_resources)])
+    conn.execute('COMMIT')
+    conn.close()
+
+def queue_claim(conn, worker_id, batch=None):
+    """
+    领取一个待执行的任务（BEGIN IMMEDIATE 保证同一任务只被一个 worker 领取），没有可领取的任务时返回 None。
+    与 pool_admit 相同，按本节点正在运行的任务计算核数/内存预算（set_resource_budget），
+    队首放不下时回填后面能放下的任务，队首被越过 admit_max_skips 次后只等待队首。
+    """
+    host = socket.gethostname()
+    sql_batch, list_values = ("", []) if batch is None else (" AND batch = ?", [batch])
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        used_cpus, used_mem_bytes, n_running = conn.execute("SELECT COALESCE(SUM(ncpus), 0), COALESCE(SUM(mem_bytes), 0), COUNT(*) FROM tasks WHERE status = 'running' AND host = ?",
+                                                            (host,)).fetchone()
+        list_rows = conn.execute("SELECT task_id, cmd, ifok, log_file, work_dir, job_store, max_retries, ncpus, mem_bytes, skips FROM tasks WHERE status = 'pending'" + sql_batch +
+                                 " ORDER BY task_id LIMIT ?", list_values + [queue_backfill_window]).fetchall()
+        row = None
+        for k, candidate in enumerate(list_rows):
+            if check_resource_fit((candidate[7] or 0, candidate[8] or 0, 0), used_cpus, used_mem_bytes, n_running):
+                row = candidate
+                break
+            if k == 0 and (candidate[9] or 0) >= admit_max_skips:
+                break
+        if row is not None:
+            if row[0] != list_rows[0][0]:
+                conn.execute("UPDATE tasks SET skips = skips + 1 WHERE task_id = ?", (list_rows[0][0],))
+            now = time.time()
+            conn.execute("UPDATE tasks SET status = 'running', worker = ?, host = ?, attempts = attempts + 1, heartbeat = ?, t_start = ? WHERE task_id = ?",
+                         (worker_id, host, now, now, row[0]))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return row[:7] if row is not None else None
+
+def queue_finish(conn, task_id, worker_id, error=None):
+    """记录任务结果（任务已被重新分配给其他 worker 时不覆盖）"""
+    conn.execute("UPDATE tasks SET status = ?, t_end = ?, error = ? WHERE task_id = ? AND worker = ? AND status = 'running'",
+                 ('failed' if error else 'done', time.time(), error, task_id, worker_id))
+
+def queue_requeue_lost(conn, heartbeat_timeout=None, max_attempts=None):
+    """把超时没有心跳的任务放回队列，尝试次数用尽的记为失败。返回放回的任务数"""
+    heartbeat_timeout = heartbeat_timeout or dict_execution_backend['heartbeat_timeout']
+    max_attempts = max_attempts or dict_execution_backend['max_attempts']
+    t_lost = time.time() - heartbeat_timeout
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute("UPDATE tasks SET status = 'failed', error = 'worker 丢失（心跳超时）', t_end = ? WHERE status = 'running' AND heartbeat < ? AND attempts >= ?",
+                 (time.time(), t_lost, max_attempts))
+    n_requeued = conn.execute("UPDATE tasks SET status = 'pending', worker = NULL WHERE status = 'running' AND heartbeat < ?", (t_lost,)).rowcount
+    conn.execute('COMMIT')
+    return n_requeued
+
+def queue_worker(queue_path, worker_id=None, idle_exit_s=0, batch=None):
+    """
+    worker 主循环：领取任务、执行 child_task，执行期间由后台线程写心跳。
+    连续 idle_exit_s 秒没有可领取的任务时退出（0 表示队列空时立即退出）。
+    batch 不为 None 时只领取该批次的任务。
+    """
+    global job_store_path, sqlite_journal_mode
+    sqlite_journal_mode = 'DELETE'
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    heartbeat_s = dict_execution_backend['heartbeat_s']
+    conn = connect_task_queue(queue_path)
+    t_idle = time.time()
+    while True:
+        row = queue_claim(conn, worker_id, batch)
+        if row is None:
+            queue_requeue_lost(conn)
+            if time.time() - t_idle >= idle_exit_s:
+                break
+            time.sleep(min(5.0, heartbeat_s))
+            continue
+        task_id, cmd, ifok, log_file, work_dir, task_job_store, max_retries = row
+        job_store_path = task_job_store
+        if max_retries is not None:
+            dict_task_retry['max_retries'] = max_retries
+
+        stop_event = threading.Event()
+        def send_heartbeat():
+            conn_heartbeat = connect_task_queue(queue_path)
+            while not stop_event.wait(heartbeat_s):
+                conn_heartbeat.execute("UPDATE tasks SET heartbeat = ? WHERE task_id = ? AND worker = ?", (time.time(), task_id, worker_id))
+            conn_heartbeat.close()
+        thread_heartbeat = threading.Thread(target=send_heartbeat, daemon=True)
+        thread_heartbeat.start()
+        error = None
+        try:
+            child_task(cmd, ifok, log_file, work_dir)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        finally:
+            stop_event.set()
+            thread_heartbeat.join()
+        queue_finish(conn, task_id, worker_id, error)
+        t_idle = time.time()
+    conn.close()
+
+def pool_queue(num_processes, task_name, cmd_list, ifok_list, log_list, work_dir):
+    """
+    通过任务队列执行一批任务：写入队列后在本机启动 num_processes 个 worker，
+    其他节点上的 queue_worker.py 也会领取这批任务。等待全部任务结束（完成或失败）后返回。
+    """
+    batch = f"{task_name}-{socket.gethostname()}-{os.getpid()}-{time.time():.0f}"
+    queue_submit(batch, cmd_list, ifok_list, log_list, work_dir)
+    queue_path = dict_execution_backend['queue_path']
+
+    progress_bar = tqdm(
+        total=len(cmd_list),
+        desc=f"{task_name}-队列",
+        unit="cmd",
+        dynamic_ncols=True,
+    )
+    list_workers = []
+    set_reported = set()
+    conn = connect_task_queue(queue_path)
+    try:
+        while True:
+            queue_requeue_lost(conn)
+            dict_counts = dict(conn.execute("SELECT status, COUNT(*) FROM tasks WHERE batch = ? GROUP BY status", (batch,)).fetchall())
+            for task_id, cmd, error in conn.execute("SELECT task_id, cmd, error FROM tasks WHERE batch = ? AND status = 'failed'", (batch,)):
+                if task_id not in set_reported:
+                    set_reported.add(task_id)
+                    progress_bar.write(f"任务执行错误: {error}")
+            n_finished = dict_counts.get('done', 0) + dict_counts.get('failed', 0)
+            progress_bar.update(n_finished - progress_bar.n)
+            if n_finished >= len(cmd_list):
+                break
+            # 本机 worker 只执行这一批任务；有任务被放回队列而本机 worker 已退出时重新启动
+            list_workers = [worker for worker in list_workers if worker.is_alive()]
+            n_new = min(num_processes - len(list_workers), dict_counts.get('pending', 0))
+            if n_new > 0:
+                wait_buffer_copy_before_fork()
+            for k in range(n_new):
+                worker = Process(target=queue_worker, args=(queue_path, None, 0, batch))
+                worker.start()
+                list_workers.append(worker)
+            time.sleep(1)
+    finally:
+        conn.close()
+        progress_bar.close()
+    for worker in list_workers:
+        worker.join()
+    if set_reported:
+        print_log(f"{task_name}: {len(set_reported)} 个任务失败", color=colors.ERROR)
 
 def pool(num_processes, task_name, cmd_list, ifok_list, log_list=None, work_dir=os.getcwd()):
     """
@@ -414,6 +1582,29 @@ def pool(num_processes, task_name, cmd_list, ifok_list, log_list=None, work_dir=
     elif len(cmd_list) != len(log_list):
         raise ValueError("cmd_list 和 log_list 长度必须一致")
 
+    # 启用任务数据库时，一次查询筛掉已完成的任务
+    if job_store_path is not None:
+        list_flag_done = filter_done_tasks(cmd_list, ifok_list, work_dir)
+        list_todo = [k for k, flag_done in enumerate(list_flag_done) if not flag_done]
+        if len(list_todo) < len(cmd_list):
+            print_log(f"{task_name}: 任务数据库中已完成 {len(cmd_list) - len(list_todo)}/{len(cmd_list)} 个任务，将跳过", color=colors.OKBLUE)
+        cmd_list = [cmd_list[k] for k in list_todo]
+        ifok_list = [ifok_list[k] for k in list_todo]
+        log_list = [log_list[k] for k in list_todo]
+
+    # 估计耗时长的任务先提交
+    list_order, predicted_makespan = order_tasks_by_cost(num_processes, task_name, cmd_list, ifok_list, work_dir)
+    cmd_list = [cmd_list[k] for k in list_order]
+    ifok_list = [ifok_list[k] for k in list_order]
+    log_list = [log_list[k] for k in list_order]
+    start_time = time.time()
+
+    # 多节点任务队列
+    if dict_execution_backend['name'] == 'queue':
+        pool_queue(num_processes, task_name, cmd_list, ifok_list, log_list, work_dir)
+        report_makespan(task_name, predicted_makespan, start_time)
+        return
+
     # 初始化进度条和线程锁
     progress_bar = tqdm(
         total=len(cmd_list),
@@ -422,9 +1613,6 @@ def pool(num_processes, task_name, cmd_list, ifok_list, log_list=None, work_dir=
         dynamic_ncols=True,
     )
 
-    def update(*args):
-        progress_bar.update()
-
     def handle_error(error):
         """统一错误处理函数"""
         try:
@@ -435,18 +1623,144 @@ def pool(num_processes, task_name, cmd_list, ifok_list, log_list=None, work_dir=
         except:
                 progress_bar.write("任务执行错误: 未知错误")
 
-    # 创建进程池并提交任务
+    # 在进程数和核数/内存预算内提交任务
+    list_args = [(cmd, ifok, log_file, work_dir) for cmd, ifok, log_file in zip(cmd_list, ifok_list, log_list)]
+    list_resources = [estimate_task_resources(cmd, work_dir) for cmd in cmd_list]
+    try:
+        pool_admit(num_processes, child_task, list_args, list_resources, progress_bar, handle_error)
+    finally:
+        progress_bar.close()
+    report_makespan(task_name, predicted_makespan, start_time)
+
+###数据流调度：按依赖关系提交任务，不同阶段之间没有整体屏障
+#任务为字典：{'id', 'cmd', 'ifok', 'log', 'deps', 'stage', 'work_dir'(可选)}
+def pool_dataflow(num_processes, task_name, task_list, work_dir=os.getcwd()):
+    """
+    基于依赖图的多进程调度函数。
+    某个任务的全部依赖完成后立即提交，因此较早 DM 的搜寻可以与较晚 DM 的 FFT 同时运行。
+    就绪任务中优先运行 stage 较大的（靠后的阶段），使已开始的 DM 链尽快结束，减少中间文件堆积；
+    同一阶段内按 estimate_task_cost 从大到小运行。
+
+    Args:
+        num_processes (int): 并行进程数
+        task_name (str): 任务名称（用于进度条显示）
+        task_list (list): 任务字典列表
+        work_dir (str): 默认工作目录路径（任务字典中的 'work_dir' 优先）
+    Returns:
+        tuple: (完成的任务 id 集合, 失败的任务 id 集合, 因上游失败而跳过的任务 id 集合)
+    """
+    if dict_execution_backend['name'] == 'queue':
+        print_log(f"{task_name}: 数据流调度按依赖关系在本进程内提交任务，EXECUTION_BACKEND = queue 时仍在本机运行", color=colors.WARNING)
+    dict_tasks = {}
+    for task in task_list:
+        if task['id'] in dict_tasks:
+            raise ValueError(f"任务 id 重复: {task['id']}")
+        dict_tasks[task['id']] = task
+
+    dict_children = {tid: [] for tid in dict_tasks}
+    dict_n_deps = {}
+    for tid, task in dict_tasks.items():
+        deps = task.get('deps', [])
+        for dep in deps:
+            if dep not in dict_tasks:
+                raise ValueError(f"任务 {tid} 依赖的任务 {dep} 不存在")
+            dict_children[dep].append(tid)
+        dict_n_deps[tid] = len(deps)
+
+    dict_order = {tid: k for k, tid in enumerate(dict_tasks)}
+    list_ready = []
+    def push_ready(tid):
+        # 同一阶段内估计开销大的先运行；入队时依赖已完成，输入文件已经存在
+        task = dict_tasks[tid]
+        cost = estimate_task_cost(task['cmd'], task.get('work_dir', work_dir))
+        heapq.heappush(list_ready, (-task.get('stage', 0), -cost, dict_order[tid], tid))
+
+    for tid, n_deps in dict_n_deps.items():
+        if n_deps == 0:
+            push_ready(tid)
+
+    progress_bar = tqdm(
+        total=len(dict_tasks),
+        desc=f"{task_name}-{num_processes}核",
+        unit="cmd",
+        dynamic_ncols=True,
+    )
+
+    finished = queue.Queue()
+    done_ids, failed_ids, skipped_ids = set(), set(), set()
+    n_running = 0
+    used_cpus, used_mem_bytes = 0, 0
+    dict_resources = {}
+
+    # 启用任务数据库时，一次查询得到已完成的任务，出队时直接视为完成
+    set_done_before = set()
+    if job_store_path is not None:
+        list_tids = list(dict_tasks)
+        list_flag_done = filter_done_tasks([dict_tasks[tid]['cmd'] for tid in list_tids], [dict_tasks[tid]['ifok'] for tid in list_tids],
+                                           [dict_tasks[tid].get('work_dir', work_dir) for tid in list_tids])
+        set_done_before = set(tid for tid, flag_done in zip(list_tids, list_flag_done) if flag_done)
+        if set_done_before:
+            print_log(f"{task_name}: 任务数据库中已完成 {len(set_done_before)}/{len(dict_tasks)} 个任务，将跳过", color=colors.OKBLUE)
+
+    def mark_done(tid):
+        done_ids.add(tid)
+        progress_bar.update()
+        for child in dict_children[tid]:
+            dict_n_deps[child] -= 1
+            if dict_n_deps[child] == 0 and child not in skipped_ids:
+                push_ready(child)
+
+    wait_buffer_copy_before_fork()
     process_pool = Pool(num_processes)
     try:
-        results = [
-            process_pool.apply_async(
-                child_task,
-                args=(cmd, ifok, log_file, work_dir),
-                callback=update,
-                error_callback=handle_error
-            )
-            for cmd, ifok, log_file in zip(cmd_list, ifok_list, log_list)
-        ]
+        while list_ready or n_running > 0:
+            # 保持最多 num_processes 个任务在运行，其余留在就绪队列中按优先级等待
+            while list_ready and n_running < num_processes:
+                tid = list_ready[0][-1]
+                if tid in set_done_before:
+                    heapq.heappop(list_ready)
+                    mark_done(tid)
+                    continue
+                task = dict_tasks[tid]
+                # 超出核数/内存预算时等待运行中的任务结束
+                dict_resources[tid] = estimate_task_resources(task['cmd'], task.get('work_dir', work_dir))
+                if not check_resource_fit(dict_resources[tid], used_cpus, used_mem_bytes, n_running):
+                    break
+                heapq.heappop(list_ready)
+                used_cpus += dict_resources[tid][0]
+                used_mem_bytes += dict_resources[tid][1]
+                process_pool.apply_async(
+                    child_task,
+                    args=(task['cmd'], task['ifok'], task.get('log'), task.get('work_dir', work_dir)),
+                    callback=lambda result, tid=tid: finished.put((tid, None)),
+                    error_callback=lambda error, tid=tid: finished.put((tid, error))
+                )
+                n_running += 1
+
+            if n_running == 0:
+                continue
+            tid, error = finished.get()
+            n_running -= 1
+            used_cpus -= dict_resources[tid][0]
+            used_mem_bytes -= dict_resources[tid][1]
+
+            if error is None:
+                mark_done(tid)
+            else:
+                progress_bar.update()
+                failed_ids.add(tid)
+                error_str = str(error).encode('utf-8', errors='replace').decode('utf-8', errors='replace')
+                progress_bar.write(f"任务执行错误: {tid}: {error_str}")
+                # 下游任务全部跳过
+                stack = list(dict_children[tid])
+                while stack:
+                    child = stack.pop()
+                    if child in skipped_ids:
+                        continue
+                    skipped_ids.add(child)
+                    progress_bar.update()
+                    stack.extend(dict_children[child])
+
         process_pool.close()
         process_pool.join()
     except Exception as e:
@@ -455,6 +1769,93 @@ def pool(num_processes, task_name, cmd_list, ifok_list, log_list=None, work_dir=
     finally:
         progress_bar.close()
 
+    if failed_ids:
+        print_log(f"{task_name}: {len(failed_ids)} 个任务失败，{len(skipped_ids)} 个下游任务被跳过", color=colors.ERROR)
+    return done_ids, failed_ids, skipped_ids
+
+def dataflow2tasks(dat_list, sourcename, out_dir, zapfile, list_zmax, dict_ifok_dirs, dict_log_dirs, numharm=8, realfft_flags="", rednoise_flags="", dict_accelsearch_flags={}, flag_fused=False):
+    """
+    为每个 DM 试验生成 realfft → rednoise → zapbirds → accelsearch(各 zmax) 的任务链，供 pool_dataflow 使用。
+    命令、ifok 和日志与分阶段模式（realfft2cmd、rednoise2cmd、zapbirds2cmd、accelsearch2cmd）完全相同，两种模式可以互相断点续跑。
+    rednoise 之后的 _red 文件重命名合并到同一条命令中，按 DM 完成而不是等全部 DM 结束后统一重命名。
+    flag_fused 时前三步合并为一个 fused_fft.py 任务（fused_fft2cmd）。
+
+    Args:
+        dict_ifok_dirs (dict): 键为 'fft'、'red'、'zap'、'search' 的 ifok 目录
+        dict_log_dirs (dict): 键同上的日志目录
+        dict_accelsearch_flags (dict): 每个 zmax 对应的 accelsearch 选项
+    """
+    fft_list = [dat.replace(".dat", ".fft") for dat in dat_list]
+    if flag_fused:
+        fft_cmds, fft_ifoks, fft_logs = fused_fft2cmd(dat_list, zapfile, dict_ifok_dirs['fft'], dict_log_dirs['fft'], other_flags=rednoise_flags)
+    else:
+        fft_cmds, fft_ifoks, fft_logs = realfft2cmd(dat_list, sourcename, out_dir, dict_ifok_dirs['fft'], dict_log_dirs['fft'], other_flags=realfft_flags)
+    red_cmds, red_ifoks, red_logs = rednoise2cmd(fft_list, sourcename, out_dir, dict_ifok_dirs['red'], dict_log_dirs['red'], other_flags=rednoise_flags)
+    zap_cmds, zap_ifoks, zap_logs = zapbirds2cmd(fft_list, zapfile, dict_ifok_dirs['zap'], dict_log_dirs['zap'])
+    dict_search = {}
+    for z in list_zmax:
+        dict_search[z] = accelsearch2cmd(fft_list, dict_ifok_dirs['search'], dict_log_dirs['search'], numharm=numharm, zmax=z, other_flags=dict_accelsearch_flags.get(z, ""))
+
+    task_list = []
+    for k, fft in enumerate(fft_list):
+        name = os.path.basename(fft)
+        fft_red = fft.replace(".fft", "_red.fft")
+        # .fft 的重命名放在最后：此前任何一步失败时原 .fft 都未被改写，run_cmd 重试时 rednoise 仍作用于原始频谱，不会重复去红噪声
+        cmd_red = f"{red_cmds[k]} && mv -f {fft_red.replace('.fft', '.inf')} {fft.replace('.fft', '.inf')} && mv -f {fft_red} {fft}"
+
+        task_list.append({'id': f"fft:{name}", 'cmd': fft_cmds[k], 'ifok': fft_ifoks[k], 'log': fft_logs[k], 'deps': [], 'stage': 0})
+        if flag_fused:
+            search_dep = f"fft:{name}"
+        else:
+            task_list.append({'id': f"red:{name}", 'cmd': cmd_red, 'ifok': red_ifoks[k], 'log': red_logs[k], 'deps': [f"fft:{name}"], 'stage': 1})
+            task_list.append({'id': f"zap:{name}", 'cmd': zap_cmds[k], 'ifok': zap_ifoks[k], 'log': zap_logs[k], 'deps': [f"red:{name}"], 'stage': 2})
+            search_dep = f"zap:{name}"
+        for z in list_zmax:
+            search_cmds, search_ifoks, search_logs = dict_search[z]
+            task_list.append({'id': f"search{z}:{name}", 'cmd': search_cmds[k], 'ifok': search_ifoks[k], 'log': search_logs[k], 'deps': [search_dep], 'stage': 3})
+
+    return task_list
+
+def staging_chain2cmd(dat_list, out_dir, zapfile, list_zmax, ifok_dir, log_dir, numharm=8, realfft_flags="", rednoise_flags="", dict_accelsearch_flags={}, flag_keep_fft=False, flag_fused=False):
+    """
+    为每个 DM 试验生成一条在暂存目录（set_staging）中完成 realfft → rednoise → zapbirds → accelsearch(各 zmax) 的组合命令。
+    flag_fused 时前三步由一次 fused_fft.py 完成。
+    .dat 和 .inf 以符号链接放入暂存目录，中间的 .fft、_red.fft 只写在暂存目录中；
+    结束后只把 ACCEL、.cand、.txtcand（flag_keep_fft 时还有消噪后的 .fft）复制回 out_dir，无论成功与否都删除暂存目录。
+    """
+    cmd_chain_list = []
+    ifok_list = []
+    log_list = []
+    for dat in dat_list:
+        DM = extract_dm_part(dat)
+        name = os.path.basename(dat)[:-len('.dat')]
+        stage_dir = os.path.join(dict_staging['dir'], name)
+
+        list_steps = [f"mkdir -p {stage_dir}",
+                      f"cd {stage_dir}",
+                      f"ln -sf {dat} {name}.dat",
+                      f"ln -sf {dat[:-len('.dat')]}.inf {name}.inf"]
+        if flag_fused:
+            list_steps.append(f"{fused_fft_script} {rednoise_flags} -zapfile {zapfile} {name}.dat")
+        else:
+            list_steps += [f"realfft {realfft_flags} {name}.dat",
+                           f"rednoise {rednoise_flags} {name}.fft",
+                           f"mv -f {name}_red.inf {name}.inf",
+                           f"mv -f {name}_red.fft {name}.fft",
+                           f"zapbirds -zap -zapfile {zapfile} {name}.fft"]
+        for z in list_zmax:
+            list_steps.append(f"accelsearch {dict_accelsearch_flags.get(z, '')} -zmax {z} -numharm {numharm} {name}.fft")
+        # 没有候选体时不生成 ACCEL 文件，用 find 复制以免 cp 因通配符不匹配而失败
+        list_steps.append(f"find . -maxdepth 1 -name '{name}_ACCEL_*' -exec cp -f {{}} {out_dir}/ \\;")
+        if flag_keep_fft:
+            list_steps.append(f"cp -f {name}.fft {out_dir}/")
+        cmd_chain = " && ".join(list_steps) + f"; status=$?; cd {out_dir}; rm -rf {stage_dir}; exit $status"
+
+        cmd_chain_list.append(cmd_chain)
+        ifok_list.append(os.path.join(ifok_dir,f'chain-{DM}.ifok'))
+        log_list.append(os.path.join(log_dir,f'LOG_04-CHAIN-{DM}.txt'))
+    return cmd_chain_list,ifok_list,log_list
+
 def handle_files(directory, to_dir, action, pattern, whitelist=None):
     """
     根据指定操作（复制、移动或删除）处理匹配的文件。
@@ -497,6 +1898,10 @@ def extract_dm_part(file_path):
     if DM:
         DM_value = DM.group(1)   # 已经干净，不会带 _p 或 .
         DM_formatted = f"{float(DM_value):05.2f}"
+        # 去轨道模板库的输出（xxx_TPL003_DM12.00）加上模板名，各模板的 ifok 和日志互不冲突
+        template = re.search(r"_(TPL[0-9]+)_DM[0-9]", filename)
+        if template:
+            return f"{template.group(1)}-{DM_formatted}"
         return DM_formatted
     else:
         return None
@@ -587,6 +1992,176 @@ def prepdata2bary(infile,sourcename, out_dir,ifok_dir, log_dir, Nsamples=0, igno
 
     return cmd_list,ifok_list,log_list
 
+###质心修正（BARY_ENGINE = numpy）：质心修正对同一观测的所有 DM 试验相同（DM 只让历元整体平移），
+#每种 (采样点数, 采样时间) 只用 prepdata 处理一条合成的“序号”时间序列，得到每个输出采样点对应的地心采样点，再用于全部 DM 试验
+bary_index_modulus = 2**22   # 合成时间序列的值为 采样点序号 mod 2^22（float32 可精确表示）
+
+def make_bary_reference_dat(inf_file, out_dat):
+    """以 inf_file 为模板写出合成时间序列 out_dat 及其 .inf，第 k 个采样点的值为 k mod bary_index_modulus"""
+    N = int(infodata.infodata(inf_file).N)
+    (np.arange(N, dtype=np.int64) % bary_index_modulus).astype(np.float32).tofile(out_dat)
+    rewrite_inf(inf_file, out_dat.replace('.dat', '.inf'), {'Data file name without suffix': os.path.basename(out_dat)[:-len('.dat')]})
+
+def read_bary_index_map(bary_ref_dat, N_topo):
+    """
+    从 prepdata 质心修正后的合成时间序列还原每个输出采样点对应的地心采样点序号。
+    prepdata 按地球运动插入（写入块平均值，为半整数）或删除采样点：相邻两个整数值之差（mod 2^22）为 1 是正常采样点，
+    为 2 是中间删除了一个采样点；非整数值和与前后都不衔接的值为插入的采样点，记为 -1。
+    """
+    values = np.fromfile(bary_ref_dat, dtype=np.float32)
+    ints = values.astype(np.int64)
+    valid = (values == ints)
+    # 与前一个或后一个整数值衔接（差 1 或 2）
+    steps_prev = np.full(len(ints), -1, dtype=np.int64)
+    steps_prev[1:] = (ints[1:] - ints[:-1]) % bary_index_modulus
+    steps_next = np.full(len(ints), -1, dtype=np.int64)
+    steps_next[:-1] = steps_prev[1:]
+    valid &= np.isin(steps_prev, (1, 2)) | np.isin(steps_next, (1, 2))
+    list_pos = np.nonzero(valid)[0]
+    index_map = np.full(len(values), -1, dtype=np.int64)
+    if len(list_pos) == 0:
+        return index_map
+    steps = (ints[list_pos[1:]] - ints[list_pos[:-1]]) % bary_index_modulus
+    index_map[list_pos] = ints[list_pos[0]] + np.concatenate([[0], np.cumsum(steps)])
+    index_map[index_map >= N_topo] = -1
+    return index_map
+
+def apply_bary_index_map(dat, index_map, out_dat, fill_bins=1024):
+    """按映射重排地心时间序列写出质心时间序列；插入的采样点用前一个采样点所在的 fill_bins 个采样点的平均值填充"""
+    data = np.memmap(dat, dtype=np.float32, mode='r')
+    N = len(data)
+    n_blocks = max(N // fill_bins, 1)
+    block_means = np.asarray(data[:n_blocks * fill_bins], dtype=np.float64).reshape(n_blocks, -1).mean(axis=1).astype(np.float32)
+    valid = (index_map >= 0) & (index_map < N)
+    out = data[np.where(valid, index_map, 0)]
+    previous = np.maximum.accumulate(np.where(valid, index_map, 0))
+    out[~valid] = block_means[np.minimum(previous[~valid] // fill_bins, n_blocks - 1)]
+    del data
+    tmp_dat = out_dat + '.tmp'
+    out.tofile(tmp_dat)
+    os.replace(tmp_dat, out_dat)
+
+def write_bary_inf(ref_inf, out_inf, basename, DM, DM_ref):
+    """
+    以合成序列质心修正后的 .inf 为模板写出某个 DM 试验的 .inf。
+    prepdata 把质心时间减去最高频率处的色散延迟，因此历元随 DM 平移 -(delay(DM) - delay(DM_ref))。
+    """
+    info = infodata.infodata(ref_inf)
+    freq_high_MHz = info.lofreq + (info.numchan - 1) * info.chan_width
+    epochf = info.epochf - (get_dm_delays(freq_high_MHz, DM, np.inf) - get_dm_delays(freq_high_MHz, DM_ref, np.inf)) / 86400.0
+    epochi = int(info.epochi) + int(np.floor(epochf))
+    epochf -= np.floor(epochf)
+    rewrite_inf(ref_inf, out_inf, {'Data file name without suffix': basename,
+                                   'Dispersion measure': "%.2f" % (DM),
+                                   'Epoch of observation': "%d.%s" % (epochi, ("%.15f" % epochf).split('.')[1])})
+
+###去轨道调制模板库（IF_PYSOLATOR = 1 且设置了 DEORB_TEMPLATE_BANK）：每个 DM 的 .dat 只读一次（内存映射），
+#用 numpy 按一组圆轨道模板 (Pb, x, T0, q) 批量重采样，每个模板写出一条可搜索的时间序列
+deorb_bank_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deorb_bank.py')
+deorb_block_elements = 1 << 24   # 每块 模板数 × 采样点数 的上限（下标和相位数组各约 128 MB）
+
+def parse_template_grid_field(field):
+    """模板库中的一个字段：单个数值，或 起始:结束:步长（包含结束值）"""
+    if ':' not in field:
+        return [float(field)]
+    start, stop, step = [float(x) for x in field.split(':')]
+    return [float(value) for value in start + step * np.arange(int(np.floor((stop - start) / step + 1e-6)) + 1)]
+
+def read_deorb_template_bank(bank_file):
+    """
+    读取轨道模板库。每行 Pb(天) x(光秒) T0(MJD) q，# 开头为注释；任一字段可写成 起始:结束:步长，该行展开为各字段的网格。
+    模板按展开顺序命名为 TPL000、TPL001 ……
+    圆轨道的罗默延迟只取决于 Pb、x、T0，q 只记录在模板表中，与单模板模式（DEORB.par）按 q 命名的输出对应。
+    Returns:
+        list: [{'name', 'Pb', 'x', 'T0', 'q'}, ...]
+    """
+    list_templates = []
+    with open(bank_file, 'r') as f:
+        for line in f:
+            list_fields = line.split('#', 1)[0].split()
+            if not list_fields:
+                continue
+            if len(list_fields) < 4:
+                raise ValueError(f"模板库 {bank_file} 中的行缺少字段（需要 Pb x T0 q）：{line.strip()}")
+            for Pb, x, T0, q in itertools.product(*[parse_template_grid_field(field) for field in list_fields[:4]]):
+                list_templates.append({'name': "TPL%03d" % (len(list_templates)), 'Pb': Pb, 'x': x, 'T0': T0, 'q': q})
+    return list_templates
+
+def write_deorb_template_table(list_templates, out_file):
+    with open(out_file, 'w') as f:
+        f.write("#%-9s %16s %14s %20s %8s\n" % ("name", "Pb(day)", "x(lt-s)", "T0(MJD)", "q"))
+        for template in list_templates:
+            f.write("%-10s %16.10f %14.8f %20.10f %8.3f\n" % (template['name'], template['Pb'], template['x'], template['T0'], template['q']))
+
+def get_deorb_template_basename(basename, template_name):
+    """在 _DM 之前插入模板名：xxx_DM12.00 -> xxx_TPL003_DM12.00"""
+    match = re.search(r"_DM[0-9]", basename)
+    if match is None:
+        return f"{basename}_{template_name}"
+    return f"{basename[:match.start()]}_{template_name}{basename[match.start():]}"
+
+def deorb_template_bank(datfile, list_templates, out_dir):
+    """
+    一次读取 .dat，按每个圆轨道模板去除罗默延迟 x·sin(2π(t - T0)/Pb)：
+    脉冲星固有时 τ 的第 j 个输出采样点取观测时间 t = τ + x·sin(2π(τ - T0)/Pb) 处最近的输入采样点（与 prepdata 质心修正一样只移动采样点，不插值），
+    超出数据范围的取首尾采样点。所有模板在同一块数据上批量计算。
+    .inf 沿用输入的（历元不变），并在末尾的注释中记录模板参数。结果先写入临时文件再改名。
+    Returns:
+        list: 各模板输出的 .dat 路径
+    """
+    basename = datfile[:-len('.dat')]
+    info = infodata.infodata(basename + '.inf')
+    dt = info.dt
+    data = np.memmap(datfile, dtype=np.float32, mode='r')
+    N = len(data)
+
+    Pb_s = np.array([template['Pb'] for template in list_templates])[:, None] * 86400.0
+    x = np.array([template['x'] for template in list_templates])[:, None]
+    T0 = np.array([template['T0'] for template in list_templates])[:, None]
+    phase0 = 2 * np.pi * np.mod((info.epoch - T0) * 86400.0, Pb_s) / Pb_s
+    max_shift = int(np.ceil(np.max(np.abs(x)) / dt)) + 1
+    block_samples = max(deorb_block_elements // len(list_templates), 1 << 16)
+
+    list_out_basenames = [os.path.join(out_dir, get_deorb_template_basename(os.path.basename(basename), template['name'])) for template in list_templates]
+    list_out_files = [open(out_basename + '.dat.tmp', 'wb') for out_basename in list_out_basenames]
+    for j0 in range(0, N, block_samples):
+        j1 = min(j0 + block_samples, N)
+        w0 = max(j0 - max_shift, 0)
+        window = np.asarray(data[w0:min(j1 + max_shift, N)])
+        j = np.arange(j0, j1)
+        index = np.rint(j + x * np.sin(phase0 + 2 * np.pi * dt * j / Pb_s) / dt).astype(np.int64)
+        np.clip(index, 0, N - 1, out=index)
+        block = window[index - w0]
+        for k, f in enumerate(list_out_files):
+            block[k].tofile(f)
+    del data
+
+    for template, out_basename, f in zip(list_templates, list_out_basenames, list_out_files):
+        f.close()
+        os.replace(out_basename + '.dat.tmp', out_basename + '.dat')
+        rewrite_inf(basename + '.inf', out_basename + '.inf', {'Data file name without suffix': os.path.basename(out_basename)})
+        with open(out_basename + '.inf', 'a') as f_inf:
+            f_inf.write("    Orbit template %s removed: Pb = %.10f d, x = %.8f lt-s, T0 = %.10f MJD, q = %.3f\n" % (template['name'], template['Pb'], template['x'], template['T0'], template['q']))
+    return [out_basename + '.dat' for out_basename in list_out_basenames]
+
+def deorb_bank2cmd(infile_list, bank_file, out_dir, ifok_dir, log_dir):
+    cmd_deorb_list = []
+    ifok_list = []
+    log_list = []
+
+    for dat in infile_list:
+        DM = extract_dm_part(dat)
+
+        cmd_deorb = f"{deorb_bank_script} -bank {bank_file} -outdir {out_dir} {dat}"
+        ifokfile = os.path.join(ifok_dir,f'deorb-{DM}.ifok')
+        log_file = os.path.join(log_dir,f'LOG_03c-DEORB-{DM}.txt')
+
+        cmd_deorb_list.append(cmd_deorb)
+        ifok_list.append(ifokfile)
+        log_list.append(log_file)
+
+    return cmd_deorb_list,ifok_list,log_list
+
          
 
 def dedisperse(infile,open_mask,sourcename, out_dir, log_dir, ignorechan_list, mask_file, list_DD_schemes, nchan, nsubbands=0, other_flags="", presto_env=os.environ['PRESTO']):
@@ -742,6 +2317,419 @@ def dedisperse2cmd(infile,open_mask,sourcename, out_dir, log_dir, ignorechan_lis
         file_script_prepsubband.close()
         return cmd_prepsubband_list,ifok_list,log_list
 
+###两级去色散（DEDISPERSE_ENGINE = presto_sub）：prepsubband -sub 按几个名义 DM 读取一遍原始数据写出子带文件，
+#各 DM 段的 prepsubband 再从最近名义 DM 的子带文件去色散。名义 DM 取 PREPSUBBAND_SUBDM_STEP 的整数倍，
+#与 DM 范围和步长无关，子带文件保留在去色散目录下的 subbands 目录中，只改变 DM 范围或步长时直接复用
+def get_subband_dm_step(nsubbands, bw_MHz, freq_central_MHz, t_samp_s):
+    """名义 DM 间距：DM 偏离名义 DM 半个间距时，子带内的展宽等于采样时间；取一位小数并向下取整"""
+    dsubDM = 2.0 * t_samp_s * 0.0001205 * freq_central_MHz**3.0 / (bw_MHz / nsubbands)
+    return max(0.1, float(np.floor(dsubDM * 10.0)) / 10.0)
+
+def get_subband_signature(infile, mask_file, ignorechan_list, nsubbands, other_flags=""):
+    """
+    子带文件的标识：原始数据、掩模、-ignorechan、子带数或其他选项改变时，不复用旧的子带文件。
+    原始数据（可以是通配符或多个文件）和掩模按 "路径|大小|修改时间" 计入，同名文件被重新生成（如重新运行 rfifind）后也不会复用。
+    """
+    list_fingerprints = []
+    for pattern in infile.split() + ([mask_file] if mask_file else []):
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            try:
+                stat = os.stat(path)
+                list_fingerprints.append(f"{path}|{stat.st_size}|{stat.st_mtime_ns}")
+            except OSError:
+                list_fingerprints.append(f"{path}|-")
+    content = "|".join([infile, mask_file, ignorechan_list, str(nsubbands), other_flags] + list_fingerprints)
+    return hashlib.sha1(content.encode('utf-8', errors='replace')).hexdigest()[:8]
+
+def split_DD_schemes_by_subdm(list_DD_schemes, subdm_step, max_DMs_per_call=1000):
+    """
+    把方案按名义 DM（subdm_step 的整数倍，取离 DM 最近的）拆分为连续的 DM 段，每段不超过 max_DMs_per_call 个 DM。
+    DM 值和文件名与拆分前相同，最后一个方案多输出的一个 DM 仍在最后一段。
+    Returns:
+        list: 方案字典，另有 'subDM'（名义 DM）
+    """
+    list_dict_schemes = []
+    for i, DD_scheme in enumerate(list_DD_schemes):
+        flag_last = i == len(list_DD_schemes) - 1
+        list_dms = get_scheme_dms(DD_scheme, flag_last)
+        list_subdm_index = [int(np.round(dm / subdm_step)) for dm in list_dms]
+        loDM = np.float64(DD_scheme['loDM'])
+        dDM = np.float64(DD_scheme['dDM'])
+        first_DM_index = 0
+        while first_DM_index < len(list_dms):
+            end_DM_index = first_DM_index + 1
+            while end_DM_index < len(list_dms) and list_subdm_index[end_DM_index] == list_subdm_index[first_DM_index] and end_DM_index - first_DM_index < max_DMs_per_call:
+                end_DM_index += 1
+            list_dict_schemes.append({'loDM': round(loDM + first_DM_index * dDM, 6), 'highDM': round(loDM + end_DM_index * dDM, 6),
+                                      'dDM': DD_scheme['dDM'], 'downsamp': DD_scheme['downsamp'], 'num_DMs': end_DM_index - first_DM_index,
+                                      'subDM': round(float(list_subdm_index[first_DM_index] * subdm_step), 6)})
+            first_DM_index = end_DM_index
+    if list_dict_schemes:
+        # 最后一段的 num_DMs 不含多输出的一个 DM，与 dedisperse2cmd 的约定一致
+        list_dict_schemes[-1]['num_DMs'] -= 1
+    return list_dict_schemes
+
+def dedisperse_sub2cmd(infile, open_mask, sourcename, out_dir, sub_dir, log_dir, ignorechan_list, mask_file, list_DD_schemes, nchan, nsubbands,
+                       subdm_step, max_DMs_per_call=1000, other_flags="", presto_env=os.environ['PRESTO']):
+        """
+        两级去色散的命令：第一步每个名义 DM 一次 prepsubband -sub（读取原始数据，写出子带文件到 sub_dir），
+        第二步每个 DM 段一次 prepsubband（读取子带文件，写出 .dat/.inf 到 out_dir）。两步分别交给 pool，第二步须在第一步完成后运行。
+        Returns:
+            tuple: (第一步的命令、ifok、日志, 第二步的命令、ifok、日志)
+        """
+        global cwd
+
+        if nsubbands == 0:
+                nsubbands = nchan
+        elif (nchan % nsubbands != 0):
+                print_log("错误：请求的子带数量为 %d，这不是通道数量 %d 的整数倍！" % (nsubbands, nchan),color=colors.ERROR)
+                exit()
+
+        string_mask = ""
+        if mask_file != "":
+                string_mask = "-mask %s" % (mask_file)
+        string_ignorechan = ""
+        if ignorechan_list != "":
+                string_ignorechan = "-ignorechan %s" % (ignorechan_list)
+
+        signature = get_subband_signature(infile, mask_file, ignorechan_list, nsubbands, other_flags)
+        sub_outfilename = f"{sourcename}_{signature}"
+        list_pieces = split_DD_schemes_by_subdm(list_DD_schemes, subdm_step, max_DMs_per_call)
+        list_subdms = sorted(set(piece['subDM'] for piece in list_pieces))
+
+        print_log("----------------------------------------------------------------------")
+        print_log(f"两级去色散：{len(list_subdms)} 个名义 DM（间距 {subdm_step}）读取原始数据写出子带，{len(list_pieces)} 次 prepsubband 从子带去色散")
+        print_log(f"子带文件：{sub_dir}/{sub_outfilename}_DM*.sub*（保留，DM 范围或步长改变时复用）")
+        print_log("----------------------------------------------------------------------")
+
+        cmd_sub_list = []
+        ifok_sub_list = []
+        log_sub_list = []
+        for subDM in list_subdms:
+                cmd_sub_list.append("prepsubband -nobary %s -sub -subdm %.2f -nsub %d -downsamp 1 -o %s %s %s %s" % (other_flags, subDM, nsubbands, sub_outfilename, string_ignorechan, string_mask, infile))
+                ifok_sub_list.append(cwd+f'/00_IFOK/ok-prepsubband-sub-{signature}-DM{subDM:.2f}.ifok')
+                log_sub_list.append("%s/LOG_03_prepsubband_sub_%s_DM%.2f.txt" % (log_dir, signature, subDM))
+
+        cmd_prepsubband_list = []
+        ifok_list = []
+        log_list = []
+        file_script_prepsubband = open("%s/script_prepsubband_%s_sub.txt" % (out_dir, open_mask), "w")
+        for cmd_sub in cmd_sub_list:
+                file_script_prepsubband.write("%s\n" % cmd_sub)
+        for i, piece in enumerate(list_pieces):
+                num_DMs = piece['num_DMs'] + (1 if i == len(list_pieces) - 1 else 0)
+                string_subfiles = " ".join(os.path.join(sub_dir, "%s_DM%.2f.sub%04d" % (sub_outfilename, piece['subDM'], k)) for k in range(nsubbands))
+                cmd_prepsubband = "prepsubband -nobary %s -o %s -lodm %s -dmstep %s -numdms %s -downsamp %s -nsub %s %s" % (other_flags, sourcename, piece['loDM'], piece['dDM'], num_DMs, piece['downsamp'], nsubbands, string_subfiles)
+                cmd_prepsubband_list.append(cmd_prepsubband)
+                ifok_list.append(cwd+f"/00_IFOK/ok-prepsubband-{open_mask}-sub-DM{piece['loDM']:.2f}-{piece['dDM']}-{num_DMs}-{piece['downsamp']}.ifok")
+                log_list.append("%s/LOG_03_prepsubband_%s_sub%s.txt" % (log_dir, open_mask, i))
+                file_script_prepsubband.write("%s\n" % cmd_prepsubband)
+        file_script_prepsubband.close()
+        return (cmd_sub_list, ifok_sub_list, log_sub_list), (cmd_prepsubband_list, ifok_list, log_list)
+
+###进程内去色散（DEDISPERSE_ENGINE = numpy）：原始数据按块只读取一次，消除 rfifind 掩模和 -ignorechan 通道后，
+#每个 prepsubband 方案按其子带 DM 形成子带，输出方案中全部 DM 试验的 .dat/.inf（文件名与 prepsubband 相同）
+dm_delay_const = 1.0 / 0.000241        # 色散常数（秒 MHz^2 / (pc cm^-3)），与 PRESTO delay_from_dm 相同
+dedisperse_block_bytes = 2 * 1024**3   # 每次读入的原始数据块（float32）大小上限
+
+def get_dm_delays(freqs_MHz, DM, freq_ref_MHz):
+    """各频率相对 freq_ref_MHz 的色散延迟（秒）"""
+    return dm_delay_const * DM * (1.0 / np.asarray(freqs_MHz, dtype=np.float64)**2 - 1.0 / np.asarray(freq_ref_MHz, dtype=np.float64)**2)
+
+def get_scheme_dms(DD_scheme, flag_last=False):
+    """方案中各 DM 试验的 DM 值，与 dedisperse2cmd 中 prepsubband 的 -lodm/-dmstep/-numdms 相同（最后一个方案多一个 DM）"""
+    num_DMs = int(DD_scheme['num_DMs']) + (1 if flag_last else 0)
+    return [np.float64(DD_scheme['loDM']) + k * np.float64(DD_scheme['dDM']) for k in range(num_DMs)]
+
+def rewrite_inf(inf_file, out_inf_file, dict_fields):
+    """以 inf_file 为模板写出 out_inf_file，dict_fields 的键为 .inf 中 '=' 左边字段名的开头，值为新的内容"""
+    with open(inf_file, 'r') as f:
+        list_lines = f.readlines()
+    with open(out_inf_file, 'w') as f:
+        for line in list_lines:
+            for key, value in dict_fields.items():
+                if line.lstrip().startswith(key) and '=' in line:
+                    line = line.split('=', 1)[0] + '=  ' + str(value) + '\n'
+                    break
+            f.write(line)
+
+def open_raw_file(infile, data_type):
+    if data_type == "psrfits":
+        return psrfits.PsrfitsFile(infile)
+    return filterbank.FilterbankFile(infile)
+
+def get_raw_freqs(infile, data_type):
+    """原始数据各通道的频率（MHz，按文件中的通道顺序）"""
+    return np.asarray(open_raw_file(infile, data_type).get_spectra(0, 1).freqs, dtype=np.float64)
+
+def iter_raw_blocks(list_infiles, list_offsets, list_N_samples, data_type, block_samples, N_iter):
+    """
+    按全局采样点顺序读取多个原始数据文件，每次返回 (起始采样点, 数据块, 是否完整)。
+    数据块为 (nchan, block_samples) 的 float32，通道按频率从低到高排列（与 rfifind 掩模、-ignorechan 的通道编号一致）；
+    文件之间的间隔和数据末尾之后（直到 N_iter）用 NaN 填充，此时“是否完整”为 False。
+    """
+    order = np.argsort(get_raw_freqs(list_infiles[0], data_type))
+    dict_readers = {}
+    for t0 in range(0, N_iter, block_samples):
+        t1 = t0 + block_samples
+        block = None
+        n_filled = 0
+        for k, (infile, offset, N) in enumerate(zip(list_infiles, list_offsets, list_N_samples)):
+            lo = max(t0, offset)
+            hi = min(t1, offset + N)
+            if hi <= lo:
+                if offset + N <= t0:
+                    dict_readers.pop(k, None)
+                continue
+            if k not in dict_readers:
+                dict_readers[k] = open_raw_file(infile, data_type)
+            data = np.asarray(dict_readers[k].get_spectra(lo - offset, hi - lo).data, dtype=np.float32)[order]
+            if block is None:
+                block = np.full((len(order), block_samples), np.nan, dtype=np.float32)
+            block[:, lo - t0:hi - t0] = data
+            n_filled += hi - lo
+        if block is None:
+            block = np.full((len(order), block_samples), np.nan, dtype=np.float32)
+        yield t0, block, n_filled == block_samples
+
+def parse_dedisperse_numpy_flags(other_flags):
+    """
+    检查 PREPSUBBAND_FLAGS 能否由 numpy 去色散复现。prepsubband 默认按 6 sigma 剪除强干扰（-clip），
+    numpy 去色散没有实现剪除，因此要求 -noclip（或 -clip 0）；此外只支持 -numout、-ncpus、-nobary。
+    Returns:
+        tuple: (numout，未指定时为 None, 不支持的选项列表)
+    """
+    list_tokens = split_cmd(other_flags.strip('"'))
+    numout = None
+    flag_noclip = False
+    list_unsupported = []
+    k = 0
+    while k < len(list_tokens):
+        token = list_tokens[k]
+        if token == '-noclip':
+            flag_noclip = True
+        elif token == '-clip' and k + 1 < len(list_tokens):
+            k += 1
+            if float(list_tokens[k]) <= 0:
+                flag_noclip = True
+            else:
+                list_unsupported.append(f"-clip {list_tokens[k]}")
+        elif token == '-numout' and k + 1 < len(list_tokens):
+            k += 1
+            numout = int(list_tokens[k])
+        elif token == '-ncpus' and k + 1 < len(list_tokens):
+            k += 1
+        elif token == '-nobary':
+            pass
+        elif token.startswith('-'):
+            list_unsupported.append(token)
+        k += 1
+    if not flag_noclip:
+        list_unsupported.append("-clip 6（prepsubband 默认，请在 PREPSUBBAND_FLAGS 中加 -noclip）")
+    return numout, list_unsupported
+
+def dedisperse_numpy(list_infiles, list_offsets, list_N_samples, data_type, t_samp_s, out_dir, outname, list_DD_schemes, inf_template,
+                     nsubbands=0, mask_file="", ignorechan_list="", n_threads=4, numout=None):
+    """
+    进程内去色散：原始数据只读取一次，输出 list_DD_schemes 中全部 DM 试验的 .dat/.inf。
+    与 prepsubband 相同的两级去色散：每个方案按其 DM 范围中点（prepsubband 默认的 -subdm）把通道移位求和为 nsubbands 个子带
+    （延迟以子带最高频率为参考），按 downsamp 降采样后，每个 DM 试验再把子带移位求和（以最高频率为参考）。
+    rfifind 掩模中被消除的时间段-通道、文件间隔和数据末尾用各通道的平均值（.stats 中各时间段平均值的中值）填充，
+    -ignorechan 的通道置零。.inf 以 inf_template（如 rfifind 的 .inf）为模板改写文件名、采样点数、采样时间和 DM。
+
+    Args:
+        list_infiles (list): 原始数据文件（按时间排序）
+        list_offsets (list): 各文件起点的全局采样点偏移
+        list_N_samples (list): 各文件的采样点数
+        inf_template (str): .inf 模板
+        n_threads (int): 各方案之间并行的线程数
+        numout (int, optional): 与 prepsubband -numout 相同，每个 DM 试验输出的采样点数（不足时用各通道平均值补齐）
+    Returns:
+        list: 生成的 .dat 文件路径
+    """
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    N_samples = max(offset + N for offset, N in zip(list_offsets, list_N_samples))
+    freqs = np.sort(get_raw_freqs(list_infiles[0], data_type))
+    nchan = len(freqs)
+    if nsubbands == 0:
+        nsubbands = nchan
+    chans_per_sub = nchan // nsubbands
+    freqs_subtop = freqs.reshape(nsubbands, chans_per_sub)[:, -1]
+
+    # 各方案的通道延迟（原始采样点）和各 DM 的子带延迟（降采样后的采样点）
+    list_calls = []
+    for i, DD_scheme in enumerate(list_DD_schemes):
+        list_dms = get_scheme_dms(DD_scheme, i == len(list_DD_schemes) - 1)
+        downsamp = int(DD_scheme['downsamp'])
+        subdm = 0.5 * (list_dms[0] + list_dms[-1])
+        chan_delays = np.round(get_dm_delays(freqs, subdm, np.repeat(freqs_subtop, chans_per_sub)) / t_samp_s).astype(np.int64)
+        sub_delays = np.array([np.round(get_dm_delays(freqs_subtop, dm, freqs[-1]) / (t_samp_s * downsamp)).astype(np.int64) for dm in list_dms])
+        list_datfiles = [os.path.join(out_dir, "%s_DM%.2f.dat" % (outname, dm)) for dm in list_dms]
+        for datfile in list_datfiles:
+            open(datfile, 'wb').close()
+        list_calls.append({'dms': list_dms, 'downsamp': downsamp, 'chan_delays': chan_delays, 'sub_delays': sub_delays,
+                           'sub_tail': np.zeros((nsubbands, int(sub_delays.max())), dtype=np.float32),
+                           'numout': numout if numout else N_samples // downsamp, 'n_written': 0, 'datfiles': list_datfiles})
+    N_samples = max([N_samples] + [call['numout'] * call['downsamp'] for call in list_calls])
+
+    ds_lcm = int(np.lcm.reduce([call['downsamp'] for call in list_calls]))
+    L = int(np.ceil(max(int(call['chan_delays'].max()) for call in list_calls) / ds_lcm)) * ds_lcm
+    block_samples = max(ds_lcm, (dedisperse_block_bytes // (4 * nchan) - L) // ds_lcm * ds_lcm)
+    N_iter = N_samples + L + max(int(call['sub_delays'].max()) * call['downsamp'] for call in list_calls) + block_samples
+
+    # 掩模：各时间段要消除的通道和填充值
+    padvals = None
+    list_int_chans = []
+    ptsperint = 0
+    if mask_file:
+        mask = read_rfifind_mask(mask_file)
+        ptsperint = mask['ptsperint']
+        zap_chans = set(mask['zap_chans'])
+        zap_ints = set(mask['zap_ints'])
+        for k in range(mask['numint']):
+            if k in zap_ints:
+                list_int_chans.append(np.arange(nchan))
+            else:
+                list_int_chans.append(np.array(sorted(zap_chans | set(mask['chans_per_int'][k])), dtype=np.int64))
+        stats_file = mask_file.replace('.mask', '.stats')
+        if os.path.isfile(stats_file):
+            padvals = np.median(read_rfifind_stats(stats_file)[2], axis=0).astype(np.float32)
+    ignore_chans = np.array([c for c in parse_int_ranges(ignorechan_list) if c < nchan], dtype=np.int64)
+
+    def dedisperse_call(call, chan_hist, t0):
+        downsamp = call['downsamp']
+        # 通道 → 子带：子带第 j 个采样点对应全局采样点 t0 - L + j
+        subbands = np.empty((nsubbands, block_samples), dtype=np.float32)
+        chan_windows = sliding_window_view(chan_hist, block_samples, axis=1)
+        for s in range(nsubbands):
+            rows = np.arange(s * chans_per_sub, (s + 1) * chans_per_sub)
+            subbands[s] = chan_windows[rows, call['chan_delays'][rows]].sum(axis=0)
+        if downsamp > 1:
+            subbands = subbands.reshape(nsubbands, block_samples // downsamp, downsamp).sum(axis=2)
+        n_out = block_samples // downsamp
+        sub_hist = np.concatenate([call['sub_tail'], subbands], axis=1)
+        call['sub_tail'] = sub_hist[:, n_out:]
+
+        # 子带 → DM 试验：输出第 j 个采样点对应降采样后的全局采样点 tau0 + j
+        out = np.zeros((len(call['dms']), n_out), dtype=np.float32)
+        sub_windows = sliding_window_view(sub_hist, n_out, axis=1)
+        for s in range(nsubbands):
+            out += sub_windows[s, call['sub_delays'][:, s]]
+        tau0 = (t0 - L) // downsamp - call['sub_tail'].shape[1]
+        j0 = max(call['n_written'] - tau0, 0)
+        j1 = min(call['numout'] - tau0, n_out)
+        if j1 > j0:
+            for k, datfile in enumerate(call['datfiles']):
+                with open(datfile, 'ab') as f:
+                    out[k, j0:j1].tofile(f)
+            call['n_written'] += j1 - j0
+
+    chan_tail = None
+    n_blocks = (N_iter + block_samples - 1) // block_samples
+    print_log(f"numpy 去色散：{len(list_calls)} 个方案，{sum(len(call['dms']) for call in list_calls)} 个 DM 试验，{nsubbands} 个子带，"
+              f"每块 {block_samples} 个采样点，共 {n_blocks} 块", color=colors.OKBLUE)
+    progress_bar = tqdm(total=n_blocks, desc="dedisperse-numpy", unit="块", dynamic_ncols=True)
+    thread_pool = ThreadPool(max(1, min(n_threads, len(list_calls))))
+    try:
+        for t0, block, flag_complete in iter_raw_blocks(list_infiles, list_offsets, list_N_samples, data_type, block_samples, N_iter):
+            if padvals is None:
+                padvals = np.nanmedian(block, axis=1).astype(np.float32) if not np.isnan(block).all() else np.zeros(nchan, dtype=np.float32)
+            if not flag_complete:
+                block = np.where(np.isnan(block), padvals[:, None], block)
+            if ptsperint > 0:
+                for k in range(t0 // ptsperint, min((t0 + block_samples - 1) // ptsperint, len(list_int_chans) - 1) + 1):
+                    if len(list_int_chans[k]):
+                        lo = max(k * ptsperint - t0, 0)
+                        hi = min((k + 1) * ptsperint - t0, block_samples)
+                        block[list_int_chans[k], lo:hi] = padvals[list_int_chans[k], None]
+            if len(ignore_chans):
+                block[ignore_chans] = 0.0
+            if chan_tail is None:
+                chan_tail = np.repeat(padvals[:, None], L, axis=1)
+            chan_hist = np.concatenate([chan_tail, block], axis=1)
+            chan_tail = chan_hist[:, block_samples:]
+
+            thread_pool.map(lambda call: dedisperse_call(call, chan_hist, t0), list_calls)
+            progress_bar.update()
+            if all(call['n_written'] >= call['numout'] for call in list_calls):
+                break
+    finally:
+        thread_pool.close()
+        progress_bar.close()
+
+    list_datfiles = []
+    for call in list_calls:
+        for dm, datfile in zip(call['dms'], call['datfiles']):
+            rewrite_inf(inf_template, datfile.replace('.dat', '.inf'), {'Data file name without suffix': os.path.basename(datfile)[:-len('.dat')],
+                                                                         'Number of bins in the time series': call['numout'],
+                                                                         'Width of each time series bin': repr(t_samp_s * call['downsamp']),
+                                                                         'Dispersion measure': "%.2f" % (dm)})
+            list_datfiles.append(datfile)
+    return list_datfiles
+
+def dedisperse_validate2cmd(infile, sourcename, out_dir, log_dir, ignorechan_list, mask_file, list_DD_schemes, nchan, nsubbands=0, other_flags=""):
+    """
+    validate 模式的 prepsubband 命令：每个方案复核第一个和最后一个 DM，-subdm 取 dedisperse_numpy 所用的子带 DM（方案 DM 范围的中点）。
+    Returns:
+        tuple: (命令, ifok, 日志, numpy 去色散中对应的 .dat 文件名)
+    """
+    global cwd
+
+    if nsubbands == 0:
+        nsubbands = nchan
+    string_mask = ""
+    if mask_file != "":
+        string_mask = "-mask %s" % (mask_file)
+    string_ignorechan = ""
+    if ignorechan_list != "":
+        string_ignorechan = "-ignorechan %s" % (ignorechan_list)
+
+    cmd_list = []
+    ifok_list = []
+    log_list = []
+    list_datnames = []
+    for i, DD_scheme in enumerate(list_DD_schemes):
+        list_dms = get_scheme_dms(DD_scheme, i == len(list_DD_schemes) - 1)
+        subdm = 0.5 * (list_dms[0] + list_dms[-1])
+        list_check_dms = [list_dms[0]] if len(list_dms) == 1 else [list_dms[0], list_dms[-1]]
+        dmstep = round(float(list_dms[-1] - list_dms[0]), 6) if len(list_dms) > 1 else DD_scheme['dDM']
+        cmd_list.append("prepsubband -nobary %s -o %s %s %s -lodm %s -dmstep %s -numdms %d -subdm %.6f -downsamp %s -nsub %s %s" % (other_flags, sourcename, string_ignorechan, string_mask, round(float(list_dms[0]), 6), dmstep, len(list_check_dms), subdm, DD_scheme['downsamp'], nsubbands, infile))
+        ifok_list.append(cwd+f"/00_IFOK/ok-prepsubband-validate-DM{list_dms[0]:.2f}-{len(list_dms)}-{DD_scheme['downsamp']}.ifok")
+        log_list.append("%s/LOG_03_prepsubband_validate%s.txt" % (log_dir, i))
+        list_datnames += ["%s_DM%.2f.dat" % (sourcename, dm) for dm in list_check_dms]
+    return cmd_list, ifok_list, log_list, list_datnames
+
+def compare_dedispersion(list_datfiles, ref_dir, max_lag=2, smooth_bins=64):
+    """
+    逐个比较去色散结果与 ref_dir 中同名的 prepsubband 输出：两者标准化后在 ±max_lag 个采样点内找相关系数最大的偏移，
+    再求按 smooth_bins 个采样点平均后的相关系数（延迟取整方式不同时白噪声部分不相关，基线、RFI 和脉冲等结构应一致）。
+    Returns:
+        list: [(文件名, 相关系数, 平均后的相关系数, 偏移的采样点数, 采样点数之差), ...]，只包含 ref_dir 中存在的文件
+    """
+    list_results = []
+    for datfile in list_datfiles:
+        ref_file = os.path.join(ref_dir, os.path.basename(datfile))
+        if not os.path.isfile(ref_file):
+            continue
+        x = np.fromfile(datfile, dtype=np.float32).astype(np.float64)
+        y = np.fromfile(ref_file, dtype=np.float32).astype(np.float64)
+        n = (min(len(x), len(y)) - 2 * max_lag) // smooth_bins * smooth_bins
+        if n <= 0:
+            list_results.append((os.path.basename(datfile), 0.0, 0.0, 0, len(x) - len(y)))
+            continue
+        def correlate(a, b):
+            a = (a - a.mean()) / (a.std() or 1.0)
+            b = (b - b.mean()) / (b.std() or 1.0)
+            return float(np.mean(a * b))
+        x_part = x[max_lag:max_lag + n]
+        list_corr = [correlate(x_part, y[max_lag + lag:max_lag + lag + n]) for lag in range(-max_lag, max_lag + 1)]
+        k = int(np.argmax(list_corr))
+        y_part = y[k:k + n]
+        corr_smooth = correlate(x_part.reshape(-1, smooth_bins).mean(axis=1), y_part.reshape(-1, smooth_bins).mean(axis=1))
+        list_results.append((os.path.basename(datfile), list_corr[k], corr_smooth, k - max_lag, len(x) - len(y)))
+    return list_results
+
 def realfft(infile,sourcename, out_dir,ifok_dir, log_path, other_flags="", presto_env=os.environ['PRESTO']):
 
     DM = extract_dm_part(infile)
@@ -1006,6 +2994,160 @@ def zapbirds2cmd(fft_infile_list, zapfile_name,ifok_dir,log_dir):
 
         return cmd_zapbirds_list,ifok_list,log_list
 
+###进程内 FFT：一次读取 .dat，在内存中依次完成 realfft、rednoise 和 zapbirds，只写一次 .fft（FFT_ENGINE = numpy）
+fused_fft_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fused_fft.py')
+
+def read_zaplist(zapfile, baryv=0.0):
+    """
+    读取 zaplist：每行 频率(Hz) 宽度(Hz)，# 开头为注释，不能解析为数字的行跳过。返回 [(频率, 宽度), ...]
+    以 B 开头的行是质心系频率（如已知脉冲星的谐波），与 zapbirds 相同按平均视向速度 baryv（v/c）换算为站心系：f × (1 + baryv)。
+    """
+    list_birds = []
+    with open(zapfile, 'r') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            factor = 1.0
+            if line.startswith('B'):
+                line = line[1:]
+                factor = 1.0 + baryv
+            list_fields = line.split()
+            if len(list_fields) < 2:
+                continue
+            try:
+                list_birds.append((float(list_fields[0]) * factor, float(list_fields[1]) * factor))
+            except ValueError:
+                continue
+    return list_birds
+
+dict_tempo_obs_codes = {'FAST': 'FA', 'GBT': 'GB', 'Arecibo': 'AO', 'Parkes': 'PK', 'Effelsberg': 'EF', 'MeerKAT': 'MK', 'GMRT': 'GM', 'Jodrell': 'JB', 'WSRT': 'WT', 'Nancay': 'NC'}
+dict_baryv_cache = {}
+
+def get_inf_baryv(info):
+    """
+    .inf 对应观测期间指向源方向的平均视向速度（v/c），与 zapbirds 未指定 -baryv 时相同（presto.get_baryv）。
+    已做质心修正的数据（.inf 中 bary = 1）返回 0。
+    """
+    if int(getattr(info, 'bary', 0)) == 1:
+        return 0.0
+    T_s = info.N * info.dt
+    key = (info.RA, info.DEC, float(info.epoch), T_s, info.telescope)
+    if key not in dict_baryv_cache:
+        from presto import presto as presto_lib
+        dict_baryv_cache[key] = float(presto_lib.get_baryv(info.RA, info.DEC, float(info.epoch), T_s, obs=dict_tempo_obs_codes.get(info.telescope, 'FA')))
+    return dict_baryv_cache[key]
+
+def whiten_rednoise(spectrum, T_s, startwidth=6, endwidth=100, endfreq=6.0):
+    """
+    与 PRESTO rednoise 相同的中值法去红噪声（原地修改 spectrum）。
+    频谱分块，每块的平均功率取 功率中值/ln2（指数分布），块宽度从 startwidth 按 log(频率单元) 增长，
+    到 endfreq 处达到 endwidth，此后固定；块中心之间线性插值得到每个频率单元的平均功率，振幅除以其平方根。
+    第 0 个单元（PRESTO 格式中为直流和奈奎斯特分量）置为 1。
+    """
+    numbins = len(spectrum)
+    powers = spectrum.real.astype(np.float32)**2 + spectrum.imag.astype(np.float32)**2
+    endbin = max(int(endfreq * T_s), 2)
+
+    # 宽度增长的低频部分逐块计算
+    list_centres = []
+    list_means = []
+    lobin = 1
+    while lobin < min(endbin, numbins):
+        width = int(startwidth + (endwidth - startwidth) * np.log(lobin) / np.log(endbin))
+        hibin = min(lobin + max(width, 1), numbins)
+        list_centres.append(0.5 * (lobin + hibin - 1))
+        list_means.append(np.median(powers[lobin:hibin]) / np.log(2.0))
+        lobin = hibin
+    # 固定宽度的部分整体变形后一次求中值
+    n_blocks = (numbins - lobin) // endwidth
+    if n_blocks > 0:
+        block_powers = powers[lobin:lobin + n_blocks * endwidth].reshape(n_blocks, endwidth)
+        list_centres += list(lobin + endwidth * np.arange(n_blocks) + 0.5 * (endwidth - 1))
+        list_means += list(np.median(block_powers, axis=1) / np.log(2.0))
+        lobin += n_blocks * endwidth
+    if lobin < numbins:
+        list_centres.append(0.5 * (lobin + numbins - 1))
+        list_means.append(np.median(powers[lobin:]) / np.log(2.0))
+    del powers
+
+    means = np.maximum(np.array(list_means, dtype=np.float64), np.finfo(np.float32).tiny)
+    # 分段处理，避免为整个频谱再分配一份 float64 数组
+    chunk_bins = 1 << 22
+    for k in range(1, numbins, chunk_bins):
+        k_end = min(k + chunk_bins, numbins)
+        spectrum[k:k_end] /= np.sqrt(np.interp(np.arange(k, k_end), list_centres, means)).astype(np.float32)
+    spectrum[0] = 1.0 + 0.0j
+
+def zap_birdies(spectrum, T_s, list_birds, n_avg_bins=50, seed=0):
+    """
+    与 PRESTO zapbirds -zap 相同：把每个干扰频率 (f - w/2, f + w/2) 范围内的频率单元（原地）替换为随机相位、
+    振幅为两侧各 n_avg_bins 个单元功率中值对应的平均振幅。返回被替换的频率单元个数。
+    """
+    numbins = len(spectrum)
+    rng = np.random.default_rng(seed)
+    n_zapped = 0
+    for freq, width in list_birds:
+        lobin = max(int(np.floor((freq - 0.5 * width) * T_s)), 1)
+        hibin = min(int(np.ceil((freq + 0.5 * width) * T_s)) + 1, numbins)
+        if lobin >= hibin:
+            continue
+        powers_around = np.concatenate([spectrum[max(lobin - n_avg_bins, 1):lobin], spectrum[hibin:hibin + n_avg_bins]])
+        powers_around = powers_around.real**2 + powers_around.imag**2
+        mean_power = np.median(powers_around) / np.log(2.0) if len(powers_around) > 0 else 1.0
+        phases = rng.uniform(0, 2 * np.pi, hibin - lobin)
+        spectrum[lobin:hibin] = (np.sqrt(mean_power) * np.exp(1j * phases)).astype(np.complex64)
+        n_zapped += hibin - lobin
+    return n_zapped
+
+def fused_fft(datfile, zapfile="", startwidth=6, endwidth=100, endfreq=6.0, flag_rednoise=True):
+    """
+    一次读取 .dat（内存映射），用 numpy 计算实数 FFT，在内存中去红噪声、消除 zaplist 中的干扰频率，
+    写出与 realfft → rednoise → zapbirds 相同格式的 .fft（complex64，第 0 个单元实部为直流、虚部为奈奎斯特分量），
+    .inf 沿用 .dat 的。结果先写入临时文件再改名，中断时不会留下不完整的 .fft。
+    Returns:
+        str: .fft 文件路径
+    """
+    basename = datfile[:-len('.dat')]
+    fftfile = basename + '.fft'
+    info = infodata.infodata(basename + '.inf')
+
+    data = np.memmap(datfile, dtype=np.float32, mode='r')
+    N = len(data) - len(data) % 2
+    T_s = N * info.dt
+    spectrum_full = np.fft.rfft(data[:N])
+    del data
+    spectrum = np.empty(N // 2, dtype=np.complex64)
+    spectrum[1:] = spectrum_full[1:N // 2]
+    spectrum[0] = complex(spectrum_full[0].real, spectrum_full[N // 2].real)
+    del spectrum_full
+
+    if flag_rednoise:
+        whiten_rednoise(spectrum, T_s, startwidth, endwidth, endfreq)
+    if zapfile:
+        zap_birdies(spectrum, T_s, read_zaplist(zapfile, get_inf_baryv(info)), seed=zlib.crc32(os.path.basename(basename).encode()))
+
+    tmp_fftfile = fftfile + '.tmp'
+    spectrum.tofile(tmp_fftfile)
+    os.replace(tmp_fftfile, fftfile)
+    return fftfile
+
+def fused_fft2cmd(infile_list, zapfile, ifok_dir, log_dir, other_flags=""):
+    cmd_fft_list = []
+    ifok_list = []
+    log_list = []
+
+    for dat in infile_list:
+        DM = extract_dm_part(dat)
+
+        cmd_fft = f"{fused_fft_script} {other_flags} -zapfile {zapfile} {dat}"
+        ifokfile = os.path.join(ifok_dir,f'fused-{DM}.ifok')
+        log_file = os.path.join(log_dir,f'LOG_04-FFT-{DM}.txt')
+
+        cmd_fft_list.append(cmd_fft)
+        ifok_list.append(ifokfile)
+        log_list.append(log_file)
+
+    return cmd_fft_list,ifok_list,log_list
+
 def check_if_DM_trial_was_searched(dat_file, list_zmax, flag_jerk_search, jerksearch_zmax, jerksearch_wmax,v = 0):
     dat_file_nameonly = os.path.basename(dat_file)
     fft_file = dat_file.replace(".dat", ".fft")
@@ -1251,9 +3393,206 @@ def get_DD_scheme_from_DDplan_output(output_DDplan, N_DMs_per_prepsubband, nsubb
                                         list_dict_schemes.append(dict_scheme)
 
 
-                                        
+
                 index = index + 1
 
+###内置去色散计划（DDPLAN_ENGINE = native）：与 DDplan.py 相同的展宽模型和 DM 步长选择，不再调用 DDplan.py 并解析其输出；
+#结果按计划参数缓存在 JSON 文件中，方案已拆分为 DM 数均衡的 prepsubband 调用
+ddplan_allow_dDMs = [0.01, 0.02, 0.03, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 20.0, 30.0, 50.0, 100.0, 200.0, 300.0]
+ddplan_allow_downsamps = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096]
+ddplan_version = 1   # 改变计划算法时加一，使旧缓存失效
+
+def ddplan_dm_smear(DM, BW_MHz, freq_central_MHz, DM_coherent=0.0):
+    """带宽 BW_MHz 内的色散展宽（毫秒）"""
+    return 1000.0 * np.fabs(DM - DM_coherent) * BW_MHz / (0.0001205 * freq_central_MHz**3.0)
+
+def ddplan_BW_smear(dDM, BW_MHz, freq_central_MHz):
+    """DM 步长 dDM 造成的全带宽展宽（毫秒）：最大 DM 误差为 dDM/2"""
+    return ddplan_dm_smear(0.5 * dDM, BW_MHz, freq_central_MHz)
+
+def ddplan_subband_smear(dsubDM, nsubbands, BW_MHz, freq_central_MHz):
+    return ddplan_dm_smear(0.5 * dsubDM, BW_MHz / nsubbands, freq_central_MHz)
+
+def get_ddplan_method(loDM, highDM, dDM, downsamp, t_samp_s, freq_central_MHz, BW_MHz, nchan, nsubbands=0, DM_coherent=0.0, smearfact=2.0):
+    """
+    一段去色散方法（DDplan.py 的 dedisp_method）：DM 步长 dDM 下，通道内展宽达到其他展宽总和 smearfact 倍的 DM 为该段的上限。
+    使用子带时，每次调用的 DM 数从 2 开始按 2 递增，直到子带展宽超过 0.8 × min(步长展宽, 采样时间)。
+    Returns:
+        dict: {'loDM', 'highDM', 'dDM', 'downsamp', 'dsubDM', 'num_DMs', 'DMs_per_call', 'num_calls'}
+    """
+    dtms = 1000.0 * t_samp_s
+    BW_smearing = ddplan_BW_smear(dDM, BW_MHz, freq_central_MHz)
+    DMs_per_call = 0
+    num_calls = 0
+    dsubDM = dDM
+    sub_smearing = 0.0
+    if nsubbands:
+        DMs_per_call = 2
+        while ddplan_subband_smear((DMs_per_call + 2) * dDM, nsubbands, BW_MHz, freq_central_MHz) <= 0.8 * min(BW_smearing, dtms * downsamp):
+            DMs_per_call += 2
+        dsubDM = DMs_per_call * dDM
+        sub_smearing = ddplan_subband_smear(dsubDM, nsubbands, BW_MHz, freq_central_MHz)
+
+    other_smear = np.sqrt(dtms**2.0 + (dtms * downsamp)**2.0 + BW_smearing**2.0 + sub_smearing**2.0)
+    cross_DM = min(smearfact * 0.001 * other_smear / (BW_MHz / nchan) * 0.0001205 * freq_central_MHz**3.0 + DM_coherent, highDM)
+    num_DMs = int(np.ceil((cross_DM - loDM) / dDM))
+    if nsubbands:
+        num_calls = int(np.ceil(num_DMs * dDM / dsubDM))
+        num_DMs = num_calls * DMs_per_call
+    return {'loDM': loDM, 'highDM': loDM + num_DMs * dDM, 'dDM': dDM, 'downsamp': downsamp, 'dsubDM': dsubDM,
+            'num_DMs': num_DMs, 'DMs_per_call': DMs_per_call, 'num_calls': num_calls}
+
+def get_ddplan_methods(loDM, highDM, DM_coherent, freq_central_MHz, BW_MHz, nchan, nsubbands, t_samp_s, ff=1.2):
+    """与 DDplan.py 的 dm_steps 相同：先按通道展宽确定初始降采样和 DM 步长，之后每段降采样加倍、DM 步长随之增大，直到覆盖 highDM"""
+    BW_MHz = np.fabs(BW_MHz)
+    dtms = 1000.0 * t_samp_s
+    index_downsamps = 0
+    index_dDMs = 0
+    min_chan_smearing = ddplan_dm_smear(np.linspace(loDM, highDM, 10000), BW_MHz / nchan, freq_central_MHz, DM_coherent).min()
+    min_BW_smearing = ddplan_dm_smear(ddplan_allow_dDMs[0], BW_MHz, freq_central_MHz)
+    ok_smearing = max(min_chan_smearing, min_BW_smearing, dtms)
+    if ff * min_chan_smearing > dtms or ok_smearing > dtms:
+        okval = ok_smearing if ok_smearing > ff * min_chan_smearing else ff * min_chan_smearing
+        while dtms * ddplan_allow_downsamps[index_downsamps + 1] < okval:
+            index_downsamps += 1
+    downsamp = ddplan_allow_downsamps[index_downsamps]
+
+    dDM_guess = t_samp_s * downsamp * 0.0001205 * freq_central_MHz**3.0 / (0.5 * BW_MHz)
+    while ddplan_allow_dDMs[index_dDMs + 1] < ff * dDM_guess:
+        index_dDMs += 1
+
+    list_methods = [get_ddplan_method(loDM, highDM, ddplan_allow_dDMs[index_dDMs], downsamp, t_samp_s, freq_central_MHz, BW_MHz, nchan, nsubbands, DM_coherent)]
+    while list_methods[-1]['highDM'] < highDM:
+        index_downsamps += 1
+        downsamp = ddplan_allow_downsamps[index_downsamps]
+        while ddplan_BW_smear(ddplan_allow_dDMs[index_dDMs + 1], BW_MHz, freq_central_MHz) < ff * dtms * downsamp:
+            index_dDMs += 1
+        list_methods.append(get_ddplan_method(list_methods[-1]['highDM'], highDM, ddplan_allow_dDMs[index_dDMs], downsamp, t_samp_s, freq_central_MHz, BW_MHz, nchan, nsubbands, DM_coherent))
+    return list_methods
+
+def split_ddplan_methods(list_methods, N_DMs_per_prepsubband, nsubbands):
+    """
+    把各段方法拆分为 prepsubband 调用（格式与 get_DD_scheme_from_DDplan_output 相同，downsamp 同样固定为 1）。
+    使用子带时每次调用为一个子带 DM 段；不使用子带时每段按 N_DMs_per_prepsubband 分为 ceil(段内DM数/上限) 次调用，
+    各次调用的 DM 数相差不超过 1（读取原始数据的开销相同，输出 DM 数均衡，各调用耗时接近）。
+    """
+    list_dict_schemes = []
+    for method in list_methods:
+        if nsubbands > 0:
+            for k in range(method['num_calls']):
+                list_dict_schemes.append({'loDM': round(method['loDM'] + k * method['dsubDM'], 3), 'highDM': round(method['loDM'] + (k + 1) * method['dsubDM'], 3),
+                                          'dDM': method['dDM'], 'downsamp': 1, 'num_DMs': method['DMs_per_call']})
+        else:
+            num_calls = max(1, int(np.ceil(method['num_DMs'] / N_DMs_per_prepsubband)))
+            list_num_DMs = [method['num_DMs'] // num_calls + (1 if k < method['num_DMs'] % num_calls else 0) for k in range(num_calls)]
+            first_DM_index = 0
+            for num_DMs in list_num_DMs:
+                list_dict_schemes.append({'loDM': round(method['loDM'] + first_DM_index * method['dDM'], 3), 'highDM': round(method['loDM'] + (first_DM_index + num_DMs) * method['dDM'], 3),
+                                          'dDM': method['dDM'], 'downsamp': 1, 'num_DMs': num_DMs})
+                first_DM_index += num_DMs
+    return list_dict_schemes
+
+def get_DDplan_scheme_native(loDM, highDM, DM_coherent_dedispersion, N_DMs_per_prepsubband, freq_central_MHz, bw_MHz, nchan, nsubbands, t_samp_s, cache_path=None, out_file=None):
+    """
+    内置的去色散计划，返回值与 get_DDplan_scheme 相同。cache_path 为 JSON 缓存，键为全部计划参数；
+    out_file 不为空时写出与 DDplan.py 相同格式的计划表。
+    """
+    if np.float64(DM_coherent_dedispersion) < 0:
+        print_log("错误：相干去色散的 DM 值小于 0！程序退出...",color=colors.ERROR)
+        exit()
+    cache_key = "v%d|%s|%s|%s|%s|%s|%s|%s|%s|%s" % (ddplan_version, loDM, highDM, DM_coherent_dedispersion, N_DMs_per_prepsubband, freq_central_MHz, np.fabs(bw_MHz), nchan, nsubbands, t_samp_s)
+    dict_cache = {}
+    if cache_path and os.path.isfile(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                dict_cache = json.load(f)
+        except (OSError, ValueError):
+            dict_cache = {}
+    if cache_key in dict_cache:
+        print_log(f"使用缓存的去色散计划（{cache_path}）",color=colors.OKBLUE)
+        return dict_cache[cache_key]['schemes']
+
+    list_methods = get_ddplan_methods(float(loDM), float(highDM), float(DM_coherent_dedispersion), float(freq_central_MHz), float(bw_MHz), int(nchan), int(nsubbands), float(t_samp_s))
+    list_dict_schemes = split_ddplan_methods(list_methods, int(N_DMs_per_prepsubband), int(nsubbands))
+
+    list_lines = []
+    if nsubbands == 0:
+        list_lines.append("  Low DM    High DM     dDM  DownSamp   #DMs  WorkFract")
+    else:
+        list_lines.append("  Low DM    High DM     dDM  DownSamp  dsubDM   #DMs  DMs/call  calls  WorkFract")
+    total_work = sum(method['num_DMs'] / method['downsamp'] for method in list_methods)
+    for method in list_methods:
+        work_fract = method['num_DMs'] / method['downsamp'] / total_work
+        if nsubbands == 0:
+            list_lines.append("%9.3f %9.3f %7.2f %6d %8d    %.4g" % (method['loDM'], method['highDM'], method['dDM'], method['downsamp'], method['num_DMs'], work_fract))
+        else:
+            list_lines.append("%9.3f %9.3f %7.2f %6d %8.2f %6d %6d %6d    %.4g" % (method['loDM'], method['highDM'], method['dDM'], method['downsamp'], method['dsubDM'], method['num_DMs'], method['DMs_per_call'], method['num_calls'], work_fract))
+    print_log("+++++++++++++++++++++++++++++++++++++++++++++++++++++++\n")
+    print_log("\n".join(list_lines))
+    print_log("+++++++++++++++++++++++++++++++++++++++++++++++++++++++")
+    if out_file:
+        with open(out_file, 'w') as f:
+            f.write("\n".join(list_lines) + "\n")
+
+    if cache_path:
+        dict_cache[cache_key] = {'methods': list_methods, 'schemes': list_dict_schemes}
+        makedir(os.path.dirname(os.path.abspath(cache_path)))
+        with open(cache_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(dict_cache, f)
+        os.replace(cache_path + '.tmp', cache_path)
+    return list_dict_schemes
+
+def get_custom_DD_schemes(list_dm_steps):
+    """IF_DDPLAN=0：DM_STEP 中的每个 (低 DM, 高 DM, DM 步长) 为一个方案"""
+    list_dict_schemes = []
+    for loDM, highDM, dDM in list_dm_steps:
+        list_dict_schemes.append({'loDM': loDM, 'highDM': highDM, 'dDM': dDM, 'downsamp': 1, 'num_DMs': int((highDM - loDM) // dDM)})
+    return list_dict_schemes
+
+def get_partition_cost(n_calls, N_DMs, n_workers, read_cost_DMs):
+    """n_calls 次 prepsubband 完成 N_DMs 个 DM 的耗时（以输出一个 DM 的耗时为单位）：每次调用读取一遍原始数据（read_cost_DMs）再输出其中的 DM，n_workers 个同时运行"""
+    return int(np.ceil(n_calls / n_workers)) * (read_cost_DMs + int(np.ceil(N_DMs / n_calls)))
+
+def partition_DD_schemes(list_DD_schemes, n_workers, max_DMs_per_call, nchan, nsubbands=0):
+    """
+    把方案按 DM 连续拆分为更多的 prepsubband 调用，使并行去色散能用上 n_workers 个核。
+    每次调用读取、消除掩模并形成子带的开销约为 2×nchan，每个 DM 的输出开销约为 nsub，
+    总调用数 K 在满足每次调用不超过 max_DMs_per_call 个 DM 的前提下取模型耗时最小（相同时取最小，读取原始数据的次数最少）。
+    K 按 DM 数分配给各方案，每个方案内各段的 DM 数相差不超过 1。
+    拆分后的 DM 值（低 DM + 序号 × 步长）和文件名与拆分前相同，最后一个方案多输出的一个 DM 仍在最后一段。
+    """
+    list_num_DMs = [int(scheme['num_DMs']) for scheme in list_DD_schemes]
+    N_DMs = sum(list_num_DMs)
+    if N_DMs == 0 or n_workers <= 1:
+        return list_DD_schemes
+    read_cost_DMs = 2.0 * nchan / (nsubbands if nsubbands > 0 else nchan)
+    K_min = max(len(list_DD_schemes), int(np.ceil(N_DMs / max(1, max_DMs_per_call))))
+    K_max = max(K_min, min(N_DMs, 4 * n_workers))
+    K = min(range(K_min, K_max + 1), key=lambda n_calls: (get_partition_cost(n_calls, N_DMs, n_workers, read_cost_DMs), n_calls))
+
+    # 按 DM 数分配调用次数（最大余数法），每个方案至少一次且不超过其 DM 数
+    list_quota = [K * num_DMs / N_DMs for num_DMs in list_num_DMs]
+    list_calls = [max(1, min(num_DMs, int(np.floor(quota)))) for num_DMs, quota in zip(list_num_DMs, list_quota)]
+    for k in sorted(range(len(list_calls)), key=lambda k: list_quota[k] - np.floor(list_quota[k]), reverse=True):
+        if sum(list_calls) >= K:
+            break
+        if list_calls[k] < list_num_DMs[k]:
+            list_calls[k] += 1
+    for k in range(len(list_calls)):
+        list_calls[k] = max(list_calls[k], int(np.ceil(list_num_DMs[k] / max(1, max_DMs_per_call))))
+
+    list_dict_schemes = []
+    for scheme, num_DMs, n_calls in zip(list_DD_schemes, list_num_DMs, list_calls):
+        loDM = np.float64(scheme['loDM'])
+        dDM = np.float64(scheme['dDM'])
+        first_DM_index = 0
+        for k in range(n_calls):
+            num_DMs_call = num_DMs // n_calls + (1 if k < num_DMs % n_calls else 0)
+            list_dict_schemes.append({'loDM': round(loDM + first_DM_index * dDM, 6), 'highDM': round(loDM + (first_DM_index + num_DMs_call) * dDM, 6),
+                                      'dDM': scheme['dDM'], 'downsamp': scheme['downsamp'], 'num_DMs': num_DMs_call})
+            first_DM_index += num_DMs_call
+    return list_dict_schemes
+
 
 def ps2png(input_pattern, rotated=True, recursive=False, output_dir=None):
     # 匹配文件
@@ -1467,6 +3806,464 @@ def send_email(content, file_paths=None):
 
 
 
+###原生数据头读取：一次读出 PSRFITS / filterbank 文件头，不再多次调用 readfile/header
+#返回的字典键与 Observation 的属性同名；结果按 (路径, 大小, 修改时间) 缓存在 JSON 文件中
+fits_block_bytes = 2880
+dict_fits_tform_bytes = {'L': 1, 'B': 1, 'I': 2, 'J': 4, 'K': 8, 'A': 1, 'E': 4, 'D': 8, 'C': 8, 'M': 16, 'P': 8, 'Q': 16}
+
+def parse_fits_value(value_str):
+    """解析 FITS 头中 '= ' 之后的值（字符串、逻辑值、整数或浮点数）"""
+    value_str = value_str.strip()
+    if value_str.startswith("'"):
+        k = 1
+        chars = []
+        while k < len(value_str):
+            if value_str[k] == "'":
+                if value_str[k+1:k+2] == "'":
+                    chars.append("'")
+                    k += 2
+                    continue
+                break
+            chars.append(value_str[k])
+            k += 1
+        return "".join(chars).rstrip()
+    value_str = value_str.split('/', 1)[0].strip()
+    if value_str in ('T', 'F'):
+        return value_str == 'T'
+    try:
+        return int(value_str)
+    except ValueError:
+        pass
+    try:
+        return float(value_str.replace('D', 'E'))
+    except ValueError:
+        return value_str
+
+def read_fits_hdus(f, extname_stop='SUBINT'):
+    """依次读取各个 HDU 的头，直到 EXTNAME 为 extname_stop。返回 [(头字典, 数据起始位置), ...]"""
+    list_hdus = []
+    position = 0
+    while True:
+        dict_cards = {}
+        flag_end = False
+        while not flag_end:
+            block = f.read(fits_block_bytes)
+            if len(block) < fits_block_bytes:
+                return list_hdus
+            if position == 0 and not block.startswith(b'SIMPLE  ='):
+                return list_hdus
+            position += fits_block_bytes
+            for k in range(0, fits_block_bytes, 80):
+                card = block[k:k+80].decode('ascii', errors='replace')
+                key = card[:8].strip()
+                if key == 'END':
+                    flag_end = True
+                    break
+                if card[8:10] == '= ' and key not in dict_cards:
+                    dict_cards[key] = parse_fits_value(card[10:])
+        list_hdus.append((dict_cards, position))
+        if dict_cards.get('EXTNAME') == extname_stop:
+            return list_hdus
+        # 跳过数据部分
+        data_bytes = 0
+        naxis = dict_cards.get('NAXIS', 0)
+        if naxis > 0:
+            n_elements = 1
+            for k in range(1, naxis + 1):
+                n_elements *= dict_cards.get(f'NAXIS{k}', 0)
+            data_bytes = abs(dict_cards.get('BITPIX', 8)) // 8 * dict_cards.get('GCOUNT', 1) * (dict_cards.get('PCOUNT', 0) + n_elements)
+        position += (data_bytes + fits_block_bytes - 1) // fits_block_bytes * fits_block_bytes
+        f.seek(position)
+
+def read_fits_column_first_row(f, dict_cards, data_start, column_name):
+    """读取二进制表第一行中某一列（E/D 类型）的数值，找不到时返回 None"""
+    offset = 0
+    for k in range(1, dict_cards.get('TFIELDS', 0) + 1):
+        match = re.match(r'\s*(\d*)([A-Z])', str(dict_cards.get(f'TFORM{k}', '')))
+        if match is None:
+            return None
+        repeat = int(match.group(1)) if match.group(1) else 1
+        code = match.group(2)
+        if dict_cards.get(f'TTYPE{k}') == column_name:
+            if code not in ('E', 'D'):
+                return None
+            f.seek(data_start + offset)
+            fmt = '>%d%s' % (repeat, 'f' if code == 'E' else 'd')
+            return struct.unpack(fmt, f.read(struct.calcsize(fmt)))
+        if code == 'X':
+            offset += (repeat + 7) // 8
+        elif code in dict_fits_tform_bytes:
+            offset += repeat * dict_fits_tform_bytes[code]
+        else:
+            return None
+    return None
+
+def ra_dec_str2deg(ra_str, dec_str):
+    """'hh:mm:ss.s' 和 '±dd:mm:ss.s' 转为度"""
+    def sexagesimal(value_str):
+        parts = [float(x) for x in value_str.strip().lstrip('+-').split(':')]
+        parts += [0.0] * (3 - len(parts))
+        return parts[0] + parts[1] / 60. + parts[2] / 3600.
+    try:
+        ra_deg = 15.0 * sexagesimal(ra_str)
+        dec_deg = sexagesimal(dec_str) * (-1.0 if dec_str.strip().startswith('-') else 1.0)
+    except (ValueError, AttributeError):
+        return 0.0, 0.0
+    return ra_deg, dec_deg
+
+def read_psrfits_header(file_abspath):
+    """读取 PSRFITS 文件头，字段与 presto.psrfits.SpecInfo 对应"""
+    with open(file_abspath, 'rb') as f:
+        list_hdus = read_fits_hdus(f)
+        if not list_hdus or list_hdus[-1][0].get('EXTNAME') != 'SUBINT':
+            raise ValueError(f"{file_abspath} 不是 PSRFITS 文件（没有 SUBINT 表）")
+        primary = list_hdus[0][0]
+        subint, data_start = list_hdus[-1]
+        freqs = read_fits_column_first_row(f, subint, data_start, 'DAT_FREQ')
+        offs_sub = read_fits_column_first_row(f, subint, data_start, 'OFFS_SUB')
+
+    header = {}
+    header['telescope'] = primary.get('TELESCOP', '')
+    header['observer'] = primary.get('OBSERVER', '')
+    header['source_name'] = primary.get('SRC_NAME', '')
+    header['receiver'] = primary.get('FRONTEND', '')
+    header['backend'] = primary.get('BACKEND', '')
+    header['project'] = primary.get('PROJID', '')
+    header['date_obs'] = primary.get('DATE-OBS', '')
+    header['ra_str'] = primary.get('RA', '')
+    header['dec_str'] = primary.get('DEC', '')
+    header['ra_deg'], header['dec_deg'] = ra_dec_str2deg(header['ra_str'], header['dec_str'])
+    header['MJD_int'] = int(primary.get('STT_IMJD', 0))
+    header['MJD_sec'] = float(primary.get('STT_SMJD', 0)) + float(primary.get('STT_OFFS', 0))
+    header['seconds_of_day'] = header['MJD_sec']
+    header['Tstart_MJD'] = header['MJD_int'] + header['MJD_sec'] / 86400.
+
+    header['t_samp_s'] = float(subint['TBIN'])
+    header['nchan'] = int(subint['NCHAN'])
+    header['nbits'] = int(subint['NBITS'])
+    header['N_samples'] = int(subint['NAXIS2']) * int(subint['NSBLK'])
+    # 拆分文件（如 FAST 的 *_0001.fits ...）的 STT_* 相同，文件在整个观测中的位置由 NSUBOFFS（没有时由第一行的 OFFS_SUB）给出
+    T_subint_s = int(subint['NSBLK']) * header['t_samp_s']
+    if 'NSUBOFFS' in subint and int(subint['NSUBOFFS']) >= 0:
+        start_subint = int(subint['NSUBOFFS'])
+    elif offs_sub:
+        start_subint = int(round((float(offs_sub[0]) - 0.5 * T_subint_s) / T_subint_s))
+    else:
+        start_subint = 0
+    header['start_sample'] = start_subint * int(subint['NSBLK'])
+    header['Tstart_MJD'] += header['start_sample'] * header['t_samp_s'] / 86400.
+    header['T_obs_s'] = header['N_samples'] * header['t_samp_s']
+    header['chanbw_MHz'] = float(subint['CHAN_BW'])
+    header['bw_MHz'] = header['nchan'] * header['chanbw_MHz']
+    header['freq_central_MHz'] = float(primary.get('OBSFREQ', 0.0))
+    if freqs:
+        header['freq_low_MHz'] = float(min(freqs))
+        header['freq_high_MHz'] = float(max(freqs))
+    else:
+        header['freq_low_MHz'] = header['freq_central_MHz'] - 0.5 * abs(header['bw_MHz']) + 0.5 * abs(header['chanbw_MHz'])
+        header['freq_high_MHz'] = header['freq_central_MHz'] + 0.5 * abs(header['bw_MHz']) - 0.5 * abs(header['chanbw_MHz'])
+    return header
+
+#filterbank（SIGPROC）头中各关键字的类型
+list_sigproc_int_keys = ('telescope_id', 'machine_id', 'data_type', 'nchans', 'nbits', 'nifs', 'nbeams', 'ibeam', 'barycentric', 'pulsarcentric', 'nsamples')
+list_sigproc_double_keys = ('tstart', 'tsamp', 'fch1', 'foff', 'refdm', 'az_start', 'za_start', 'src_raj', 'src_dej', 'period')
+list_sigproc_str_keys = ('source_name', 'rawdatafile')
+
+def read_filterbank_header(file_abspath):
+    """读取 filterbank（SIGPROC）文件头，字段与 presto.filterbank.FilterbankFile 对应"""
+    def read_string(f):
+        n_chars = struct.unpack('<i', f.read(4))[0]
+        if not 0 < n_chars < 256:
+            raise ValueError(f"{file_abspath} 不是 filterbank 文件")
+        return f.read(n_chars).decode('ascii', errors='replace')
+
+    dict_header = {}
+    with open(file_abspath, 'rb') as f:
+        if read_string(f) != 'HEADER_START':
+            raise ValueError(f"{file_abspath} 不是 filterbank 文件")
+        while True:
+            key = read_string(f)
+            if key == 'HEADER_END':
+                break
+            if key in list_sigproc_int_keys:
+                dict_header[key] = struct.unpack('<i', f.read(4))[0]
+            elif key in list_sigproc_double_keys:
+                dict_header[key] = struct.unpack('<d', f.read(8))[0]
+            elif key in list_sigproc_str_keys:
+                dict_header[key] = read_string(f)
+            else:
+                raise ValueError(f"{file_abspath}: 未知的 filterbank 头关键字 {key}")
+        header_bytes = f.tell()
+
+    nchan = dict_header['nchans']
+    nbits = dict_header['nbits']
+    bytes_per_spectrum = nchan * nbits * dict_header.get('nifs', 1) // 8
+    header = {}
+    header['N_samples'] = (os.path.getsize(file_abspath) - header_bytes) // bytes_per_spectrum
+    header['t_samp_s'] = dict_header['tsamp']
+    header['T_obs_s'] = header['N_samples'] * header['t_samp_s']
+    header['nbits'] = nbits
+    header['nchan'] = nchan
+    header['chanbw_MHz'] = dict_header['foff']
+    header['bw_MHz'] = nchan * dict_header['foff']
+    header['freq_central_MHz'] = dict_header['fch1'] + dict_header['foff'] * 0.5 * nchan
+    freq_last = dict_header['fch1'] + dict_header['foff'] * (nchan - 1)
+    header['freq_high_MHz'] = max(dict_header['fch1'], freq_last)
+    header['freq_low_MHz'] = min(dict_header['fch1'], freq_last)
+    header['MJD_int'] = int(dict_header['tstart'])
+    header['Tstart_MJD'] = dict_header['tstart']
+    header['source_name'] = dict_header.get('source_name', '').strip()
+    return header
+
+raw_header_version = 2    # 文件头字段改变时加一，使 header_cache.json 中的旧记录失效
+
+def get_observation_offsets(list_observations, t_samp_s):
+    """
+    各文件的起始采样点（以第一个文件为 0）。
+    各文件头中的 start_sample（PSRFITS 的 NSUBOFFS × NSBLK）互不相同时按它计算；
+    否则（filterbank、没有 NSUBOFFS 等）按 Tstart_MJD 之差换算。
+    """
+    list_start_samples = [getattr(obs, 'start_sample', None) for obs in list_observations]
+    if None not in list_start_samples and len(set(list_start_samples)) == len(list_start_samples):
+        return [int(start_sample) - int(list_start_samples[0]) for start_sample in list_start_samples]
+    Tstart_MJD = np.float64(list_observations[0].Tstart_MJD)
+    return [int(round((np.float64(obs.Tstart_MJD) - Tstart_MJD) * 86400. / t_samp_s)) for obs in list_observations]
+
+def read_data_header(file_abspath, data_type):
+    if data_type == "psrfits":
+        return read_psrfits_header(file_abspath)
+    return read_filterbank_header(file_abspath)
+
+def read_data_headers(list_files, data_type, cache_path=None, n_threads=8):
+    """
+    读取一组数据文件的头（未缓存的文件用线程池并行读取）。
+    读取失败的文件返回 None，由调用者改用 PRESTO 读取。
+
+    Args:
+        list_files (list): 文件路径列表
+        data_type (str): psrfits 或 filterbank
+        cache_path (str, optional): JSON 缓存文件路径
+        n_threads (int): 并行读取的线程数
+    Returns:
+        list: 与 list_files 对应的头字典列表
+    """
+    dict_cache = {}
+    if cache_path and os.path.isfile(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                dict_cache = json.load(f)
+        except (OSError, ValueError):
+            dict_cache = {}
+
+    def get_cache_key(file_abspath):
+        stat = os.stat(file_abspath)
+        return f"{file_abspath}|{stat.st_size}|{stat.st_mtime_ns}|{data_type}|{raw_header_version}"
+
+    list_keys = [get_cache_key(os.path.abspath(x)) for x in list_files]
+    list_todo = [k for k, key in enumerate(list_keys) if key not in dict_cache]
+
+    def read_one(k):
+        try:
+            return read_data_header(os.path.abspath(list_files[k]), data_type)
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            print_log(f"警告：无法直接读取 {list_files[k]} 的文件头（{e}），将使用 PRESTO 读取", color=colors.WARNING)
+            return None
+
+    if list_todo:
+        with ThreadPool(max(1, min(n_threads, len(list_todo)))) as thread_pool:
+            list_headers = thread_pool.map(read_one, list_todo)
+        for k, header in zip(list_todo, list_headers):
+            if header is not None:
+                dict_cache[list_keys[k]] = header
+        if cache_path:
+            # 只保留仍然存在的文件，避免缓存无限增长
+            dict_cache = {key: value for key, value in dict_cache.items() if os.path.exists(key.split('|')[0])}
+            makedir(os.path.dirname(os.path.abspath(cache_path)))
+            with open(cache_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(dict_cache, f)
+            os.replace(cache_path + '.tmp', cache_path)
+    return [dict_cache.get(key) for key in list_keys]
+
+###快速缓冲目录：多线程复制原始数据，断点续传并用 CRC32 校验
+#复制过程中写入 <文件>.part，并在 <文件>.part.json 中记录已写入的长度和 CRC，中断后从记录处继续
+#校验通过后才重命名为正式文件名，因此正式文件存在即表示复制完成
+buffer_copy_chunk_bytes = 64 * 1024**2
+buffer_manifest_name = '.buffer_manifest.json'
+dict_buffer = {'dir': '', 'wait_timeout_s': 6 * 3600.0, 'handle': None}
+
+def file_crc32(file_path, chunk_bytes=buffer_copy_chunk_bytes):
+    crc = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            data = f.read(chunk_bytes)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+    return crc
+
+def copy_file_resumable(src, dst, progress_callback=None):
+    """
+    断点续传复制 src 到 dst，边复制边计算源文件的 CRC32，写完后重新读取目标文件校验。
+    Returns:
+        int: 源文件的 CRC32
+    """
+    part_path = dst + '.part'
+    state_path = part_path + '.json'
+    stat = os.stat(src)
+    offset, crc = 0, 0
+    if os.path.isfile(part_path) and os.path.isfile(state_path):
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                dict_state = json.load(f)
+            if dict_state['src_size'] == stat.st_size and dict_state['src_mtime_ns'] == stat.st_mtime_ns and os.path.getsize(part_path) >= dict_state['offset']:
+                offset, crc = int(dict_state['offset']), int(dict_state['crc32'])
+        except (OSError, ValueError, KeyError):
+            offset, crc = 0, 0
+
+    with open(src, 'rb') as fin, open(part_path, 'r+b' if offset > 0 else 'wb') as fout:
+        fout.truncate(offset)
+        fout.seek(offset)
+        fin.seek(offset)
+        if progress_callback and offset > 0:
+            progress_callback(offset)
+        while True:
+            data = fin.read(buffer_copy_chunk_bytes)
+            if not data:
+                break
+            fout.write(data)
+            crc = zlib.crc32(data, crc)
+            offset += len(data)
+            # 先落盘再记录进度，记录的长度之前的数据一定已经写入
+            fout.flush()
+            os.fsync(fout.fileno())
+            with open(state_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump({'src_size': stat.st_size, 'src_mtime_ns': stat.st_mtime_ns, 'offset': offset, 'crc32': crc}, f)
+            os.replace(state_path + '.tmp', state_path)
+            if progress_callback:
+                progress_callback(len(data))
+
+    # 数据已逐块 fsync，丢弃目标文件的页缓存后再读取校验，确保读到的是磁盘上的内容而不是刚写入的缓存
+    if hasattr(os, 'posix_fadvise'):
+        with open(part_path, 'rb') as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    if offset != stat.st_size or file_crc32(part_path) != crc:
+        for path in (part_path, state_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raise IOError(f"{dst} 校验失败（已写入 {offset}/{stat.st_size} 字节）")
+    os.replace(part_path, dst)
+    os.remove(state_path)
+    return crc
+
+def load_buffer_manifest(buffer_dir):
+    manifest_path = os.path.join(buffer_dir, buffer_manifest_name)
+    if os.path.isfile(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    return {}
+
+def check_buffer_copy_done(src, dst, dict_manifest):
+    """目标文件是普通文件、大小一致，且清单中记录的源文件大小和修改时间没有变化时，认为已复制完成"""
+    if not os.path.isfile(dst) or os.path.islink(dst):
+        return False
+    stat = os.stat(src)
+    entry = dict_manifest.get(os.path.basename(dst))
+    return (entry is not None and os.path.getsize(dst) == stat.st_size
+            and entry.get('src_size') == stat.st_size and entry.get('src_mtime_ns') == stat.st_mtime_ns)
+
+def start_buffer_copy(list_pairs, buffer_dir, n_threads=4):
+    """
+    在后台线程中按列表顺序复制 [(源文件, 目标文件), ...]，立即返回，之后用 wait_buffer_copy 等待。
+    复制两次仍失败的文件，在目标位置创建指向源文件的符号链接，使后续任务仍然可以读取。
+    复制期间 run_cmd 会等待命令中尚未复制完成的缓冲目录输入文件（wait_for_buffer_inputs）；
+    复制线程运行时不能 fork 子进程，进程池启动前会先等待复制结束（wait_buffer_copy_before_fork）。
+    """
+    dict_buffer['dir'] = os.path.abspath(buffer_dir)
+    total_bytes = sum(os.path.getsize(src) for src, _ in list_pairs)
+    progress_bar = tqdm(total=total_bytes, desc=f"复制到缓冲目录-{n_threads}线程", unit="B", unit_scale=True, unit_divisor=1024, dynamic_ncols=True)
+    progress_lock = threading.Lock()
+
+    def update_progress(n_bytes):
+        with progress_lock:
+            progress_bar.update(n_bytes)
+
+    def copy_one(pair):
+        src, dst = pair
+        if os.path.islink(dst):
+            os.remove(dst)
+        error = None
+        for attempt in range(2):
+            try:
+                crc = copy_file_resumable(src, dst, update_progress)
+                stat = os.stat(src)
+                return (src, dst, {'src': src, 'src_size': stat.st_size, 'src_mtime_ns': stat.st_mtime_ns, 'crc32': crc}, None)
+            except OSError as e:
+                error = e
+        os.symlink(src, dst)
+        return (src, dst, None, error)
+
+    thread_pool = ThreadPool(max(1, min(n_threads, len(list_pairs))))
+    async_result = thread_pool.map_async(copy_one, list_pairs, chunksize=1)
+    dict_buffer['handle'] = {'pool': thread_pool, 'result': async_result, 'progress_bar': progress_bar, 'buffer_dir': buffer_dir, 'list_failed': None}
+    return dict_buffer['handle']
+
+def wait_buffer_copy(handle):
+    """
+    等待 start_buffer_copy 启动的复制全部结束，更新缓冲目录清单。
+    Returns:
+        list: 复制失败（已改为符号链接）的源文件列表
+    """
+    if handle is None:
+        return []
+    if handle['list_failed'] is not None:
+        return handle['list_failed']
+    list_results = handle['result'].get()
+    handle['pool'].close()
+    handle['pool'].join()
+    handle['progress_bar'].close()
+
+    dict_manifest = load_buffer_manifest(handle['buffer_dir'])
+    list_failed = []
+    for src, dst, entry, error in list_results:
+        if entry is None:
+            print_log(f"警告：{src} 复制到缓冲目录失败（{error}），改为直接读取原文件", color=colors.WARNING)
+            list_failed.append(src)
+            dict_manifest.pop(os.path.basename(dst), None)
+        else:
+            dict_manifest[os.path.basename(dst)] = entry
+    manifest_path = os.path.join(handle['buffer_dir'], buffer_manifest_name)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(dict_manifest, f, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    dict_buffer['dir'] = ''
+    dict_buffer['handle'] = None
+    handle['list_failed'] = list_failed
+    return list_failed
+
+def wait_buffer_copy_before_fork():
+    """
+    fork 时子进程只复制调用 fork 的线程，复制线程持有的锁（tqdm、文件对象等）在子进程中永远不会释放，
+    因此启动进程池或子进程前，先等待后台复制全部结束
+    """
+    if dict_buffer['handle'] is not None:
+        print_log("等待缓冲目录复制完成后再启动进程池", color=colors.OKBLUE, mode='p')
+        wait_buffer_copy(dict_buffer['handle'])
+
+def wait_for_buffer_inputs(cmd, work_dir):
+    """命令的输入文件位于正在复制的缓冲目录中、且尚未复制完成时，等待其出现（最多 wait_timeout_s 秒）"""
+    if not dict_buffer['dir']:
+        return
+    list_waiting = [path for path in get_cmd_input_files(cmd, work_dir) if path.startswith(dict_buffer['dir'] + os.sep) and not os.path.exists(path)]
+    if not list_waiting:
+        return
+    print_log(f"等待 {len(list_waiting)} 个输入文件复制到缓冲目录，例如 {list_waiting[0]}", color=colors.OKBLUE, mode='p')
+    t_start = time.time()
+    while any(not os.path.exists(path) for path in list_waiting) and time.time() - t_start < dict_buffer['wait_timeout_s']:
+        time.sleep(5)
+
 def get_command_output_with_pipe(command1, command2):
         list_for_Popen_cmd1 = command1.split()
         list_for_Popen_cmd2 = command2.split()
@@ -1536,15 +4333,107 @@ def make_even_number(number_int):  # 定义一个函数，将输入的数字转
                 exit()  
 
 
+###rfifind 掩模摘要：每个掩模只解析一次，结果保存在 *_rfifind_summary.npz 中，掩模（或 .weights/.bytemask）变化后自动重建
+#bytemask 中各位的含义（rfifind.c）
+dict_bytemask_bits = {'PADDING': 1, 'OLDMASK': 2, 'USERCHAN': 4, 'USERINTS': 8, 'BAD_POW': 16, 'BAD_STD': 32, 'BAD_AVG': 64}
+dict_rfifind_summary_cache = {}
+
+def get_rfifind_summary_signature(mask_file):
+    """掩模及相关文件的路径、大小和修改时间，任一变化都会使摘要失效"""
+    list_parts = []
+    for path in (mask_file, mask_file.replace('.mask', '.bytemask'), mask_file.replace('.mask', '.weights')):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            list_parts.append(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}")
+    return "\n".join(list_parts)
+
+def build_rfifind_summary(mask_file, summary_file=None):
+    """
+    解析掩模，生成摘要并保存为 npz：
+        nchan, nint, ptsperint, dtint, mjd
+        zap_chans, zap_ints: 整体消除的通道和时间段
+        chan_zap_fraction: 每个通道被消除的时间段比例
+        int_zap_fraction: 每个时间段被消除的通道比例
+        fraction_masked_channels, fraction_masked_ints
+        ignorechan: .weights 中权重为 0 的通道（没有 .weights 时为空）
+        bytemask_flag_names, bytemask_flag_counts, bytemask_fraction: bytemask 各标志的计数和非零比例
+    """
+    summary_file = summary_file or mask_file.replace('.mask', '_summary.npz')
+    signature = get_rfifind_summary_signature(mask_file)
+    mask = read_rfifind_mask(mask_file)
+    nchan, nint = mask['numchan'], len(mask['chans_per_int'])
+
+    array_chan_count = np.zeros(nchan, dtype=np.int64)
+    array_int_fraction = np.zeros(nint, dtype=np.float64)
+    for k, chans in enumerate(mask['chans_per_int']):
+        if chans:
+            array_chan_count[np.asarray(chans, dtype=np.int64)] += 1
+        array_int_fraction[k] = len(chans) / nchan
+
+    array_ignorechan = np.zeros(0, dtype=np.int64)
+    weights_file = mask_file.replace('.mask', '.weights')
+    if os.path.exists(weights_file):
+        array_weights = np.loadtxt(weights_file, unpack=True, usecols=(0, 1,), skiprows=1, ndmin=2)
+        array_ignorechan = array_weights[0][array_weights[1] == 0].astype(np.int64)
+
+    list_flag_names = list(dict_bytemask_bits.keys())
+    array_flag_counts = np.zeros(len(list_flag_names), dtype=np.int64)
+    bytemask_fraction = 0.0
+    bytemask_file = mask_file.replace('.mask', '.bytemask')
+    if os.path.exists(bytemask_file):
+        array_bytemask = np.fromfile(bytemask_file, dtype=np.uint8)
+        for k, name in enumerate(list_flag_names):
+            array_flag_counts[k] = np.count_nonzero(array_bytemask & dict_bytemask_bits[name])
+        if array_bytemask.size > 0:
+            bytemask_fraction = np.count_nonzero(array_bytemask) / array_bytemask.size
+
+    summary = {
+        'signature': signature,
+        'nchan': nchan,
+        'nint': nint,
+        'ptsperint': mask['ptsperint'],
+        'dtint': mask['dtint'],
+        'mjd': mask['mjd'],
+        'zap_chans': np.asarray(mask['zap_chans'], dtype=np.int64),
+        'zap_ints': np.asarray(mask['zap_ints'], dtype=np.int64),
+        'chan_zap_fraction': array_chan_count / max(nint, 1),
+        'int_zap_fraction': array_int_fraction,
+        'fraction_masked_channels': len(set(mask['zap_chans'])) / nchan,
+        'fraction_masked_ints': len(set(mask['zap_ints'])) / max(nint, 1),
+        'ignorechan': array_ignorechan,
+        'bytemask_flag_names': np.array(list_flag_names),
+        'bytemask_flag_counts': array_flag_counts,
+        'bytemask_fraction': bytemask_fraction,
+    }
+    with open(summary_file + '.tmp', 'wb') as f:
+        np.savez(f, **summary)
+    os.replace(summary_file + '.tmp', summary_file)
+    return summary
+
+def load_rfifind_summary(mask_file):
+    """读取掩模摘要（同一进程内只读一次），不存在或已过期时重新生成"""
+    signature = get_rfifind_summary_signature(mask_file)
+    if signature in dict_rfifind_summary_cache:
+        return dict_rfifind_summary_cache[signature]
+    summary_file = mask_file.replace('.mask', '_summary.npz')
+    summary = None
+    if os.path.exists(summary_file):
+        try:
+            with np.load(summary_file, allow_pickle=False) as npz:
+                if str(npz['signature']) == signature:
+                    summary = {key: (npz[key].item() if npz[key].ndim == 0 else npz[key]) for key in npz.files}
+        except (OSError, ValueError, KeyError):
+            summary = None
+    if summary is None:
+        summary = build_rfifind_summary(mask_file, summary_file)
+    dict_rfifind_summary_cache[signature] = summary
+    return summary
+
 def get_rfifind_result(file_mask, LOG_file):
-        rfifind_mask = rfifind.rfifind(file_mask)  # 加载 rfifind 对象
+        summary = load_rfifind_summary(file_mask)  # 读取掩模摘要（不再重新加载 rfifind 对象）
 
-        N_int = rfifind_mask.nint  # 获取时间积分的数量
-        N_chan = rfifind_mask.nchan  # 获取频率通道的数量
-        N_int_masked = len(rfifind_mask.mask_zap_ints)  # 获取被屏蔽的时间积分数量
-        N_chan_masked = len(rfifind_mask.mask_zap_chans)  # 获取被屏蔽的频率通道数量
-        fraction_int_masked = np.float64(N_int_masked / N_int)  # 计算被屏蔽的时间积分比例
-        fraction_chan_masked = np.float64(N_chan_masked / N_chan)  # 计算被屏蔽的频率通道比例
+        fraction_int_masked = np.float64(summary['fraction_masked_ints'])  # 计算被屏蔽的时间积分比例
+        fraction_chan_masked = np.float64(summary['fraction_masked_channels'])  # 计算被屏蔽的频率通道比例
 
         # print("get_rfifind_result:: 文件掩膜：%s" % file_mask)  # 打印文件掩膜
         # print("get_rfifind_result:: 日志文件：%s" % LOG_file)  # 打印日志文件
@@ -1826,6 +4715,329 @@ def singlepulse_search(work_dir, log_dir, LOG_basename, list_files_to_search, si
         os.system('single_pulse_search.py *.singlepulse')
         print("done!"); sys.stdout.flush()
 
+###进程内单脉冲搜寻（SINGLEPULSE_ENGINE = numpy）：多个 DM 的 .dat（内存映射）按时间分块成批做多宽度 boxcar 匹配滤波，
+#事件写入列式事件库（.npz，每列一个数组），不再为每个 DM 启动一次 single_pulse_search.py
+singlepulse_default_downfacts = [2, 3, 4, 6, 9, 14, 20, 30, 45, 70, 100, 150, 220, 300]   # 与 single_pulse_search.py 相同
+singlepulse_chunk_blocks = 256      # 每次处理的去趋势块数
+singlepulse_batch_dms = 16          # 每批一起处理的 DM 试验数
+list_event_columns = ('DM', 'sigma', 'time', 'sample', 'downfact')
+
+def parse_singlepulse_flags(singlepulse_search_flags):
+    """
+    从 SINGLEPULSE_SEARCH_FLAGS 中取出搜寻参数（含义与 single_pulse_search.py 相同，其余选项忽略）：
+    -t 阈值（默认 5.0），-m 最大脉宽（秒，默认 0 即最多 30 个采样点），-d 去趋势块长度（×1000 个采样点，默认 1），
+    -f 用中值代替线性去趋势，-b 不剔除坏块
+    """
+    list_tokens = split_cmd(singlepulse_search_flags.strip().strip('"'))
+    threshold = float(get_option_value(list_tokens, '-t', 5.0))
+    maxwidth = float(get_option_value(list_tokens, '-m', 0.0))
+    detrendlen = int(get_option_value(list_tokens, '-d', 1)) * 1000
+    flag_fast = ('-f' in list_tokens)
+    flag_badblocks = ('-b' not in list_tokens)
+    return threshold, maxwidth, detrendlen, flag_fast, flag_badblocks
+
+def get_singlepulse_downfacts(dt, maxwidth=0.0):
+    if maxwidth > 0:
+        return [1] + [downfact for downfact in singlepulse_default_downfacts if downfact * dt <= maxwidth]
+    return [1] + [downfact for downfact in singlepulse_default_downfacts if downfact <= 30]
+
+def detrend_singlepulse_blocks(blocks, flag_fast=False):
+    """blocks 为 (..., 块数, 块长度)，逐块减去中值（flag_fast）或最小二乘直线"""
+    if flag_fast:
+        return blocks - np.median(blocks, axis=-1, keepdims=True)
+    x = np.arange(blocks.shape[-1], dtype=np.float32) - 0.5 * (blocks.shape[-1] - 1)
+    slopes = (blocks @ x) / np.dot(x, x)
+    return blocks - blocks.mean(axis=-1, keepdims=True) - slopes[..., None] * x
+
+def get_singlepulse_block_stds(stds, flag_badblocks=True):
+    """
+    与 single_pulse_search.py 相同的坏块判定：排序后的块标准差在两端跳变最大处截断，
+    偏离截断后中值超过 4 倍离散度的块为坏块，其标准差记为中值。返回 (各块标准差, 坏块布尔数组)
+    """
+    numblocks = len(stds)
+    stds = stds.copy()
+    bad_blocks = np.zeros(numblocks, dtype=bool)
+    if not flag_badblocks or numblocks < 4:
+        return stds, bad_blocks
+    sort_stds = np.sort(stds)
+    locut = (sort_stds[1:numblocks//2+1] - sort_stds[:numblocks//2]).argmax() + 1
+    hicut = (sort_stds[numblocks//2+1:] - sort_stds[numblocks//2:-1]).argmax() + numblocks//2 - 2
+    if hicut <= locut:
+        locut, hicut = 0, numblocks
+    std_stds = np.std(sort_stds[locut:hicut])
+    median_stds = sort_stds[(locut + hicut) // 2]
+    bad_blocks = (stds < median_stds - 4.0 * std_stds) | (stds > median_stds + 4.0 * std_stds)
+    stds[bad_blocks] = median_stds
+    return stds, bad_blocks
+
+def singlepulse_search_batch(list_datfiles, threshold=5.0, maxwidth=0.0, detrendlen=1000, flag_fast=False, flag_badblocks=True):
+    """
+    对一批 DM 试验做单脉冲搜寻。要求同一批的 .dat 采样时间相同；采样点数不同时按最短的截断到整数个去趋势块。
+    第一遍逐块去趋势、计算标准差并判定坏块；第二遍逐块归一化（坏块置零）后，用累加和对每个宽度计算居中的 boxcar 信噪比，
+    取各宽度中最大的；全部分块完成后，超过阈值的采样点按相邻间隔不超过脉宽分组，每组只保留信噪比最大的一个事件。
+    Returns:
+        dict: 列式事件 {'DM', 'sigma', 'time', 'sample', 'downfact'}
+    """
+    list_infos = [infodata.infodata(dat[:-len('.dat')] + '.inf') for dat in list_datfiles]
+    dt = list_infos[0].dt
+    list_data = [np.memmap(dat, dtype=np.float32, mode='r') for dat in list_datfiles]
+    DMs = np.array([info.DM for info in list_infos], dtype=np.float32)
+    K = len(list_data)
+    numblocks = min(len(data) for data in list_data) // detrendlen
+    downfacts = get_singlepulse_downfacts(dt, maxwidth)
+    dict_events = {column: [] for column in list_event_columns}
+    if numblocks == 0:
+        return {column: np.array(values) for column, values in dict_events.items()}
+
+    def read_blocks(b0, b1):
+        return detrend_singlepulse_blocks(np.stack([np.asarray(data[b0 * detrendlen:b1 * detrendlen]) for data in list_data]).reshape(K, b1 - b0, detrendlen), flag_fast)
+
+    stds = np.empty((K, numblocks), dtype=np.float32)
+    for b0 in range(0, numblocks, singlepulse_chunk_blocks):
+        b1 = min(b0 + singlepulse_chunk_blocks, numblocks)
+        stds[:, b0:b1] = np.sqrt((read_blocks(b0, b1) ** 2).mean(axis=-1))
+    bad_blocks = np.zeros((K, numblocks), dtype=bool)
+    for k in range(K):
+        stds[k], bad_blocks[k] = get_singlepulse_block_stds(stds[k], flag_badblocks)
+    stds[stds == 0] = 1.0
+
+    pad_blocks = int(np.ceil(max(downfacts) / detrendlen))
+    list_candidates = [[] for k in range(K)]    # 每个 DM 试验各分块中超过阈值的 (采样点, 信噪比, 脉宽)
+    for b0 in range(0, numblocks, singlepulse_chunk_blocks):
+        b1 = min(b0 + singlepulse_chunk_blocks, numblocks)
+        e0 = max(b0 - pad_blocks, 0)
+        e1 = min(b1 + pad_blocks, numblocks)
+        blocks = read_blocks(e0, e1) / stds[:, e0:e1, None]
+        blocks[bad_blocks[:, e0:e1]] = 0.0
+        # 两端再补 max(downfacts) 个零，使所有宽度的窗口都不越界
+        pad = max(downfacts)
+        series = np.zeros((K, (e1 - e0) * detrendlen + 2 * pad), dtype=np.float64)
+        series[:, pad:pad + (e1 - e0) * detrendlen] = blocks.reshape(K, -1)
+        del blocks
+        cumsum = np.concatenate([np.zeros((K, 1)), np.cumsum(series, axis=1)], axis=1)
+        core = pad + (b0 - e0) * detrendlen + np.arange((b1 - b0) * detrendlen)
+        best_sigma = np.full((K, len(core)), -np.inf, dtype=np.float32)
+        best_downfact = np.ones((K, len(core)), dtype=np.int16)
+        for downfact in downfacts:
+            start = core - downfact // 2
+            sigma = (cumsum[:, start + downfact] - cumsum[:, start]) / np.sqrt(downfact)
+            better = sigma > best_sigma
+            best_sigma[better] = sigma[better]
+            best_downfact[better] = downfact
+        del series, cumsum
+
+        for k in range(K):
+            list_pos = np.flatnonzero(best_sigma[k] > threshold)
+            if len(list_pos) == 0:
+                continue
+            list_candidates[k].append((b0 * detrendlen + list_pos, best_sigma[k][list_pos], best_downfact[k][list_pos]))
+    del list_data
+
+    # 分组在全部分块的候选上进行，跨越分块边界的脉冲只保留一个事件（与 single_pulse_search.py 对整个序列分组相同）
+    for k in range(K):
+        if not list_candidates[k]:
+            continue
+        samples_pos, sigma_pos, downfact_pos = (np.concatenate(values) for values in zip(*list_candidates[k]))
+        # 相邻超阈值采样点间隔大于前一个的脉宽时分为新的一组
+        list_starts = np.concatenate([[0], np.flatnonzero(np.diff(samples_pos) > downfact_pos[:-1]) + 1])
+        group_ids = np.repeat(np.arange(len(list_starts)), np.diff(np.append(list_starts, len(samples_pos))))
+        order = np.lexsort((-sigma_pos, group_ids))
+        list_best = order[np.searchsorted(group_ids[order], np.arange(len(list_starts)))]
+        samples = samples_pos[list_best]
+        dict_events['DM'].append(np.full(len(samples), DMs[k], dtype=np.float32))
+        dict_events['sigma'].append(sigma_pos[list_best])
+        dict_events['time'].append(samples * dt)
+        dict_events['sample'].append(samples.astype(np.int64))
+        dict_events['downfact'].append(downfact_pos[list_best])
+
+    dict_dtypes = {'DM': np.float32, 'sigma': np.float32, 'time': np.float64, 'sample': np.int64, 'downfact': np.int16}
+    return {column: np.concatenate(values).astype(dict_dtypes[column]) if values else np.array([], dtype=dict_dtypes[column]) for column, values in dict_events.items()}
+
+def write_event_store(store_file, dict_events):
+    """列式事件库：每列一个数组保存在同一个 .npz 中；先写临时文件再改名"""
+    tmp_file = store_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        np.savez(f, **dict_events)
+    os.replace(tmp_file, store_file)
+
+def read_event_store(store_file, list_columns=list_event_columns):
+    with np.load(store_file) as store:
+        return {column: store[column] for column in list_columns if column in store.files}
+
+def merge_event_stores(list_store_files, store_file):
+    """合并多个事件库（按 DM、采样点排序，重复的事件只保留一个）写出 store_file，返回合并后的事件"""
+    list_parts = [read_event_store(part_file) for part_file in list_store_files]
+    list_parts = [part for part in list_parts if len(part['DM']) > 0]
+    if not list_parts:
+        dict_events = {column: np.array([]) for column in list_event_columns}
+    else:
+        dict_events = {column: np.concatenate([part[column] for part in list_parts]) for column in list_event_columns}
+        _, index_unique = np.unique(np.stack([dict_events['DM'].astype(np.float64), dict_events['sample'].astype(np.float64), dict_events['downfact'].astype(np.float64)], axis=1), axis=0, return_index=True)
+        dict_events = {column: values[index_unique] for column, values in dict_events.items()}
+    write_event_store(store_file, dict_events)
+    return dict_events
+
+sp_cluster_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sp_cluster.py')
+
+###单脉冲事件聚类：.singlepulse 文件并行读入同一个列式事件库，在 DM-时间网格上做朋友的朋友（FOF）聚类，
+#输出按峰值信噪比排序的爆发列表和每个爆发的 DM-信噪比曲线
+singlepulse_dm_link_factor = 1.5    # DM 方向的链接长度为该 DM 处 DM 步长的倍数（DDplan 的步长随 DM 增大）
+singlepulse_time_link = 0.05        # 链接长度：时间（秒）
+singlepulse_max_pairs = 4000000     # 聚类时每批计算距离的事件对数上限
+
+def read_singlepulse_file(singlepulse_file):
+    """读取 single_pulse_search.py 的 .singlepulse（# DM Sigma Time(s) Sample Downfact），返回列式事件"""
+    with open(singlepulse_file, 'r') as f:
+        list_lines = [line for line in f if line.strip() and not line.startswith('#')]
+    table = np.loadtxt(list_lines, ndmin=2) if list_lines else np.zeros((0, 5))
+    return {'DM': table[:, 0].astype(np.float32), 'sigma': table[:, 1].astype(np.float32), 'time': table[:, 2],
+            'sample': table[:, 3].astype(np.int64), 'downfact': table[:, 4].astype(np.int16)}
+
+def ingest_singlepulse_files(list_singlepulse_files, store_file, n_processes=4):
+    """多进程读取所有 .singlepulse，合并为一个事件库 store_file（按 DM、时间排序），返回事件"""
+    wait_buffer_copy_before_fork()
+    with Pool(max(1, n_processes)) as process_pool:
+        list_parts = list(tqdm(process_pool.imap(read_singlepulse_file, list_singlepulse_files, chunksize=16), total=len(list_singlepulse_files), desc='ingest', unit='file', dynamic_ncols=True))
+    if not list_parts:
+        dict_events = {column: np.zeros(0) for column in list_event_columns}
+    else:
+        dict_events = {column: np.concatenate([part[column] for part in list_parts]) for column in list_event_columns}
+    order = np.lexsort((dict_events['time'], dict_events['DM']))
+    dict_events = {column: values[order] for column, values in dict_events.items()}
+    write_event_store(store_file, dict_events)
+    return dict_events
+
+def get_singlepulse_dm_coordinate(DMs, dm_link=None, DM_grid=None, dm_link_factor=singlepulse_dm_link_factor):
+    """
+    把 DM 换算为以链接长度为单位的坐标 u，相邻两个事件的 |Δu| <= 1 即为 DM 方向上的朋友。
+    dm_link 不为 None 时使用固定的链接长度；否则相邻两个 DM 试验之间的链接长度为 dm_link_factor 倍的局部 DM 步长，
+    步长取 DM 试验网格 DM_grid（默认为事件本身出现过的 DM）中该间隔与前后两个间隔的中值，
+    这样 DDplan 步长变化处按新的步长链接，而网格中个别缺失的试验不会把链接长度放大。
+    """
+    DMs = np.asarray(DMs, dtype=np.float64)
+    if dm_link is not None:
+        return DMs / dm_link
+    grid = np.unique(np.round(np.asarray(DMs if DM_grid is None else DM_grid, dtype=np.float64), 6))
+    if len(grid) < 2:
+        return DMs / dm_link_factor
+    gaps = np.diff(grid)
+    padded = np.concatenate([[gaps[0]], gaps, [gaps[-1]]])
+    list_links = dm_link_factor * np.median(np.stack([padded[:-2], padded[1:-1], padded[2:]]), axis=0)
+    u_grid = np.concatenate([[0.0], np.cumsum(gaps / list_links)])
+    # 网格以外的 DM 按两端的链接长度外推
+    u = np.interp(DMs, grid, u_grid)
+    u += np.minimum(DMs - grid[0], 0.0) / list_links[0] + np.maximum(DMs - grid[-1], 0.0) / list_links[-1]
+    return u
+
+def cluster_singlepulse_events(DMs, times, dm_link=None, time_link=singlepulse_time_link, DM_grid=None, dm_link_factor=singlepulse_dm_link_factor):
+    """
+    朋友的朋友聚类：DM 换算为链接长度单位（get_singlepulse_dm_coordinate），时间除以 time_link，
+    两个事件在该坐标下的距离不超过 1 即互为朋友，朋友关系传递连通的事件属于同一个爆发。
+    先按单位网格分格，只在同一格和相邻（含对角）格子的事件之间计算距离，事件数很多时也不需要全部两两比较；
+    连通分量用最小标签传播 + 指针跳跃求得。
+    Returns:
+        np.ndarray: 每个事件的爆发编号（0 开始）
+    """
+    n_events = len(DMs)
+    if n_events == 0:
+        return np.zeros(0, dtype=np.int64)
+    u = get_singlepulse_dm_coordinate(DMs, dm_link, DM_grid, dm_link_factor)
+    v = np.asarray(times, dtype=np.float64) / time_link
+    cell_DM = np.floor(u).astype(np.int64)
+    cell_time = np.floor(v).astype(np.int64)
+    cell_DM -= cell_DM.min() - 1
+    cell_time -= cell_time.min() - 1
+    n_time = cell_time.max() + 2
+    event_keys = cell_DM * n_time + cell_time
+    order = np.argsort(event_keys, kind='stable')
+    sorted_keys = event_keys[order]
+
+    # 每个事件与同一格及四个方向（覆盖八邻域）相邻格子中的事件组成候选对，逐批计算距离
+    list_a, list_b = [], []
+    for d_DM, d_time in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+        neighbour_keys = sorted_keys + d_DM * n_time + d_time
+        starts = np.searchsorted(sorted_keys, neighbour_keys, side='left')
+        ends = np.searchsorted(sorted_keys, neighbour_keys, side='right')
+        if d_DM == 0 and d_time == 0:
+            # 同一格内每对只算一次
+            starts = np.arange(1, n_events + 1)
+        counts = np.maximum(ends - starts, 0)
+        cumulative = np.cumsum(counts)
+        i0 = 0
+        while i0 < n_events:
+            base = cumulative[i0 - 1] if i0 > 0 else 0
+            i1 = max(i0 + 1, int(np.searchsorted(cumulative, base + singlepulse_max_pairs, side='right')))
+            i1 = min(i1, n_events)
+            index_a = np.repeat(np.arange(i0, i1), counts[i0:i1])
+            if len(index_a) > 0:
+                offsets = np.arange(len(index_a)) - np.repeat(cumulative[i0:i1] - counts[i0:i1] - base, counts[i0:i1])
+                index_b = starts[index_a] + offsets
+                a, b = order[index_a], order[index_b]
+                friends = (u[a] - u[b]) ** 2 + (v[a] - v[b]) ** 2 <= 1.0
+                list_a.append(a[friends])
+                list_b.append(b[friends])
+            i0 = i1
+    edge_a = np.concatenate(list_a) if list_a else np.zeros(0, dtype=np.int64)
+    edge_b = np.concatenate(list_b) if list_b else np.zeros(0, dtype=np.int64)
+
+    labels = np.arange(n_events)
+    while True:
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, edge_a, labels[edge_b])
+        np.minimum.at(new_labels, edge_b, labels[edge_a])
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    _, clusters = np.unique(labels, return_inverse=True)
+    return clusters
+
+def summarize_singlepulse_clusters(dict_events, labels, min_events=1):
+    """
+    每个爆发的统计量，按峰值信噪比从高到低排序。
+    Returns:
+        list: [{'cluster', 'sigma', 'DM', 'time', 'downfact', 'n_events', 'n_DMs', 'DM_min', 'DM_max', 'time_min', 'time_max', 'dm_snr'}, ...]，
+              dm_snr 为 (DM 数组, 各 DM 试验中该爆发的最大信噪比)
+    """
+    if len(labels) == 0:
+        return []
+    order = np.lexsort((dict_events['DM'], labels))
+    sorted_labels = labels[order]
+    list_starts = np.flatnonzero(np.diff(np.concatenate([[-1], sorted_labels])))
+    list_ends = np.append(list_starts[1:], len(order))
+    list_bursts = []
+    for start, end in zip(list_starts, list_ends):
+        if end - start < min_events:
+            continue
+        index = order[start:end]
+        DMs = dict_events['DM'][index]
+        sigmas = dict_events['sigma'][index]
+        peak = index[np.argmax(sigmas)]
+        list_DM_starts = np.flatnonzero(np.diff(np.concatenate([[-np.inf], DMs])))
+        list_bursts.append({'cluster': int(sorted_labels[start]), 'sigma': float(dict_events['sigma'][peak]), 'DM': float(dict_events['DM'][peak]),
+                            'time': float(dict_events['time'][peak]), 'downfact': int(dict_events['downfact'][peak]),
+                            'n_events': int(end - start), 'n_DMs': len(list_DM_starts),
+                            'DM_min': float(DMs.min()), 'DM_max': float(DMs.max()),
+                            'time_min': float(dict_events['time'][index].min()), 'time_max': float(dict_events['time'][index].max()),
+                            'dm_snr': (DMs[list_DM_starts], np.maximum.reduceat(sigmas, list_DM_starts))})
+    list_bursts.sort(key=lambda burst: burst['sigma'], reverse=True)
+    return list_bursts
+
+def write_burst_list(list_bursts, out_file):
+    with open(out_file, 'w') as f:
+        f.write("#%-5s %8s %8s %10s %14s %8s %8s %6s %10s %10s %14s %14s\n" % ("rank", "cluster", "sigma", "DM", "time(s)", "downfact", "n_events", "n_DMs", "DM_min", "DM_max", "time_min(s)", "time_max(s)"))
+        for rank, burst in enumerate(list_bursts, 1):
+            f.write("%-6d %8d %8.2f %10.3f %14.6f %8d %8d %6d %10.3f %10.3f %14.6f %14.6f\n" % (rank, burst['cluster'], burst['sigma'], burst['DM'], burst['time'], burst['downfact'],
+                    burst['n_events'], burst['n_DMs'], burst['DM_min'], burst['DM_max'], burst['time_min'], burst['time_max']))
+
+def write_burst_dm_snr(list_bursts, out_file):
+    """每个爆发一段：# rank 信息行，之后每行 DM 信噪比"""
+    with open(out_file, 'w') as f:
+        for rank, burst in enumerate(list_bursts, 1):
+            f.write("# rank %d  cluster %d  sigma %.2f  DM %.3f  time %.6f s\n" % (rank, burst['cluster'], burst['sigma'], burst['DM'], burst['time']))
+            for DM, sigma in zip(*burst['dm_snr']):
+                f.write("%10.3f %8.2f\n" % (DM, sigma))
+
 
         
 
@@ -2137,10 +5349,9 @@ def make_rfifind_mask(infile, out_dir, log_dir, LOG_basename, time=0.1, time_int
         if time_intervals_to_zap != "":
                 flag_zapints = "-zapints %s" %  (time_intervals_to_zap)  #待检查
         if chans_to_zap != "":
-                flag_zapchan = "-zapchan %s" %  (chans_to_ig)
-        else:
-            if chans_to_ig != "":
-                flag_zapchan = "-ignorechan %s" %  (chans_to_ig)
+                flag_zapchan = "-zapchan %s" %  (chans_to_zap)
+        if chans_to_ig != "":
+                flag_zapchan += " -ignorechan %s" %  (chans_to_ig)
 
 
         cmd_rfifind = "rfifind %s -o %s -time %s %s %s %s" % (other_flags, infile_basename, time, flag_zapints, flag_zapchan, infile)
@@ -2168,29 +5379,315 @@ def make_rfifind_mask(infile, out_dir, log_dir, LOG_basename, time=0.1, time_int
 
 
 
-def check_prepsubband_result_single_scheme(work_dir, DD_scheme, verbosity_level=1):
+###分段 rfifind：每个文件（或每组文件）单独运行 rfifind，再合并为一个与 PRESTO 格式兼容的掩模
+#.mask 格式（本机字节序）：
+#   double timesigma, freqsigma, mjd, dtint, lofreq, dfreq
+#   int numchan, numint, ptsperint
+#   int num_zap_chans, zap_chans[num_zap_chans]
+#   int num_zap_ints, zap_ints[num_zap_ints]
+#   int num_chans_per_int[numint]
+#   每个时间段：0 < num_chans_per_int < numchan 时写入 int chans[num_chans_per_int]（等于 numchan 表示整段被消除）
+#.stats 格式：int numchan, numint, ptsperint, lobin, numbetween；float pow[numint][numchan], avg[...], std[...]
+#.bytemask 格式：unsigned char [numint][numchan]
+
+def parse_int_ranges(ranges_str):
+    """解析 PRESTO 风格的整数列表，如 "0:5,10,12:13" """
+    list_values = []
+    for part in str(ranges_str).replace('"', '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if ':' in part:
+            lo, hi = part.split(':', 1)
+            list_values.extend(range(int(lo), int(hi) + 1))
+        else:
+            list_values.append(int(part))
+    return sorted(set(list_values))
+
+def read_rfifind_mask(mask_file):
+    """读取 rfifind 的 .mask 文件，返回字典（chans_per_int 为每个时间段被消除通道的列表）"""
+    with open(mask_file, 'rb') as f:
+        data = f.read()
+    pos = 0
+    def unpack(fmt):
+        nonlocal pos
+        values = struct.unpack_from(fmt, data, pos)
+        pos += struct.calcsize(fmt)
+        return values
+    mask = {}
+    mask['timesigma'], mask['freqsigma'], mask['mjd'], mask['dtint'], mask['lofreq'], mask['dfreq'] = unpack('=6d')
+    mask['numchan'], mask['numint'], mask['ptsperint'] = unpack('=3i')
+    num_zap_chans, = unpack('=i')
+    mask['zap_chans'] = list(unpack('=%di' % num_zap_chans))
+    num_zap_ints, = unpack('=i')
+    mask['zap_ints'] = list(unpack('=%di' % num_zap_ints))
+    list_num_chans = unpack('=%di' % mask['numint'])
+    mask['chans_per_int'] = []
+    for num_chans in list_num_chans:
+        if 0 < num_chans < mask['numchan']:
+            mask['chans_per_int'].append(list(unpack('=%di' % num_chans)))
+        elif num_chans >= mask['numchan']:
+            mask['chans_per_int'].append(list(range(mask['numchan'])))
+        else:
+            mask['chans_per_int'].append([])
+    return mask
+
+def write_rfifind_mask(mask_file, mask):
+    with open(mask_file, 'wb') as f:
+        f.write(struct.pack('=6d', mask['timesigma'], mask['freqsigma'], mask['mjd'], mask['dtint'], mask['lofreq'], mask['dfreq']))
+        f.write(struct.pack('=3i', mask['numchan'], len(mask['chans_per_int']), mask['ptsperint']))
+        f.write(struct.pack('=i%di' % len(mask['zap_chans']), len(mask['zap_chans']), *mask['zap_chans']))
+        f.write(struct.pack('=i%di' % len(mask['zap_ints']), len(mask['zap_ints']), *mask['zap_ints']))
+        f.write(struct.pack('=%di' % len(mask['chans_per_int']), *[len(chans) for chans in mask['chans_per_int']]))
+        for chans in mask['chans_per_int']:
+            if 0 < len(chans) < mask['numchan']:
+                f.write(struct.pack('=%di' % len(chans), *chans))
+
+def read_rfifind_stats(stats_file):
+    """读取 .stats 文件，返回 (头 [numchan, numint, ptsperint, lobin, numbetween], pow, avg, std)"""
+    with open(stats_file, 'rb') as f:
+        list_header = list(np.fromfile(f, dtype=np.int32, count=5))
+        numchan, numint = list_header[0], list_header[1]
+        list_arrays = [np.fromfile(f, dtype=np.float32, count=numchan * numint).reshape(numint, numchan) for k in range(3)]
+    return list_header, list_arrays[0], list_arrays[1], list_arrays[2]
+
+def merge_rfifind_inf(inf_file, out_inf_file, out_basename, N_samples):
+    """以第一段的 .inf 为模板，改写文件名和采样点数"""
+    with open(inf_file, 'r') as f:
+        list_lines = f.readlines()
+    with open(out_inf_file, 'w') as f:
+        for line in list_lines:
+            if line.lstrip().startswith('Data file name without suffix') and '=' in line:
+                line = line.split('=', 1)[0] + '=  ' + out_basename + '\n'
+            elif line.lstrip().startswith('Number of bins in the time series') and '=' in line:
+                line = line.split('=', 1)[0] + '=  ' + str(int(N_samples)) + '\n'
+            f.write(line)
+
+def merge_rfifind_parts(list_part_basenames, list_offsets, list_N_samples, out_dir, out_basename, time_intervals_to_zap=""):
+    """
+    把各段 rfifind 的结果合并为 out_dir/out_basename_rfifind.{mask,stats,bytemask,inf}。
+    各段按全局采样点偏移放到整体观测的时间段网格上：同一时间段内被消除的通道取并集，
+    .stats 取重叠最多的那一段，.bytemask 按位取或；全局消除的通道取并集。
+    RFIFIND_TIME_INTERVALS_TO_ZAP 中的时间段按合并后的编号在这里统一消除。
+
+    Args:
+        list_part_basenames (list): 各段的 "目录/前缀"（不含 _rfifind.mask）
+        list_offsets (list): 各段起点在整体观测中的采样点偏移
+        list_N_samples (list): 各段的采样点数
+    Returns:
+        str: 合并后的 .mask 文件路径
+    """
+    if len(set(list_offsets)) < len(list_offsets):
+        raise ValueError(f"各段的采样点偏移 {list_offsets} 有重复，无法合并（偏移应由文件头的 NSUBOFFS 给出）")
+    list_masks = [read_rfifind_mask(f"{x}_rfifind.mask") for x in list_part_basenames]
+    first = list_masks[0]
+    numchan, ptsperint = first['numchan'], first['ptsperint']
+    for basename, mask in zip(list_part_basenames, list_masks):
+        if mask['numchan'] != numchan or mask['ptsperint'] != ptsperint:
+            raise ValueError(f"{basename}: numchan/ptsperint ({mask['numchan']}/{mask['ptsperint']}) 与第一段 ({numchan}/{ptsperint}) 不一致，无法合并")
+
+    N_total = max(offset + N for offset, N in zip(list_offsets, list_N_samples))
+    numint = (N_total + ptsperint - 1) // ptsperint
+    list_chans = [set() for k in range(numint)]
+    set_zap_chans = set()
+    set_zap_ints = set(k for k in parse_int_ranges(time_intervals_to_zap) if k < numint)
+
+    stats_header = None
+    array_pow = array_avg = array_std = None
+    array_bytemask = None
+    array_best_overlap = np.zeros(numint, dtype=np.int64)
+    for basename, mask, offset, N in zip(list_part_basenames, list_masks, list_offsets, list_N_samples):
+        set_zap_chans.update(mask['zap_chans'])
+        set_part_zap_ints = set(mask['zap_ints'])
+        part_stats = None
+        if os.path.isfile(f"{basename}_rfifind.stats"):
+            part_stats = read_rfifind_stats(f"{basename}_rfifind.stats")
+            if stats_header is None:
+                stats_header = part_stats[0]
+                array_pow, array_avg, array_std = [np.zeros((numint, numchan), dtype=np.float32) for k in range(3)]
+        part_bytemask = None
+        if os.path.isfile(f"{basename}_rfifind.bytemask"):
+            part_bytemask = np.fromfile(f"{basename}_rfifind.bytemask", dtype=np.uint8)
+            part_bytemask = part_bytemask[:mask['numint'] * numchan].reshape(-1, numchan)
+            if array_bytemask is None:
+                array_bytemask = np.zeros((numint, numchan), dtype=np.uint8)
+
+        for i, chans in enumerate(mask['chans_per_int']):
+            start = offset + i * ptsperint
+            end = min(start + ptsperint, offset + N)
+            if end <= start:
+                continue
+            for j in range(start // ptsperint, min((end - 1) // ptsperint, numint - 1) + 1):
+                list_chans[j].update(chans)
+                if i in set_part_zap_ints:
+                    set_zap_ints.add(j)
+                if part_bytemask is not None and i < len(part_bytemask):
+                    array_bytemask[j] |= part_bytemask[i]
+                overlap = min(end, (j + 1) * ptsperint) - max(start, j * ptsperint)
+                if part_stats is not None and i < len(part_stats[1]) and overlap > array_best_overlap[j]:
+                    array_best_overlap[j] = overlap
+                    array_pow[j], array_avg[j], array_std[j] = part_stats[1][i], part_stats[2][i], part_stats[3][i]
+
+    # 文件之间的间隔没有统计量，沿用前一个时间段的值
+    if stats_header is not None:
+        for j in range(1, numint):
+            if array_best_overlap[j] == 0:
+                array_pow[j], array_avg[j], array_std[j] = array_pow[j-1], array_avg[j-1], array_std[j-1]
+
+    merged = dict(first)
+    merged['numint'] = numint
+    merged['zap_chans'] = sorted(set_zap_chans)
+    merged['zap_ints'] = sorted(set_zap_ints)
+    merged['chans_per_int'] = []
+    for j in range(numint):
+        if j in set_zap_ints:
+            merged['chans_per_int'].append(list(range(numchan)))
+        else:
+            merged['chans_per_int'].append(sorted(list_chans[j] | set_zap_chans))
+
+    out_prefix = os.path.join(out_dir, f"{out_basename}_rfifind")
+    write_rfifind_mask(f"{out_prefix}.mask.tmp", merged)
+    if stats_header is not None:
+        stats_header = [numchan, numint, ptsperint] + list(stats_header[3:5])
+        with open(f"{out_prefix}.stats", 'wb') as f:
+            np.array(stats_header, dtype=np.int32).tofile(f)
+            array_pow.tofile(f)
+            array_avg.tofile(f)
+            array_std.tofile(f)
+    if array_bytemask is not None:
+        array_bytemask.tofile(f"{out_prefix}.bytemask")
+    if os.path.isfile(f"{list_part_basenames[0]}_rfifind.inf"):
+        merge_rfifind_inf(f"{list_part_basenames[0]}_rfifind.inf", f"{out_prefix}.inf", f"{out_basename}_rfifind", N_total)
+    # 最后写入 .mask，作为合并完成的标志
+    os.replace(f"{out_prefix}.mask.tmp", f"{out_prefix}.mask")
+    print_log(f"已合并 {len(list_part_basenames)} 段 rfifind 结果：{numint} 个时间段，{len(merged['zap_chans'])} 个通道被整体消除，{len(merged['zap_ints'])} 个时间段被整体消除", color=colors.OKGREEN)
+    return f"{out_prefix}.mask"
+
+def rfifind_parts2cmd(list_groups, out_dir, log_dir, time=0.1, chans_to_zap="", chans_to_ig="", other_flags=""):
+    """
+    生成分段 rfifind 的命令。list_groups 为每段的文件路径列表。
+    -zapints 按整体观测的时间段编号给出，不传给各段，在 merge_rfifind_parts 中统一处理。
+    Returns:
+        tuple: (命令列表, ifok 列表, 日志列表, 各段 "目录/前缀" 列表)
+    """
+    flag_zapchan = ""
+    if chans_to_zap != "":
+        flag_zapchan = "-zapchan %s" % (chans_to_zap)
+    if chans_to_ig != "":
+        flag_zapchan += " -ignorechan %s" % (chans_to_ig)
+
+    cmd_list, ifok_list, log_list, list_part_basenames = [], [], [], []
+    for k, list_files in enumerate(list_groups):
+        part_basename = f"rfi{time}s_part{k:04d}"
+        cmd_list.append("rfifind %s -o %s -time %s %s %s" % (other_flags, part_basename, time, flag_zapchan, " ".join(list_files)))
+        ifok_list.append(os.path.join(out_dir, f"{part_basename}_rfifind.mask"))
+        log_list.append(os.path.join(log_dir, f"LOG_01_rfifind_part{k:04d}.txt"))
+        list_part_basenames.append(os.path.join(out_dir, part_basename))
+    return cmd_list, ifok_list, log_list, list_part_basenames
+
+def list_dedispersion_dir(work_dir):
+    """只列出一次去色散目录，返回 {文件名: 大小（字节）}，只含 .dat/.inf，不含 _red 文件"""
+    dict_sizes = {}
+    if not os.path.isdir(work_dir):
+        return dict_sizes
+    with os.scandir(work_dir) as it:
+        for entry in it:
+            if entry.name.endswith(('.dat', '.inf')) and "_red" not in entry.name and entry.is_file():
+                dict_sizes[entry.name] = entry.stat().st_size
+    return dict_sizes
+
+def check_prepsubband_result_single_scheme(work_dir, DD_scheme, verbosity_level=1, dict_sizes=None):
+    """方案中每个 DM 都恰好有一个 *DM<DM>.dat 和一个 *DM<DM>.inf（不含 _red 文件）；dict_sizes 为 list_dedispersion_dir 的结果，多个方案共用时只列一次目录"""
+    if dict_sizes is None:
+        dict_sizes = list_dedispersion_dir(work_dir)
+    dict_counts = {}
+    for name in dict_sizes:
+        match = re.search(r'DM(-?\d+\.\d\d)\.(dat|inf)$', name)
+        if match:
+            dict_counts[match.group(1)] = dict_counts.get(match.group(1), 0) + 1
     # 遍历当前去色散方案中的所有 DM 值
     for dm in np.arange(DD_scheme['loDM'], DD_scheme['highDM'] - 0.5*DD_scheme['dDM'], DD_scheme['dDM']):
-        # if verbosity_level >= 2:
-        #     # 打印正在检查的文件路径
-        #     print("check_prepsubband_result_single_scheme:: 正在查找：", [os.path.join(work_dir, "*DM%.2f.dat" % (dm))], [os.path.join(work_dir, "*DM%.2f.inf" % (dm))])
-        #     # 打印实际找到的文件
-        #     print("check_prepsubband_result_single_scheme:: 找到以下文件： %s, %s" % (
-        #         [x for x in glob.glob(os.path.join(work_dir, "*DM%.2f.dat" % (dm))) if not "_red" in x],
-        #         [x for x in glob.glob(os.path.join(work_dir, "*DM%.2f.inf" % (dm))) if not "_red" in x]
-        #     ))
-
-        # 检查是否存在对应的 .dat 和 .inf 文件（排除 "_red" 文件）
-        if len(
-            [x for x in glob.glob(os.path.join(work_dir, "*DM%.2f.dat" % (dm))) if not "_red" in x] +
-            [x for x in glob.glob(os.path.join(work_dir, "*DM%.2f.inf" % (dm))) if not "_red" in x]
-        ) != 2:
-        #     if verbosity_level >= 2:
-        #         print("check_prepsubband_result_single_scheme: 返回 False")
+        if dict_counts.get("%.2f" % (dm), 0) != 2:
+            if verbosity_level >= 2:
+                print("check_prepsubband_result_single_scheme: DM %.2f 的 .dat/.inf 不完整" % (dm))
             return False
-        
     return True
 
+def get_expected_nsamples(N_samples, downsamp, other_flags=""):
+    """prepsubband 输出的采样点数：指定了 -numout 时为该值，否则为原始采样点数 // downsamp"""
+    numout = get_option_value(split_cmd(other_flags.strip('"')), '-numout')
+    if numout is not None:
+        return int(numout)
+    return int(N_samples) // max(1, int(downsamp))
+
+def get_dedispersion_repair_schemes(work_dir, sourcename, list_DD_schemes, N_samples, other_flags="", dict_sizes=None, set_reclaimed=None):
+    """
+    修复模式：只列一次去色散目录，按期望的采样点数找出缺失或不完整的 DM 试验
+    （.dat 或 .inf 不存在、.inf 为空、.dat 小于 4 × 期望采样点数字节），每个方案内连续缺失的 DM 合并为一段。
+    set_reclaimed 为中间文件生命周期已删除或归档的文件名（read_lifecycle_manifest），这些 .dat 的使用者都已完成，不算缺失。
+    Returns:
+        tuple: (需要重新运行的 DM 段（num_DMs 为实际输出的 DM 数，不再加 1）, 缺失的 DM 试验数, DM 试验总数)
+    """
+    if dict_sizes is None:
+        dict_sizes = list_dedispersion_dir(work_dir)
+    if set_reclaimed is None:
+        set_reclaimed = set()
+    list_repair_schemes = []
+    n_missing = 0
+    n_total = 0
+    for i, DD_scheme in enumerate(list_DD_schemes):
+        list_dms = get_scheme_dms(DD_scheme, i == len(list_DD_schemes) - 1)
+        expected_bytes = 4 * get_expected_nsamples(N_samples, DD_scheme['downsamp'], other_flags)
+        list_flag_missing = []
+        for dm in list_dms:
+            basename = "%s_DM%.2f" % (sourcename, dm)
+            if basename + '.dat' in set_reclaimed and basename + '.dat' not in dict_sizes:
+                list_flag_missing.append(False)
+                continue
+            list_flag_missing.append(dict_sizes.get(basename + '.dat', -1) < expected_bytes or dict_sizes.get(basename + '.inf', 0) <= 0)
+        n_missing += sum(list_flag_missing)
+        n_total += len(list_dms)
+        loDM = np.float64(DD_scheme['loDM'])
+        dDM = np.float64(DD_scheme['dDM'])
+        for flag_missing, group in itertools.groupby(enumerate(list_flag_missing), key=lambda x: x[1]):
+            list_index = [k for k, _ in group]
+            if flag_missing:
+                list_repair_schemes.append({'loDM': round(loDM + list_index[0] * dDM, 6), 'highDM': round(loDM + (list_index[-1] + 1) * dDM, 6),
+                                            'dDM': DD_scheme['dDM'], 'downsamp': DD_scheme['downsamp'], 'num_DMs': len(list_index)})
+    return list_repair_schemes, n_missing, n_total
+
+def dedisperse_repair2cmd(infile, open_mask, sourcename, out_dir, log_dir, ignorechan_list, mask_file, list_repair_schemes, nchan, nsubbands=0, other_flags=""):
+    """
+    修复模式的 prepsubband 命令：每个缺失的 DM 段一次，-numdms 为段内的 DM 数。
+    同一 DM 段可能多次修复，生成命令前删除其旧的 ifok 和任务数据库记录。
+    """
+    global cwd
+
+    if nsubbands == 0:
+            nsubbands = nchan
+    string_mask = ""
+    if mask_file != "":
+            string_mask = "-mask %s" % (mask_file)
+    string_ignorechan = ""
+    if ignorechan_list != "":
+            string_ignorechan = "-ignorechan %s" % (ignorechan_list)
+
+    cmd_prepsubband_list = []
+    ifok_list = []
+    log_list = []
+    for DD_scheme in list_repair_schemes:
+        cmd_prepsubband = "prepsubband -nobary %s -o %s %s %s -lodm %s -dmstep %s -numdms %s -downsamp %s -nsub %s %s" % (other_flags, sourcename, string_ignorechan, string_mask, DD_scheme['loDM'], DD_scheme['dDM'], DD_scheme['num_DMs'], DD_scheme['downsamp'], nsubbands, infile)
+        ifok_path = cwd+f"/00_IFOK/ok-prepsubband-{open_mask}-repair-DM{DD_scheme['loDM']:.2f}-{DD_scheme['num_DMs']}.ifok"
+        if os.path.exists(ifok_path):
+            os.remove(ifok_path)
+        if job_store_path is not None:
+            # 源名等常含有 _，不能用 LIKE 匹配，否则会使其他 prepsubband 任务失效
+            invalidate_jobs(cmd=cmd_prepsubband)
+        cmd_prepsubband_list.append(cmd_prepsubband)
+        ifok_list.append(ifok_path)
+        log_list.append("%s/LOG_03_prepsubband_%s_repair_DM%.2f.txt" % (log_dir, open_mask, DD_scheme['loDM']))
+    return cmd_prepsubband_list, ifok_list, log_list
+
 
 
 
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+多节点任务队列的 worker（配置文件中 EXECUTION_BACKEND 为 queue 时使用）
+
+在共享 ROOT_WORKDIR 的任意节点上运行，从 00_IFOK/queue.sqlite 中领取任务执行。
+
+用法：
+    queue_worker.py [-n 8] [-idle 600]             启动 8 个 worker，队列连续空闲 600 秒后退出
+    queue_worker.py status                           各批次任务数（待执行、运行中、完成、失败）
+    queue_worker.py failed                           列出失败的任务
+    queue_worker.py requeue                          把心跳超时的任务放回队列
+    可选 -db <路径> 指定队列数据库，默认使用配置文件中 ROOT_WORKDIR 下的 00_IFOK/queue.sqlite
+    可选 -timeout <秒> 心跳超时时间（默认 300）
+    可选 -cpus <核数> -mem <GB> 本节点的核数和内存预算，默认使用配置文件中的 CPU_BUDGET、MEM_BUDGET_GB；
+    worker 只领取放得下的任务，与本地进程池的准入规则相同
+"""
+import os,sys
+import time
+from psr_fuc import *
+
+def find_cfg_file():
+    for folder in [".", "..", "../..", "../../..","../../../.."]:
+        try:
+            for fname in os.listdir(folder):
+                if fname.endswith(".cfg"):
+                    return os.path.join(folder, fname)
+        except FileNotFoundError:
+            continue
+    return None
+
+def parse_config_value(cfg_path, param_name):
+    with open(cfg_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            line = line.split("#", 1)[0].strip()
+            parts = line.split(None, 1)
+            if len(parts) >= 2 and parts[0] == param_name:
+                return parts[1].strip()
+    return None
+
+def print_status(conn):
+    rows = conn.execute("""SELECT batch,
+                                  SUM(status = 'pending'),
+                                  SUM(status = 'running'),
+                                  SUM(status = 'done'),
+                                  SUM(status = 'failed'),
+                                  MIN(t_submit)
+                           FROM tasks GROUP BY batch ORDER BY MIN(t_submit)""").fetchall()
+    print("%-48s %8s %8s %8s %8s" % ("批次", "待执行", "运行中", "完成", "失败"))
+    for batch, n_pending, n_running, n_done, n_failed, _ in rows:
+        print("%-48s %8d %8d %8d %8d" % (batch, n_pending or 0, n_running or 0, n_done or 0, n_failed or 0))
+    for worker, task_id, heartbeat in conn.execute("SELECT worker, task_id, heartbeat FROM tasks WHERE status = 'running' ORDER BY worker"):
+        print(f"    {worker} 正在执行任务 {task_id}，{time.time() - heartbeat:.0f} 秒前心跳")
+
+db_path = None
+action = "run"
+n_workers = 1
+idle_exit_s = 600
+heartbeat_timeout = 300.0
+cpu_budget = None
+mem_budget_gb = None
+
+if ("-h" in sys.argv) or ("-help" in sys.argv) or ("--help" in sys.argv):
+    print(__doc__)
+    sys.exit(0)
+
+for j in range(1, len(sys.argv)):
+    if sys.argv[j] in ["run", "status", "failed", "requeue"]:
+        action = sys.argv[j]
+    elif sys.argv[j] == "-db":
+        db_path = sys.argv[j+1]
+    elif sys.argv[j] == "-n":
+        n_workers = int(sys.argv[j+1])
+    elif sys.argv[j] == "-idle":
+        idle_exit_s = float(sys.argv[j+1])
+    elif sys.argv[j] == "-timeout":
+        heartbeat_timeout = float(sys.argv[j+1])
+    elif sys.argv[j] == "-cpus":
+        cpu_budget = int(sys.argv[j+1])
+    elif sys.argv[j] == "-mem":
+        mem_budget_gb = float(sys.argv[j+1])
+
+cfg_file = find_cfg_file()
+if db_path is None:
+    root_workdir = parse_config_value(cfg_file, "ROOT_WORKDIR") if cfg_file else None
+    db_path = os.path.join(root_workdir or os.getcwd(), '00_IFOK', 'queue.sqlite')
+if cpu_budget is None:
+    cpu_budget = int(parse_config_value(cfg_file, "CPU_BUDGET") or 0) if cfg_file else 0
+if mem_budget_gb is None:
+    mem_budget_gb = float(parse_config_value(cfg_file, "MEM_BUDGET_GB") or 0) if cfg_file else 0.0
+
+if not os.path.isfile(db_path):
+    print_log(f"错误：任务队列 {db_path} 不存在！", color=colors.ERROR, mode='p')
+    sys.exit(1)
+
+set_execution_backend('queue', db_path, heartbeat_timeout)
+conn = connect_task_queue(db_path)
+
+if action == "status":
+    print_status(conn)
+elif action == "failed":
+    for task_id, batch, worker, error, cmd in conn.execute("SELECT task_id, batch, worker, error, cmd FROM tasks WHERE status = 'failed' ORDER BY task_id"):
+        print(f"[{task_id}] {batch} {worker}")
+        print(f"    error: {error}")
+        print(f"    cmd  : {cmd}")
+elif action == "requeue":
+    n_requeued = queue_requeue_lost(conn)
+    print_log(f"已把 {n_requeued} 个心跳超时的任务放回队列（数据库：{db_path}）", color=colors.OKGREEN)
+elif action == "run":
+    set_resource_budget(cpu_budget, mem_budget_gb)
+    print_log(f"{socket.gethostname()}: 启动 {n_workers} 个 worker，队列：{db_path}", color=colors.OKBLUE)
+    list_workers = [Process(target=queue_worker, args=(db_path, None, idle_exit_s)) for k in range(n_workers)]
+    for worker in list_workers:
+        worker.start()
+    for worker in list_workers:
+        worker.join()
+    print_log(f"{socket.gethostname()}: 队列空闲 {idle_exit_s:.0f} 秒，worker 退出", color=colors.OKBLUE)
+conn.close()
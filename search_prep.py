@@ -81,12 +81,14 @@ def prep_configure(observation_filename):
         
         'IF_BARY':                               "0                # 是否执行质心修正？重要参数（1=是，0=否）。1需要给出正确的RA,DEC，仅搜寻不推荐质心修正" ,    
         'IF_DDPLAN':                             "0                # 是否执行ddplan？（1=是，使用DM_MIN和DM_MAX，0=否，使用DM_STEP）",
+        'DDPLAN_ENGINE':                         "presto           # 去色散计划的实现（IF_DDPLAN=1 时）：presto=调用 DDplan.py 并解析输出；native=内置计算，结果缓存在 00_IFOK/ddplan_cache.json，方案拆分为 DM 数均衡的 prepsubband 调用",
         'FLAG_ACCELERATION_SEARCH':              "1                # 是否进行加速度搜索？（1=是，0=否）",
         'FLAG_JERK_SEARCH':                      "0                # 是否进行jerk search？（1=是，0=否）",
         'PERIOD_TO_SEARCH_MIN':                  "0.001            # 可接受的最小候选周期（秒）",
         'PERIOD_TO_SEARCH_MAX':                  "20.0             # 可接受的最大候选周期（秒）,毫秒脉冲星可改为0.040",
         'FLAG_SINGLEPULSE_SEARCH':               "0                # 是否进行单脉冲搜索？（1=是，0=否）",
         'IF_PYSOLATOR ':                         "0                # 是否进行去轨道调制？（1=是，0=否）",
+        'DEORB_TEMPLATE_BANK':                   "\"\"               # 去轨道调制的模板库文件（每行 Pb(天) x(光秒) T0(MJD) q，字段可写成 起始:结束:步长）；不为空时 IF_PYSOLATOR=1 用 numpy 一次处理全部模板，不再使用 DEORB.par",
         
         'POOL_NUM':                              "%s               # 多线程核数。（默认为一半） "%int(cpu_count()/2) ,
         'DM_MIN':                                "2.0              # 搜索的最小色散",
@@ -107,11 +109,13 @@ def prep_configure(observation_filename):
         'NUM_SIMULTANEOUS_PREPSUBBANDS':         "%-4d             # 同时运行的 prepsubband 实例的最大数量" % (multiprocessing.cpu_count() / 4),
         'MAX_SIMULTANEOUS_DMS_PER_PREPSUBBAND':  "1000             # prepsubband 一次处理的最大 DM 值数量（最大 1000）",
         'NUM_SIMULTANEOUS_SINGLEPULSE_SEARCHES': "%-4d             # 同时运行的单脉冲搜索实例数量" % (multiprocessing.cpu_count()),       
+        'FLAG_DATAFLOW':                         "1                # 是否按 DM 试验数据流调度 FFT/去红噪声/消噪/搜寻？（1=是，0=各阶段全部完成后再进入下一阶段）",
         
         'RFIFIND_TIME':                          "1              # RFIFIND 的 -time 选项值",
         'RFIFIND_FLAGS':                         "\"\"             # 为 RFIFIND 提供的其他选项",
         'RFIFIND_CHANS_TO_ZAP':                  "\"\"             # 在 RFIFIND 掩模中需要消除的通道列表，中值代替",
         'RFIFIND_TIME_INTERVALS_TO_ZAP':         "\"\"             # 在 RFIFIND 掩模中需要消除的时间间隔列表",
+        'RFIFIND_FILES_PER_JOB':                 "0                # 分段 rfifind：每个 rfifind 处理的文件数，各段并行运行后合并掩模（0=对全部文件运行一个 rfifind）",
         'IGNORECHAN_LIST':                       "\"680:810\"           # 全程使用ignorechan选项",
         'REALFFT_FLAGS':                         "\"\"             # 为 REALFFT 提供的其他选项",
         'ZAP_ISOLATED_PULSARS_FROM_FFTS':        "0                # 是否在功率谱中消除已知脉冲星？（1=是，0=否）",
@@ -142,17 +146,35 @@ def prep_configure(observation_filename):
 
         'PREPDATA_FLAGS':                        "\"\"             # 为 PREPDATA 提供的其他选项",
         'REDNOISE_FLAGS':                        "\"\"             # 为 REDNOISE 提供的其他选项",
+        'DEDISPERSE_ENGINE':                     "presto           # 去色散的实现：presto=prepsubband；presto_sub=两级 prepsubband，原始数据只按几个名义 DM 读取并写出子带文件，各 DM 段从子带文件去色散；numpy=进程内按块读取一次原始数据输出全部 DM 试验（不做 -clip，PREPSUBBAND_FLAGS 须含 -noclip，只支持 -numout/-ncpus/-nobary）；validate=numpy 并用 prepsubband 复核每个方案的首末 DM，不一致时终止",
+        'PREPSUBBAND_SUBDM_STEP':                "0                # DEDISPERSE_ENGINE=presto_sub 时名义 DM 的间距（pc cm^-3），0=按子带展宽不超过采样时间自动计算；子带文件保留在去色散目录的 subbands 中，DM 范围或步长改变时复用",
+        'FLAG_REPAIR_DEDISPERSION':              "0                # 1=去色散修复模式：只列一次去色散目录，按期望采样点数找出缺失或截断的 .dat/.inf，只对连续缺失的 DM 段重新运行 prepsubband",
+        'BARY_ENGINE':                           "presto           # 质心修正的实现：presto=每个 DM 试验运行一次 prepdata；numpy=每种采样参数只运行一次 prepdata，得到的重采样映射用于全部 DM 试验",
+        'FFT_ENGINE':                            "presto           # FFT、去红噪声和消噪的实现：presto=realfft/rednoise/zapbirds 三个程序；numpy=fused_fft.py 一次读写完成",
         'ACCELSEARCH_FLAGS':                     "-sigma 2            # 进行加速搜索时为 ACCELSEARCH 提供的其他选项",
         'ACCELSEARCH_GPU_FLAGS':                 "\"\"             # 使用 PRESTO_ON_GPU 进行加速搜索时为 ACCELSEARCH 提供的其他选项",
         'ACCELSEARCH_JERK_FLAGS':                "\"\"             # 进行jerk search时为 ACCELSEARCH 提供的其他选项",
         'PREPFOLD_FLAGS':                        "\"-topo -nosearch -ncpus %-3d -n 64 -npart 128 -nsub 64 -noxwin\"     # 为 PREPFOLD 提供的其他选项" % (multiprocessing.cpu_count() / 4),
         'SINGLEPULSE_SEARCH_FLAGS':              "\"-t 7 -b -m 300 -p \"             # 进行单脉冲搜索时为 SINGLE_PULSE_SEARCH.py 提供的其他选项",
+        'SINGLEPULSE_ENGINE':                    "presto           # 单脉冲搜寻的实现：presto=每个 DM 运行一次 single_pulse_search.py；numpy=进程内按批匹配滤波，事件写入列式事件库 07_SINGLEPULSE/*_singlepulse_events.npz，总图由事件库画出",
 
         'FAST_BUFFER_DIR':                       "\"\"             # 快速内存缓冲区路径（可选，最小化 I/O 瓶颈）",
+        'BUFFER_COPY_THREADS':                   "4                # 复制到快速缓冲目录时的并行线程数（断点续传，CRC32 校验）",
         'FLAG_KEEP_DATA_IN_BUFFER_DIR':          "0                # 搜索后是否在缓冲区保留观测数据副本？（1=是，0=否）",
+        'FLAG_JOB_STORE':                        "1                # 是否用 00_IFOK/jobs.sqlite 任务数据库记录任务状态（取代 .ifok 文件，用 jobdb.py 查询）？（1=是，0=否）",
+        'TASK_MAX_RETRIES':                      "2                # 命令失败（返回码非 0 或输出文件缺失/为空）后的最大重试次数",
+        'TASK_RETRY_BACKOFF':                    "30               # 首次重试前等待的秒数，之后每次翻倍",
+        'CPU_BUDGET':                            "0                # 同时运行的任务最多占用的核数（按各命令的 -ncpus 累加，0=全部核）",
+        'MEM_BUDGET_GB':                         "0                # 同时运行的任务最多占用的内存（GB，按观测参数估计，0=当前可用内存的 90%）",
+        'EXECUTION_BACKEND':                     "local            # 任务执行方式：local=本机进程池；queue=共享文件系统上的任务队列（其他节点运行 queue_worker.py 领取任务，各节点按 CPU_BUDGET、MEM_BUDGET_GB 领取；FLAG_DATAFLOW 和折叠仍在本机运行）",
+        'QUEUE_HEARTBEAT_TIMEOUT':               "300              # queue 模式下 worker 超过多少秒没有心跳即认为丢失，任务重新放回队列",
         'FLAG_REMOVE_FFTFILES':                  "0                # 搜索后是否删除 FFT 文件以节省磁盘空间？（1=是，0=否）",
         'FLAG_REMOVE_DATFILES_OF_SEGMENTS':      "1                 # 分析中完全忽略的通道列表（PRESTO -ignorechan 选项）",
        # 搜索后是否删除较短分段的 .dat 文件以节省磁盘空间？（1=是，0=否）",
+        'FLAG_REMOVE_DATFILES':                  "0                # 是否在最后一个使用者（质心修正、去轨道调制、FFT、时间序列折叠、单脉冲搜索）完成后删除 .dat 文件？（1=是，0=否）",
+        'LIFECYCLE_ARCHIVE_DIR':                 "\"\"               # 不为空时，回收的 .dat/.fft 文件移动到该目录而不是删除",
+        'STAGING_DIR':                           "\"\"               # 内存盘暂存目录（如 /dev/shm/psr）：每个 DM 的 FFT、去红噪声、消噪和搜寻在其中完成，只写回 ACCEL 结果（为空则不使用）",
+        'STAGING_CAPACITY_GB':                   "0                # 同时占用暂存目录的上限（GB，0=暂存目录可用空间的 80%）",
         'STEP_RFIFIND':                          "1                # 是否运行 RFIFIND 步骤？（1=是，0=否）",
         'STEP_ZAPLIST':                          "1                # 是否运行 ZAPLIST 步骤？（1=是，0=否）,质心修正需修改为0",
         'STEP_DEDISPERSE':                       "1                # 是否运行去色散步骤？（1=是，0=否）",
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+单脉冲事件聚类：把所有 DM 的单脉冲事件归并为不同的爆发，按峰值信噪比排序
+
+输入为 .singlepulse 文件（并行读入并合并为一个列式事件库 <输出名>_singlepulse_events.npz），
+或已有的事件库 .npz（SINGLEPULSE_ENGINE = numpy 的输出）。
+在 DM-时间网格上做朋友的朋友聚类，输出：
+    <输出名>_bursts.txt           按峰值信噪比排序的爆发列表
+    <输出名>_bursts_dm_snr.txt    每个爆发的 DM-信噪比曲线
+    <输出名>_bursts.png           前 -top 个爆发的 DM-信噪比曲线图
+
+用法：
+    sp_cluster.py [-o singlepulse] [-dm_link_factor 1.5 | -dm_link 1.0] [-t_link 0.05] [-sigma 6.0] [-min_events 2] [-top 16] [-n 8] <文件.singlepulse ... | 事件库.npz>
+    sp_cluster.py -glob "*_DM*.singlepulse" ...      文件很多时用通配符代替文件列表
+    -o            输出文件名前缀
+    -dm_link_factor  DM 方向的链接长度为局部 DM 步长（由事件出现过的 DM 试验推得）的倍数，默认 1.5
+    -dm_link      使用固定的 DM 链接长度（pc cm^-3），不再按局部步长计算
+    -t_link       时间方向的链接长度（秒）
+    -sigma        参与聚类的最小信噪比
+    -min_events   爆发至少包含的事件数
+    -top          画图的爆发个数
+    -n            读取 .singlepulse 的进程数
+"""
+import os,sys
+import time
+from psr_fuc import *
+
+outname = "singlepulse"
+dm_link = None
+dm_link_factor = singlepulse_dm_link_factor
+time_link = singlepulse_time_link
+sigma_min = 6.0
+min_events = 2
+n_top = 16
+n_processes = 8
+list_infiles = []
+
+if len(sys.argv) == 1 or ("-h" in sys.argv) or ("-help" in sys.argv) or ("--help" in sys.argv):
+    print(__doc__)
+    sys.exit(0)
+
+j = 1
+while j < len(sys.argv):
+    if sys.argv[j] == "-o":
+        outname = sys.argv[j+1]
+        j += 1
+    elif sys.argv[j] == "-dm_link":
+        dm_link = float(sys.argv[j+1])
+        j += 1
+    elif sys.argv[j] == "-dm_link_factor":
+        dm_link_factor = float(sys.argv[j+1])
+        j += 1
+    elif sys.argv[j] == "-t_link":
+        time_link = float(sys.argv[j+1])
+        j += 1
+    elif sys.argv[j] == "-sigma":
+        sigma_min = float(sys.argv[j+1])
+        j += 1
+    elif sys.argv[j] == "-min_events":
+        min_events = int(sys.argv[j+1])
+        j += 1
+    elif sys.argv[j] == "-top":
+        n_top = int(sys.argv[j+1])
+        j += 1
+    elif sys.argv[j] == "-n":
+        n_processes = int(sys.argv[j+1])
+        j += 1
+    elif sys.argv[j] == "-glob":
+        list_infiles += sorted(glob.glob(sys.argv[j+1]))
+        j += 1
+    elif sys.argv[j].endswith(".singlepulse") or sys.argv[j].endswith(".npz"):
+        list_infiles.append(sys.argv[j])
+    j += 1
+
+start_time = time.time()
+list_stores = [infile for infile in list_infiles if infile.endswith(".npz")]
+list_singlepulse_files = [infile for infile in list_infiles if infile.endswith(".singlepulse")]
+if list_stores:
+    dict_events = merge_event_stores(list_stores, f"{outname}_singlepulse_events.npz") if len(list_stores) > 1 else read_event_store(list_stores[0])
+elif list_singlepulse_files:
+    dict_events = ingest_singlepulse_files(list_singlepulse_files, f"{outname}_singlepulse_events.npz", n_processes)
+    print_log(f"{len(list_singlepulse_files)} 个 .singlepulse 文件 -> {outname}_singlepulse_events.npz（{len(dict_events['DM'])} 个事件）", color=colors.OKBLUE)
+else:
+    print_log("错误：没有输入文件！", color=colors.ERROR, mode='p')
+    sys.exit(1)
+
+# 局部 DM 步长按信噪比筛选之前的全部事件推得，低阈值事件几乎覆盖了每个 DM 试验
+DM_grid = np.unique(dict_events['DM'])
+keep = np.flatnonzero(dict_events['sigma'] >= sigma_min)
+dict_events = {column: values[keep] for column, values in dict_events.items()}
+labels = cluster_singlepulse_events(dict_events['DM'], dict_events['time'], dm_link, time_link, DM_grid=DM_grid, dm_link_factor=dm_link_factor)
+list_bursts = summarize_singlepulse_clusters(dict_events, labels, min_events)
+write_burst_list(list_bursts, f"{outname}_bursts.txt")
+write_burst_dm_snr(list_bursts, f"{outname}_bursts_dm_snr.txt")
+print_log(f"{len(keep)} 个事件（信噪比 >= {sigma_min}）聚为 {len(list_bursts)} 个爆发 -> {outname}_bursts.txt（{time.time() - start_time:.1f} 秒）", color=colors.OKGREEN)
+
+if list_bursts and n_top > 0:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    list_top = list_bursts[:n_top]
+    n_cols = min(4, len(list_top))
+    n_rows = int(np.ceil(len(list_top) / n_cols))
+    fig, axes = plt.subplots(n_rows, n_cols, figsize=(4 * n_cols, 3 * n_rows), squeeze=False)
+    for rank, (burst, ax) in enumerate(zip(list_top, axes.flat), 1):
+        DMs, sigmas = burst['dm_snr']
+        ax.plot(DMs, sigmas, 'k.-', markersize=3)
+        ax.axvline(burst['DM'], color='r', linestyle='--', linewidth=0.8)
+        ax.set_title(f"#{rank}  t={burst['time']:.3f} s  DM={burst['DM']:.2f}  S/N={burst['sigma']:.1f}", fontsize=8)
+        ax.set_xlabel('DM (pc cm$^{-3}$)', fontsize=8)
+        ax.set_ylabel('Sigma', fontsize=8)
+    for ax in list(axes.flat)[len(list_top):]:
+        ax.axis('off')
+    fig.tight_layout()
+    fig.savefig(f"{outname}_bursts.png", dpi=100)
+    plt.close(fig)
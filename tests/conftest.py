@@ -0,0 +1,28 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def run_in_tmp_path(tmp_path, monkeypatch):
+    """在临时目录中运行测试，print_log 写出的 logall.txt 和 00_IFOK 等不会落在仓库目录中"""
+    monkeypatch.chdir(tmp_path)
+    if 'psr_fuc' in sys.modules:
+        monkeypatch.setattr(sys.modules['psr_fuc'], 'cwd', str(tmp_path))
+
+
+@pytest.fixture
+def all_dms():
+    """方案列表中全部 DM 试验的 DM 值（最后一个方案多一个 DM），用于检查拆分前后 DM 不变"""
+    psr_fuc = pytest.importorskip("psr_fuc")
+
+    def get_all_dms(list_schemes):
+        list_dms = []
+        for i, scheme in enumerate(list_schemes):
+            list_dms += psr_fuc.get_scheme_dms(scheme, i == len(list_schemes) - 1)
+        return np.array(list_dms)
+    return get_all_dms
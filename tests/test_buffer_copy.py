@@ -0,0 +1,49 @@
+"""缓冲目录复制：校验后改名、清单记录，以及启动进程池前等待复制线程结束"""
+import json
+import os
+
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+
+def _make_sources(tmp_path, n_files=3, n_bytes=1000):
+    src_dir = tmp_path / "src"
+    buffer_dir = tmp_path / "buffer"
+    src_dir.mkdir()
+    buffer_dir.mkdir()
+    list_pairs = []
+    for k in range(n_files):
+        src = src_dir / f"obs_{k:04d}.fits"
+        src.write_bytes(bytes([k]) * n_bytes)
+        list_pairs.append((str(src), str(buffer_dir / src.name)))
+    return list_pairs, buffer_dir
+
+
+def test_copy_and_manifest(tmp_path):
+    list_pairs, buffer_dir = _make_sources(tmp_path)
+    handle = psr_fuc.start_buffer_copy(list_pairs, str(buffer_dir), 2)
+    assert psr_fuc.wait_buffer_copy(handle) == []
+    # 重复等待同一个句柄不会再次写清单
+    assert psr_fuc.wait_buffer_copy(handle) == []
+    assert psr_fuc.dict_buffer['handle'] is None and psr_fuc.dict_buffer['dir'] == ''
+
+    with open(buffer_dir / psr_fuc.buffer_manifest_name, encoding='utf-8') as f:
+        dict_manifest = json.load(f)
+    for src, dst in list_pairs:
+        assert open(src, 'rb').read() == open(dst, 'rb').read()
+        assert not os.path.exists(dst + '.part')
+        assert dict_manifest[os.path.basename(dst)]['crc32'] == psr_fuc.file_crc32(src)
+        assert psr_fuc.check_buffer_copy_done(src, dst, dict_manifest)
+
+
+def test_wait_before_fork(tmp_path):
+    list_pairs, buffer_dir = _make_sources(tmp_path)
+    handle = psr_fuc.start_buffer_copy(list_pairs, str(buffer_dir), 2)
+    assert psr_fuc.dict_buffer['handle'] is handle
+    psr_fuc.wait_buffer_copy_before_fork()
+    assert psr_fuc.dict_buffer['handle'] is None
+    assert all(os.path.isfile(dst) for _, dst in list_pairs)
+    # 主流程之后再等待同一个句柄直接返回
+    assert psr_fuc.wait_buffer_copy(handle) == []
+    psr_fuc.wait_buffer_copy_before_fork()
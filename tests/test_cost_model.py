@@ -0,0 +1,27 @@
+"""耗时模型：没有历史记录时按命令类型的先验速率预测总耗时"""
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+
+def test_first_run_gets_prior_prediction(tmp_path, monkeypatch):
+    monkeypatch.setattr(psr_fuc, 'job_store_path', None)
+    for k in range(4):
+        (tmp_path / f"src_DM{k}.00.dat").write_bytes(b"\0" * 4000 * (k + 1))
+    cmd_list = [f"realfft src_DM{k}.00.dat" for k in range(4)]
+    ifok_list = [str(tmp_path / f"real-{k}.ifok") for k in range(4)]
+    list_costs, list_seconds, n_prior = psr_fuc.predict_task_times(cmd_list, ifok_list, str(tmp_path))
+    assert n_prior == 4
+    assert list_seconds == pytest.approx([cost * psr_fuc.dict_cost_prior_rates['realfft'] for cost in list_costs])
+    list_order, predicted_makespan = psr_fuc.order_tasks_by_cost(2, 'realfft', cmd_list, ifok_list, str(tmp_path))
+    assert list_order == [3, 2, 1, 0]
+    assert predicted_makespan == pytest.approx(max(list_seconds[3] + list_seconds[0], list_seconds[2] + list_seconds[1]))
+
+
+def test_prior_scales_with_samples_when_inputs_do_not_exist_yet(tmp_path, monkeypatch):
+    monkeypatch.setattr(psr_fuc, 'job_store_path', None)
+    monkeypatch.setitem(psr_fuc.dict_obs_params, 'N_samples', 1000)
+    _, list_small, _ = psr_fuc.predict_task_times(["accelsearch -zmax 0 -numharm 8 a.fft"], [""], str(tmp_path))
+    monkeypatch.setitem(psr_fuc.dict_obs_params, 'N_samples', 4000)
+    _, list_large, _ = psr_fuc.predict_task_times(["accelsearch -zmax 0 -numharm 8 a.fft"], [""], str(tmp_path))
+    assert list_large[0] == pytest.approx(4 * list_small[0])
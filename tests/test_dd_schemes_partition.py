@@ -0,0 +1,26 @@
+"""并行去色散的方案拆分：DM 值不变，段数受 max_DMs_per_call 限制，方案内各段 DM 数均衡"""
+import numpy as np
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+
+def test_partition_keeps_dms_and_balances(all_dms):
+    list_DD_schemes = psr_fuc.get_custom_DD_schemes([(0.0, 100.0, 0.5), (100.0, 400.0, 1.0)])
+    list_parts = psr_fuc.partition_DD_schemes(list_DD_schemes, n_workers=8, max_DMs_per_call=1000, nchan=4096, nsubbands=64)
+
+    assert len(list_parts) >= 8
+    np.testing.assert_allclose(all_dms(list_parts), all_dms(list_DD_schemes))
+    for scheme in list_DD_schemes:
+        list_num_DMs = [part['num_DMs'] for part in list_parts if scheme['loDM'] <= part['loDM'] < scheme['highDM']]
+        assert sum(list_num_DMs) == scheme['num_DMs']
+        assert max(list_num_DMs) - min(list_num_DMs) <= 1
+
+
+def test_partition_limits():
+    list_DD_schemes = psr_fuc.get_custom_DD_schemes([(0.0, 300.0, 0.1)])
+    # 一个核时不拆分
+    assert psr_fuc.partition_DD_schemes(list_DD_schemes, 1, 1000, 4096) == list_DD_schemes
+    list_parts = psr_fuc.partition_DD_schemes(list_DD_schemes, 2, 500, 4096)
+    assert all(part['num_DMs'] <= 500 for part in list_parts)
+    assert sum(part['num_DMs'] for part in list_parts) == list_DD_schemes[0]['num_DMs']
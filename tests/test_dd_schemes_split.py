@@ -0,0 +1,29 @@
+"""两级去色散按名义 DM 拆分方案：DM 值不变，每段只对应一个名义 DM"""
+import numpy as np
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+
+def test_split_keeps_dms_and_groups_by_subdm(all_dms):
+    list_DD_schemes = [{'loDM': 0.0, 'highDM': 10.0, 'dDM': 0.5, 'downsamp': 1, 'num_DMs': 20},
+                       {'loDM': 10.0, 'highDM': 30.0, 'dDM': 1.0, 'downsamp': 2, 'num_DMs': 20}]
+    subdm_step = 4.0
+    list_pieces = psr_fuc.split_DD_schemes_by_subdm(list_DD_schemes, subdm_step, max_DMs_per_call=1000)
+
+    np.testing.assert_allclose(all_dms(list_pieces), all_dms(list_DD_schemes))
+    for i, piece in enumerate(list_pieces):
+        dms = psr_fuc.get_scheme_dms(piece, i == len(list_pieces) - 1)
+        # 段内每个 DM 最近的名义 DM 都是这一段的 subDM
+        assert all(np.round(dm / subdm_step) * subdm_step == piece['subDM'] for dm in dms)
+    # 方案内的分段按 DM 连续排列，名义 DM 不会回退
+    list_subdms = [piece['subDM'] for piece in list_pieces]
+    assert list_subdms == sorted(list_subdms)
+
+
+def test_split_respects_max_DMs_per_call(all_dms):
+    list_DD_schemes = [{'loDM': 0.0, 'highDM': 50.0, 'dDM': 0.1, 'downsamp': 1, 'num_DMs': 500}]
+    list_pieces = psr_fuc.split_DD_schemes_by_subdm(list_DD_schemes, 100.0, max_DMs_per_call=64)
+    assert all(piece['num_DMs'] <= 64 for piece in list_pieces)
+    assert sum(piece['num_DMs'] for piece in list_pieces) == 500
+    np.testing.assert_allclose(all_dms(list_pieces), all_dms(list_DD_schemes))
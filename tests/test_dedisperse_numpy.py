@@ -0,0 +1,26 @@
+"""numpy 去色散可复现的 PREPSUBBAND_FLAGS 和 validate 模式复核的 DM"""
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+
+def test_noclip_numout_and_ncpus_are_supported():
+    numout, list_unsupported = psr_fuc.parse_dedisperse_numpy_flags('"-ncpus 4 -noclip -numout 1000 -nobary"')
+    assert numout == 1000
+    assert list_unsupported == []
+
+
+def test_default_clip_and_zerodm_are_refused():
+    numout, list_unsupported = psr_fuc.parse_dedisperse_numpy_flags('"-ncpus 4 -zerodm"')
+    assert numout is None
+    assert '-zerodm' in list_unsupported
+    assert any(flag.startswith('-clip') for flag in list_unsupported)
+    assert psr_fuc.parse_dedisperse_numpy_flags("-clip 0")[1] == []
+
+
+def test_validate_checks_first_and_last_dm_of_every_scheme():
+    list_DD_schemes = psr_fuc.get_custom_DD_schemes([(0, 10, 0.5), (10, 20, 1.0)])
+    cmd_list, ifok_list, log_list, list_datnames = psr_fuc.dedisperse_validate2cmd("raw.fits", "src", "/tmp", "/tmp", "", "", list_DD_schemes, 64, 16, "-noclip")
+    assert len(cmd_list) == len(list_DD_schemes)
+    assert list_datnames == ["src_DM0.00.dat", "src_DM9.50.dat", "src_DM10.00.dat", "src_DM20.00.dat"]
+    assert "-subdm 4.750000" in cmd_list[0] and "-subdm 15.000000" in cmd_list[1]
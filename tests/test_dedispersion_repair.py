@@ -0,0 +1,62 @@
+"""去色散修复：连续缺失的 DM 合并为一段、按期望采样点数判断截断、跳过生命周期回收的文件"""
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+N_samples = 1000
+list_schemes = [{'loDM': 0.0, 'highDM': 5.0, 'dDM': 1.0, 'downsamp': 1, 'num_DMs': 5},
+                {'loDM': 5.0, 'highDM': 9.0, 'dDM': 2.0, 'downsamp': 2, 'num_DMs': 2}]
+
+
+def make_sizes(dict_dat_bytes):
+    dict_sizes = {}
+    for dm, dat_bytes in dict_dat_bytes.items():
+        if dat_bytes is not None:
+            dict_sizes["src_DM%.2f.dat" % dm] = dat_bytes
+            dict_sizes["src_DM%.2f.inf" % dm] = 100
+    return dict_sizes
+
+
+def complete_sizes():
+    # 最后一个方案多一个 DM（9.00）
+    return make_sizes({0.0: 4000, 1.0: 4000, 2.0: 4000, 3.0: 4000, 4.0: 4000, 5.0: 2000, 7.0: 2000, 9.0: 2000})
+
+
+def test_complete_directory_needs_no_repair():
+    list_repair, n_missing, n_total = psr_fuc.get_dedispersion_repair_schemes("unused", "src", list_schemes, N_samples, dict_sizes=complete_sizes())
+    assert list_repair == [] and n_missing == 0 and n_total == 8
+
+
+def test_contiguous_missing_trials_are_grouped():
+    dict_sizes = complete_sizes()
+    for dm in (1.0, 2.0, 4.0):
+        del dict_sizes["src_DM%.2f.dat" % dm]
+    list_repair, n_missing, _ = psr_fuc.get_dedispersion_repair_schemes("unused", "src", list_schemes, N_samples, dict_sizes=dict_sizes)
+    assert n_missing == 3
+    assert [(r['loDM'], r['highDM'], r['num_DMs']) for r in list_repair] == [(1.0, 3.0, 2), (4.0, 5.0, 1)]
+
+
+def test_truncation_threshold_uses_downsampled_length():
+    dict_sizes = complete_sizes()
+    dict_sizes["src_DM3.00.dat"] = 3996          # 少一个采样点
+    dict_sizes["src_DM7.00.dat"] = 1996          # downsamp 2：期望 500 个采样点
+    dict_sizes["src_DM9.00.dat"] = 4000          # 比期望长不算截断
+    list_repair, n_missing, _ = psr_fuc.get_dedispersion_repair_schemes("unused", "src", list_schemes, N_samples, dict_sizes=dict_sizes)
+    assert n_missing == 2
+    assert [(r['loDM'], r['downsamp'], r['num_DMs']) for r in list_repair] == [(3.0, 1, 1), (7.0, 2, 1)]
+    # -numout 指定输出长度时以该值为准
+    _, n_missing, _ = psr_fuc.get_dedispersion_repair_schemes("unused", "src", list_schemes, N_samples, other_flags="-numout 499", dict_sizes=dict_sizes)
+    assert n_missing == 0
+
+
+def test_reclaimed_datfiles_are_not_missing(tmp_path):
+    dict_sizes = complete_sizes()
+    del dict_sizes["src_DM2.00.dat"]
+    del dict_sizes["src_DM3.00.dat"]
+    manifest = tmp_path / "lifecycle_reclaimed.txt"
+    manifest.write_text(str(tmp_path / "src_DM2.00.dat") + "\n" + str(tmp_path / "other" / "src_DM3.00.dat") + "\n")
+    set_reclaimed = psr_fuc.read_lifecycle_manifest(str(manifest), str(tmp_path))
+    assert set_reclaimed == {"src_DM2.00.dat"}
+    list_repair, n_missing, _ = psr_fuc.get_dedispersion_repair_schemes("unused", "src", list_schemes, N_samples, dict_sizes=dict_sizes, set_reclaimed=set_reclaimed)
+    assert n_missing == 1
+    assert [(r['loDM'], r['num_DMs']) for r in list_repair] == [(3.0, 1)]
@@ -0,0 +1,105 @@
+"""任务数据库：旧 ifok 的导入、invalidate 之后不再导入、输入改变时任务键改变"""
+import os
+
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+
+@pytest.fixture
+def job_store(tmp_path):
+    psr_fuc.set_job_store(str(tmp_path / "jobs.sqlite"))
+    yield tmp_path
+    psr_fuc.set_job_store(None)
+
+
+def test_legacy_ifok_is_imported_only_without_a_record(job_store):
+    tmp_path = job_store
+    datfile = tmp_path / "src_DM10.00.dat"
+    datfile.write_bytes(b"\0" * 64)
+    ifok = tmp_path / "00_IFOK" / "fft-10.00.ifok"
+    ifok.parent.mkdir()
+    ifok.write_text("done")
+    cmd = f"realfft {datfile.name}"
+
+    assert psr_fuc.check_job_done(cmd, str(ifok), str(tmp_path))
+    assert psr_fuc.invalidate_jobs(cmd_like=cmd) == 1
+    # 旧 ifok 还在，但任务已被置为失效，不能再算作完成
+    assert not psr_fuc.check_job_done(cmd, str(ifok), str(tmp_path))
+    assert not psr_fuc.filter_done_tasks([cmd], [str(ifok)], str(tmp_path))[0]
+
+
+def test_job_key_changes_with_input_size_and_mtime(tmp_path):
+    datfile = tmp_path / "src_DM10.00.dat"
+    datfile.write_bytes(b"\0" * 64)
+    cmd = f"realfft {datfile.name}"
+    key_before = psr_fuc.get_job_key(cmd, str(tmp_path))
+    assert psr_fuc.get_job_key(cmd, str(tmp_path)) == key_before
+
+    datfile.write_bytes(b"\0" * 128)
+    os.utime(datfile, ns=(1, 1))
+    assert psr_fuc.get_job_key(cmd, str(tmp_path)) != key_before
+
+
+def test_inputs_rewritten_in_place_do_not_change_the_key(tmp_path):
+    fftfile = tmp_path / "src_DM10.00.fft"
+    fftfile.write_bytes(b"\0" * 64)
+    cmd = f"zapbirds -zap -zapfile birds.zaplist {fftfile.name}"
+    key_before = psr_fuc.get_job_key(cmd, str(tmp_path))
+    os.utime(fftfile, ns=(2, 2))
+    assert psr_fuc.get_job_key(cmd, str(tmp_path)) == key_before
+
+
+def test_lifecycle_removes_fft_after_search_done_in_job_store(job_store):
+    tmp_path = job_store
+    fftfile = tmp_path / "src_DM10.00.fft"
+    fftfile.write_bytes(b"\0" * 64)
+    ifok = str(tmp_path / "00_IFOK" / "search0-10.00.ifok")
+    cmd = f"accelsearch -zmax 0 {fftfile.name}"
+    psr_fuc.set_lifecycle(('.fft',))
+    psr_fuc.lifecycle_register([str(fftfile)], 'search0', [ifok])
+    try:
+        # 使用任务数据库时不写 ifok 文件，搜索完成只记录在数据库中
+        psr_fuc.record_job(psr_fuc.get_job_key(cmd, str(tmp_path)), cmd, str(tmp_path), ifok, 'running')
+        assert psr_fuc.lifecycle_collect()[0] == 0
+        psr_fuc.record_job(psr_fuc.get_job_key(cmd, str(tmp_path)), cmd, str(tmp_path), ifok, 'done')
+        assert psr_fuc.lifecycle_collect() == (1, 64)
+        assert not fftfile.exists()
+    finally:
+        psr_fuc.set_lifecycle(())
+        psr_fuc.dict_lifecycle['artifacts'].clear()
+
+
+def test_done_task_with_reclaimed_input_is_not_rerun(job_store):
+    tmp_path = job_store
+    fftfile = tmp_path / "src_DM10.00.fft"
+    fftfile.write_bytes(b"\0" * 64)
+    ifok = str(tmp_path / "00_IFOK" / "search0-10.00.ifok")
+    cmd = f"accelsearch -zmax 0 {fftfile.name}"
+    psr_fuc.record_job(psr_fuc.get_job_key(cmd, str(tmp_path)), cmd, str(tmp_path), ifok, 'done', t_start=1.0, t_end=2.0)
+
+    # .fft 被回收后任务键改变，也没有 ifok 文件，但同一命令最新的记录已完成
+    os.remove(fftfile)
+    assert psr_fuc.filter_done_tasks([cmd], [ifok], str(tmp_path)) == [True]
+    assert psr_fuc.check_job_done(cmd, ifok, str(tmp_path))
+    # 命令不同（如参数改变）时仍需重新运行
+    assert psr_fuc.filter_done_tasks([f"accelsearch -zmax 200 {fftfile.name}"], [ifok], str(tmp_path)) == [False]
+
+    psr_fuc.invalidate_jobs(cmd_like=cmd)
+    assert psr_fuc.filter_done_tasks([cmd], [ifok], str(tmp_path)) == [False]
+
+
+def test_invalidate_exact_cmd_does_not_treat_underscore_as_wildcard(job_store):
+    tmp_path = job_store
+    cmd = "prepsubband -nobary -o J1234_mask -lodm 10.0 -dmstep 0.1 -numdms 10 obs.fits"
+    cmd_other = "prepsubband -nobary -o J1234amask -lodm 10.0 -dmstep 0.1 -numdms 10 obs.fits"
+    for k, task_cmd in enumerate((cmd, cmd_other)):
+        psr_fuc.record_job(psr_fuc.get_job_key(task_cmd, str(tmp_path)), task_cmd, str(tmp_path), str(tmp_path / f"{k}.ifok"), 'done')
+
+    # LIKE 中 _ 可以匹配任意字符
+    assert psr_fuc.invalidate_jobs(cmd_like=cmd) == 2
+    for k, task_cmd in enumerate((cmd, cmd_other)):
+        psr_fuc.record_job(psr_fuc.get_job_key(task_cmd, str(tmp_path)), task_cmd, str(tmp_path), str(tmp_path / f"{k}.ifok"), 'done')
+    assert psr_fuc.invalidate_jobs(cmd=cmd) == 1
+    assert psr_fuc.check_job_done(cmd_other, str(tmp_path / "1.ifok"), str(tmp_path))
+    assert not psr_fuc.check_job_done(cmd, str(tmp_path / "0.ifok"), str(tmp_path))
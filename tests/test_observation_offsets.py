@@ -0,0 +1,68 @@
+"""拆分的 PSRFITS 文件（STT_* 相同、NSUBOFFS 不同）的起始采样点和全局偏移"""
+import struct
+import types
+
+import numpy as np
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+NSBLK = 1024
+NCHAN = 4
+TBIN = 4.9152e-5
+
+
+def fits_header(list_cards):
+    text = "".join("%-8s= %-70s" % (key, value) for key, value in list_cards) + "%-80s" % "END"
+    text += " " * (-len(text) % 2880)
+    return text.encode('ascii')
+
+
+def write_split_psrfits(path, nsuboffs, nrows=2, flag_nsuboffs_card=True):
+    """STT_* 固定、第 nsuboffs 个子积分开始的 PSRFITS 文件（只含文件头需要的列）"""
+    primary = fits_header([('SIMPLE', 'T'), ('BITPIX', '8'), ('NAXIS', '0'), ('OBSFREQ', '1250.0'),
+                           ('STT_IMJD', '60000'), ('STT_SMJD', '3600'), ('STT_OFFS', '0.0')])
+    row_bytes = 8 + 4 * NCHAN
+    list_cards = [('XTENSION', "'BINTABLE'"), ('BITPIX', '8'), ('NAXIS', '2'), ('NAXIS1', str(row_bytes)), ('NAXIS2', str(nrows)),
+                  ('PCOUNT', '0'), ('GCOUNT', '1'), ('TFIELDS', '2'), ('TTYPE1', "'OFFS_SUB'"), ('TFORM1', "'1D'"),
+                  ('TTYPE2', "'DAT_FREQ'"), ('TFORM2', "'%dE'" % NCHAN), ('EXTNAME', "'SUBINT'"), ('TBIN', repr(TBIN)),
+                  ('NCHAN', str(NCHAN)), ('NBITS', '8'), ('NSBLK', str(NSBLK)), ('CHAN_BW', '0.125')]
+    if flag_nsuboffs_card:
+        list_cards.append(('NSUBOFFS', str(nsuboffs)))
+    data = b""
+    for row in range(nrows):
+        offs_sub = (nsuboffs + row + 0.5) * NSBLK * TBIN
+        data += struct.pack('>d', offs_sub) + struct.pack('>%df' % NCHAN, *[1000.0 + 0.125 * k for k in range(NCHAN)])
+    data += b"\0" * (-len(data) % 2880)
+    with open(path, 'wb') as f:
+        f.write(primary + fits_header(list_cards) + data)
+
+
+@pytest.mark.parametrize("flag_nsuboffs_card", [True, False])
+def test_split_files_get_offsets_from_nsuboffs(tmp_path, flag_nsuboffs_card):
+    list_headers = []
+    for k, nsuboffs in enumerate([0, 2]):
+        path = str(tmp_path / f"obs_{k + 1:04d}.fits")
+        write_split_psrfits(path, nsuboffs, flag_nsuboffs_card=flag_nsuboffs_card)
+        list_headers.append(psr_fuc.read_psrfits_header(path))
+
+    assert [header['start_sample'] for header in list_headers] == [0, 2 * NSBLK]
+    assert list_headers[0]['N_samples'] == 2 * NSBLK
+    assert list_headers[1]['Tstart_MJD'] > list_headers[0]['Tstart_MJD']
+
+    list_observations = [types.SimpleNamespace(**header) for header in list_headers]
+    assert psr_fuc.get_observation_offsets(list_observations, TBIN) == [0, 2 * NSBLK]
+
+
+def test_offsets_fall_back_to_mjd_without_start_sample():
+    t_samp_s = 1.0e-3
+    list_observations = [types.SimpleNamespace(Tstart_MJD=np.float64(60000.0)),
+                         types.SimpleNamespace(Tstart_MJD=np.float64(60000.0) + 5000 * t_samp_s / 86400.)]
+    assert psr_fuc.get_observation_offsets(list_observations, t_samp_s) == [0, 5000]
+
+
+def test_identical_start_samples_fall_back_to_mjd():
+    t_samp_s = 1.0e-3
+    list_observations = [types.SimpleNamespace(start_sample=0, Tstart_MJD=np.float64(60000.0)),
+                         types.SimpleNamespace(start_sample=0, Tstart_MJD=np.float64(60000.0) + 3000 * t_samp_s / 86400.)]
+    assert psr_fuc.get_observation_offsets(list_observations, t_samp_s) == [0, 3000]
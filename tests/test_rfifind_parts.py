@@ -0,0 +1,53 @@
+"""分段 rfifind 的命令和掩模合并"""
+import numpy as np
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+NCHAN = 8
+PTSPERINT = 100
+
+
+def write_part(basename, numint, chans_per_int, zap_chans, zap_ints):
+    mask = dict(timesigma=10.0, freqsigma=4.0, mjd=60000.0, dtint=0.01, lofreq=1000.0, dfreq=1.0, numchan=NCHAN, numint=numint,
+                ptsperint=PTSPERINT, zap_chans=zap_chans, zap_ints=zap_ints, chans_per_int=chans_per_int)
+    psr_fuc.write_rfifind_mask(f"{basename}_rfifind.mask", mask)
+    with open(f"{basename}_rfifind.stats", 'wb') as f:
+        np.array([NCHAN, numint, PTSPERINT, 0, 2], dtype=np.int32).tofile(f)
+        for k in range(3):
+            (np.arange(numint * NCHAN, dtype=np.float32) + 1000 * k).tofile(f)
+    np.ones(numint * NCHAN, dtype=np.uint8).tofile(f"{basename}_rfifind.bytemask")
+    with open(f"{basename}_rfifind.inf", 'w') as f:
+        f.write(" Data file name without suffix          =  part\n Number of bins in the time series      =  250\n")
+
+
+def test_parts_cmd_zaps_the_configured_channels():
+    cmd_list, ifok_list, log_list, list_part_basenames = psr_fuc.rfifind_parts2cmd([["a.fits"], ["b.fits"]], "/out", "/log", 2.0, "10:20", "0:3")
+    assert len(cmd_list) == 2
+    assert "-zapchan 10:20" in cmd_list[0]
+    assert "-ignorechan 0:3" in cmd_list[0]
+
+
+def test_merge_places_parts_by_offset(tmp_path):
+    part0 = str(tmp_path / "p0")
+    part1 = str(tmp_path / "p1")
+    write_part(part0, 3, [[1], [2], []], [7], [2])
+    write_part(part1, 2, [[3], []], [6], [])
+    psr_fuc.merge_rfifind_parts([part0, part1], [0, 300], [300, 200], str(tmp_path), "merged", "4")
+
+    merged = psr_fuc.read_rfifind_mask(str(tmp_path / "merged_rfifind.mask"))
+    assert merged['numint'] == 5
+    assert merged['zap_chans'] == [6, 7]
+    # 第一段的第 2 个时间段整体消除，RFIFIND_TIME_INTERVALS_TO_ZAP 的第 4 个按合并后的编号消除
+    assert merged['zap_ints'] == [2, 4]
+    # 第二段的第 0 个时间段落在合并后的第 3 个时间段
+    assert 3 in merged['chans_per_int'][3]
+
+
+def test_merge_rejects_duplicate_offsets(tmp_path):
+    part0 = str(tmp_path / "p0")
+    part1 = str(tmp_path / "p1")
+    write_part(part0, 2, [[], []], [], [])
+    write_part(part1, 2, [[], []], [], [])
+    with pytest.raises(ValueError):
+        psr_fuc.merge_rfifind_parts([part0, part1], [0, 0], [200, 200], str(tmp_path), "merged")
@@ -0,0 +1,33 @@
+"""进程内单脉冲搜寻：跨越分块边界的脉冲只报告一个事件"""
+import types
+
+import numpy as np
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+
+@pytest.fixture
+def datfile(tmp_path, monkeypatch):
+    dict_infos = {}
+    monkeypatch.setattr(psr_fuc, 'infodata', types.SimpleNamespace(infodata=lambda inf_file: dict_infos[inf_file]))
+    rng = np.random.default_rng(1)
+    data = rng.normal(size=6000).astype(np.float32)
+    # 8 个采样点的脉冲跨越第 2、3 个去趋势块的边界（采样点 2000）
+    data[1996:2004] += 6.0
+    basename = str(tmp_path / "src_DM10.00")
+    data.tofile(basename + '.dat')
+    dict_infos[basename + '.inf'] = types.SimpleNamespace(dt=1e-4, DM=10.0)
+    return basename + '.dat'
+
+
+def test_pulse_across_chunk_boundary_reported_once(datfile, monkeypatch):
+    monkeypatch.setattr(psr_fuc, 'singlepulse_chunk_blocks', 100)
+    dict_whole = psr_fuc.singlepulse_search_batch([datfile], threshold=6.0, detrendlen=1000, flag_badblocks=False)
+    monkeypatch.setattr(psr_fuc, 'singlepulse_chunk_blocks', 2)
+    dict_chunked = psr_fuc.singlepulse_search_batch([datfile], threshold=6.0, detrendlen=1000, flag_badblocks=False)
+
+    list_near = [sample for sample in dict_chunked['sample'] if abs(sample - 2000) < 20]
+    assert len(list_near) == 1
+    for column in psr_fuc.list_event_columns:
+        np.testing.assert_array_equal(dict_chunked[column], dict_whole[column])
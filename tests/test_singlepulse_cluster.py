@@ -0,0 +1,36 @@
+"""单脉冲事件的朋友的朋友聚类：链接长度随局部 DM 步长变化，按真实距离判断朋友"""
+import numpy as np
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+
+def test_adjacent_trials_on_coarse_grid_form_one_burst():
+    # DM 步长为 2 时，相邻试验上的同一个脉冲应归为一个爆发
+    labels = psr_fuc.cluster_singlepulse_events(np.array([50.0, 52.0, 54.0]), np.array([10.000, 10.001, 10.002]))
+    assert len(set(labels)) == 1
+
+
+def test_dm_link_follows_local_step_across_ddplan_boundary():
+    DM_grid = np.concatenate([np.arange(90.0, 100.0, 0.5), np.arange(100.0, 120.0, 2.0)])
+    DMs = np.array([99.0, 99.5, 100.0, 102.0, 104.0, 112.0])
+    times = np.full(len(DMs), 5.0)
+    labels = psr_fuc.cluster_singlepulse_events(DMs, times, DM_grid=DM_grid)
+    # 104 到 112 之间缺了三个试验，不应连通
+    assert len(set(labels[:5])) == 1
+    assert labels[5] != labels[0]
+
+
+def test_points_in_adjacent_cells_are_not_linked_beyond_link_length():
+    # 按格子连通时 DM 0.0 与 1.99 落在相邻格子会被连通，实际距离超过链接长度
+    labels = psr_fuc.cluster_singlepulse_events(np.array([0.0, 1.99]), np.array([1.0, 1.0]), dm_link=1.0)
+    assert labels[0] != labels[1]
+    labels = psr_fuc.cluster_singlepulse_events(np.array([0.0, 0.9, 1.8]), np.array([1.0, 1.0, 1.0]), dm_link=1.0)
+    assert len(set(labels)) == 1
+
+
+def test_separate_times_give_separate_bursts():
+    DMs = np.array([50.0, 52.0, 50.0, 52.0])
+    times = np.array([1.0, 1.0, 3.0, 3.0])
+    labels = psr_fuc.cluster_singlepulse_events(DMs, times)
+    assert labels[0] == labels[1] and labels[2] == labels[3] and labels[0] != labels[2]
@@ -0,0 +1,19 @@
+"""存储规划：去轨道调制模板库按 模板 × DM 计入各步骤"""
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+list_schemes = [{'loDM': 0.0, 'highDM': 10.0, 'dDM': 0.5, 'downsamp': 1, 'num_DMs': 20}]
+dict_args = dict(list_DDplan_scheme=list_schemes, N_samples=2**20, t_samp_s=1e-4, nchan=4096, rfifind_time_s=2.0, n_zmax=1, ifdeorb=1)
+
+
+def test_deorb_bank_scales_storage_with_templates():
+    plan_1 = psr_fuc.plan_storage(**dict_args)
+    plan_8 = psr_fuc.plan_storage(n_deorb_templates=8, **dict_args)
+    dat_bytes = 20 * 4 * 2**20
+    dict_delta_1 = {name: delta for name, delta, _, _ in plan_1['stages']}
+    dict_delta_8 = {name: delta for name, delta, _, _ in plan_8['stages']}
+    assert dict_delta_8['deorb'] >= 8 * dat_bytes
+    assert dict_delta_8['realfft'] >= 8 * dat_bytes
+    assert plan_8['peak_bytes'] > plan_1['peak_bytes'] + 7 * 2 * dat_bytes
+
@@ -0,0 +1,31 @@
+"""子进程输出流式写入日志：跨块的多字节字符和结尾不完整的字符"""
+import subprocess
+import sys
+
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+
+def _run(tmp_path, script, monkeypatch, chunk_bytes=None):
+    if chunk_bytes:
+        monkeypatch.setattr(psr_fuc, 'stream_chunk_bytes', chunk_bytes)
+    proc = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    log_path = tmp_path / 'LOG.txt'
+    with open(log_path, 'w', encoding='utf-8') as log_handle:
+        tail = psr_fuc.stream_process_output(proc, log_handle)
+    proc.wait()
+    return log_path.read_text(encoding='utf-8'), tail
+
+
+def test_multibyte_split_between_chunks(tmp_path, monkeypatch):
+    script = "import sys; sys.stdout.buffer.write('脉冲星搜索'.encode('utf-8'))"
+    log_text, tail = _run(tmp_path, script, monkeypatch, chunk_bytes=1)
+    assert log_text == '脉冲星搜索'
+    assert tail == '脉冲星搜索'
+
+
+def test_truncated_character_flushed_at_eof(tmp_path, monkeypatch):
+    script = "import sys; sys.stdout.buffer.write('done 星'.encode('utf-8')[:-1])"
+    log_text, _ = _run(tmp_path, script, monkeypatch)
+    assert log_text == 'done �'
@@ -0,0 +1,29 @@
+"""子带文件标识：掩模和原始数据的大小、修改时间改变时标识随之改变"""
+import os
+
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+
+def test_signature_changes_with_mask_and_input_contents(tmp_path):
+    rawfile = tmp_path / "obs_0001.fits"
+    rawfile.write_bytes(b"\0" * 100)
+    maskfile = tmp_path / "obs_rfifind.mask"
+    maskfile.write_bytes(b"\0" * 10)
+    args = (str(tmp_path / "obs_*.fits"), str(maskfile), "", 64)
+    signature = psr_fuc.get_subband_signature(*args)
+    assert psr_fuc.get_subband_signature(*args) == signature
+
+    maskfile.write_bytes(b"\1" * 12)
+    signature_mask = psr_fuc.get_subband_signature(*args)
+    assert signature_mask != signature
+
+    os.utime(rawfile, ns=(1, 1))
+    signature_raw = psr_fuc.get_subband_signature(*args)
+    assert signature_raw != signature_mask
+
+    (tmp_path / "obs_0002.fits").write_bytes(b"\0" * 100)
+    signature_two = psr_fuc.get_subband_signature(*args)
+    assert signature_two != signature_raw
+    assert psr_fuc.get_subband_signature(str(tmp_path / "obs_*.fits"), str(maskfile), "", 32) != signature_two
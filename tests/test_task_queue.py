@@ -0,0 +1,106 @@
+"""多节点任务队列：领取时的核数/内存预算和队首预留"""
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+
+@pytest.fixture
+def task_queue(tmp_path, monkeypatch):
+    queue_path = str(tmp_path / "queue.sqlite")
+    monkeypatch.setitem(psr_fuc.dict_execution_backend, 'queue_path', queue_path)
+    monkeypatch.setitem(psr_fuc.dict_resource_budget, 'cpus', 8)
+    monkeypatch.setitem(psr_fuc.dict_resource_budget, 'mem_bytes', 0)
+    conn = psr_fuc.connect_task_queue(queue_path)
+    yield conn
+    conn.close()
+
+
+def submit(conn, list_ncpus):
+    for k, ncpus in enumerate(list_ncpus):
+        conn.execute("INSERT INTO tasks (batch, cmd, status, ncpus, mem_bytes) VALUES ('b', ?, 'pending', ?, 0)", (f"task{k}", ncpus))
+
+
+def test_claim_respects_cpu_budget(task_queue):
+    submit(task_queue, [6, 6, 2])
+    assert psr_fuc.queue_claim(task_queue, "w1")[1] == "task0"
+    # task1 放不下，回填 task2
+    assert psr_fuc.queue_claim(task_queue, "w2")[1] == "task2"
+    assert psr_fuc.queue_claim(task_queue, "w3") is None
+
+
+def test_head_of_queue_is_reserved_after_repeated_skips(task_queue, monkeypatch):
+    monkeypatch.setattr(psr_fuc, 'admit_max_skips', 2)
+    submit(task_queue, [6, 8, 1, 1, 1, 1])
+    assert psr_fuc.queue_claim(task_queue, "w0")[1] == "task0"
+    assert psr_fuc.queue_claim(task_queue, "w1")[1] == "task2"
+    assert psr_fuc.queue_claim(task_queue, "w2")[1] == "task3"
+    # task1 已被越过两次，不再回填，等待资源释放
+    assert psr_fuc.queue_claim(task_queue, "w3") is None
+    task_queue.execute("UPDATE tasks SET status = 'done' WHERE status = 'running'")
+    assert psr_fuc.queue_claim(task_queue, "w4")[1] == "task1"
+
+
+@pytest.fixture
+def worker_env(tmp_path, monkeypatch):
+    # run_cmd 在 cwd/00_IFOK 下写 rm 脚本，指向临时目录
+    monkeypatch.setattr(psr_fuc, 'cwd', str(tmp_path))
+    monkeypatch.setattr(psr_fuc, 'job_store_path', None)
+    monkeypatch.setitem(psr_fuc.dict_execution_backend, 'heartbeat_s', 0.2)
+    monkeypatch.setitem(psr_fuc.dict_task_retry, 'max_retries', 0)
+    return tmp_path
+
+
+def start_workers(queue_path, n_workers, batch, idle_exit_s=0):
+    list_workers = [psr_fuc.Process(target=psr_fuc.queue_worker, args=(queue_path, f"w{k}", idle_exit_s, batch)) for k in range(n_workers)]
+    for worker in list_workers:
+        worker.start()
+    return list_workers
+
+
+def test_two_workers_claim_each_task_once(task_queue, worker_env):
+    tmp_path = worker_env
+    n_tasks = 8
+    cmd_list = [f"sleep 0.2 && echo {k} >> out_{k}.txt" for k in range(n_tasks)]
+    ifok_list = [str(tmp_path / f"ok-{k}.ifok") for k in range(n_tasks)]
+    log_list = [str(tmp_path / f"LOG_{k}.txt") for k in range(n_tasks)]
+    psr_fuc.queue_submit('two', cmd_list, ifok_list, log_list, str(tmp_path))
+    list_workers = start_workers(psr_fuc.dict_execution_backend['queue_path'], 2, 'two')
+    for worker in list_workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+    rows = task_queue.execute("SELECT status, attempts, worker FROM tasks WHERE batch = 'two'").fetchall()
+    assert [(status, attempts) for status, attempts, _ in rows] == [('done', 1)] * n_tasks
+    assert set(worker for _, _, worker in rows) <= {"w0", "w1"}
+    # 每个任务只执行了一次
+    for k in range(n_tasks):
+        assert (tmp_path / f"out_{k}.txt").read_text().split() == [str(k)]
+
+
+def test_running_task_sends_heartbeat(task_queue, worker_env):
+    tmp_path = worker_env
+    psr_fuc.queue_submit('hb', ["sleep 1.5"], [str(tmp_path / "ok-hb.ifok")], [str(tmp_path / "LOG_hb.txt")], str(tmp_path))
+    list_workers = start_workers(psr_fuc.dict_execution_backend['queue_path'], 1, 'hb')
+    psr_fuc.time.sleep(1.0)
+    t_start, heartbeat, status = task_queue.execute("SELECT t_start, heartbeat, status FROM tasks WHERE batch = 'hb'").fetchone()
+    assert status == 'running'
+    assert heartbeat > t_start
+    for worker in list_workers:
+        worker.join(60)
+    assert task_queue.execute("SELECT status FROM tasks WHERE batch = 'hb'").fetchone()[0] == 'done'
+
+
+def test_lost_task_is_requeued_and_finished_by_another_worker(task_queue, worker_env):
+    tmp_path = worker_env
+    psr_fuc.queue_submit('lost', ["echo ok > out_lost.txt", "echo ok > out_dead.txt"], [str(tmp_path / "ok-lost.ifok"), str(tmp_path / "ok-dead.ifok")],
+                         [str(tmp_path / "LOG_lost.txt"), str(tmp_path / "LOG_dead.txt")], str(tmp_path))
+    # 两个任务都被已经退出的 worker 领取，心跳早已停止；第二个已用尽尝试次数
+    task_queue.execute("UPDATE tasks SET status = 'running', worker = 'dead', host = 'elsewhere', attempts = 1, heartbeat = 0 WHERE batch = 'lost'")
+    task_queue.execute("UPDATE tasks SET attempts = 3 WHERE cmd LIKE '%out_dead%'")
+    assert psr_fuc.queue_requeue_lost(task_queue, heartbeat_timeout=1, max_attempts=3) == 1
+    list_workers = start_workers(psr_fuc.dict_execution_backend['queue_path'], 2, 'lost')
+    for worker in list_workers:
+        worker.join(60)
+    dict_rows = {cmd: (status, attempts) for cmd, status, attempts in task_queue.execute("SELECT cmd, status, attempts FROM tasks WHERE batch = 'lost'")}
+    assert dict_rows["echo ok > out_lost.txt"] == ('done', 2)
+    assert dict_rows["echo ok > out_dead.txt"][0] == 'failed'
+    assert (tmp_path / "out_lost.txt").exists() and not (tmp_path / "out_dead.txt").exists()
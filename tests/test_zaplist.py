@@ -0,0 +1,38 @@
+"""zaplist 的读取（含质心系的 B 行）和干扰频率的消除"""
+import numpy as np
+import pytest
+
+psr_fuc = pytest.importorskip("psr_fuc")
+
+
+def write_zaplist(path):
+    with open(path, 'w') as f:
+        f.write("# Freq  Width\n")
+        f.write("50.0    0.5\n")
+        f.write("########################################\n")
+        f.write("# 脉冲星 J0000+0000 \n")
+        f.write("B   30.00000000000000   0.01000000000000000\n")
+
+
+def test_barycentric_lines_are_converted_to_topocentric(tmp_path):
+    zapfile = str(tmp_path / "birds.zaplist")
+    write_zaplist(zapfile)
+    baryv = 1.0e-4
+    list_birds = psr_fuc.read_zaplist(zapfile, baryv)
+    assert list_birds[0] == (50.0, 0.5)
+    assert list_birds[1] == pytest.approx((30.0 * (1 + baryv), 0.01 * (1 + baryv)))
+
+
+def test_barycentric_birdie_is_zapped(tmp_path):
+    zapfile = str(tmp_path / "birds.zaplist")
+    write_zaplist(zapfile)
+    T_s = 1000.0
+    baryv = 1.0e-4
+    rng = np.random.default_rng(1)
+    spectrum = (rng.normal(size=100000) + 1j * rng.normal(size=100000)).astype(np.complex64)
+    spike_bin = int(round(30.0 * (1 + baryv) * T_s))
+    spectrum[spike_bin] = 1000.0
+
+    n_zapped = psr_fuc.zap_birdies(spectrum, T_s, psr_fuc.read_zaplist(zapfile, baryv))
+    assert n_zapped > 0
+    assert abs(spectrum[spike_bin]) < 10.0